@@ -0,0 +1,222 @@
+# This code benchmarks every stage of the simulation pipeline on synthetic raw USGS flow and weather files (see
+# synthetic), at a configurable record length and number of sites: raw ingest, time zone conversion (USGS time zone
+# codes to UTC as in Hydro_1_LocalTimetoUTC_Convert, then to the site zone), resampling/interpolation to 1 minute, turbine conversion, pvlib chain, step energy, battery loop and result writing. Every stage reports its best
+# time over the repeats, its throughput (minutes of 1-minute record simulated per second) and its peak memory (Python
+# and NumPy allocations, tracemalloc). The report is written as JSON and compared with a saved baseline, stages slower
+# than the tolerance are reported as regressions (exit code 1)
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import turbine
+import battery
+import timeseries
+import site_store
+import synthetic
+import Hydro_1_LocalTimetoUTC_Convert
+
+
+now = datetime.datetime.now()
+
+# Version of the stage definitions, reports of other versions are not compared (2: the time zone conversion stage
+# converts raw USGS records)
+BENCHMARK_VERSION = 2
+
+STAGES = ['raw_ingest', 'timezone_conversion', 'resampling', 'turbine_conversion', 'pvlib_chain', 'step_energy',
+          'battery_loop', 'result_writing']
+
+
+# Best time (seconds) of function over the repeats and peak memory (bytes) of one more traced call, with its result
+def measure(function, repeat):
+
+    best = np.inf
+    for r in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, best, peak
+
+
+# Runs every stage on the synthetic files of one site; returns the stage timings and peak memory, and the minutes of
+# the 1-minute grid
+def benchmark_site(flow_file, weather_file, store_dir, site, time_zone, latitude, longitude, params, repeat):
+
+    # pvlib is only needed by the PV model of the solar simulations, loaded before any timing
+    import SolarPVLib_Simulations
+    if SolarPVLib_Simulations.module is None:
+        SolarPVLib_Simulations.load_components()
+
+    stages = {}
+    T_threshold = 24 * 60
+
+    # Raw ingest (as Hydro_1_LocalTimetoUTC_Convert and site_store.solar_minutes)
+    def raw_ingest():
+        return (Hydro_1_LocalTimetoUTC_Convert.read_raw_file(flow_file),
+                pd.read_csv(weather_file, encoding="ISO-8859-1", dtype={'site_no': str}))
+    (flow_raw, weather_raw), *stages['raw_ingest'] = measure(raw_ingest, repeat)
+
+    # Time zone conversion of the local flow records with their USGS time zone codes to UTC (then to the site zone, as
+    # site_store.hydro_samples) and of the local standard time weather records
+    def timezone_conversion():
+        timestamp = Hydro_1_LocalTimetoUTC_Convert.to_utc(flow_raw['str_timestamp'], flow_raw['tz'])
+        flow = flow_raw[['flow']].assign(timestamp=timestamp.dt.tz_convert(time_zone)).dropna(subset=['timestamp'])
+        flow = flow.sort_values(by='timestamp', ascending=True, kind='stable')
+        weather = weather_raw.assign(Date_Time=(pd.to_datetime(weather_raw['Date_Time']) +
+                                                pd.Timedelta(site_store.timezone_translator_toUTCminusLocaltime(time_zone))
+                                                ).dt.tz_localize('UTC').dt.tz_convert(time_zone))
+        return flow.set_index('timestamp'), weather.set_index('Date_Time')
+    (flow, weather), *stages['timezone_conversion'] = measure(timezone_conversion, repeat)
+
+    # Resampling and interpolation to 1 minute
+    def resampling():
+        return (flow.resample('1min').interpolate(method='linear'),
+                weather.resample('1min').interpolate(method='linear'))
+    (interpolated, interpolated_weather), *stages['resampling'] = measure(resampling, repeat)
+    minutes = timeseries.minute_offsets(interpolated.index)
+    weather_minutes = timeseries.minute_offsets(interpolated_weather.index)
+
+    # Turbine conversion
+    def turbine_conversion():
+        return 2 * turbine.waterlilyv2_power(interpolated['flow']) #Use two WaterLily
+    gen_power, *stages['turbine_conversion'] = measure(turbine_conversion, repeat)
+
+    # pvlib chain, without the solar geometry cache
+    def pvlib_chain():
+        return SolarPVLib_Simulations.module_dc_power(interpolated_weather, latitude, longitude, 0, geometry_cache=None)
+    dc_power, *stages['pvlib_chain'] = measure(pvlib_chain, repeat)
+
+    # Step energy of the hydro and solar power
+    def step_energy():
+        return (timeseries.step_energy(minutes, gen_power, T_threshold, verbose=False),
+                timeseries.step_energy(weather_minutes, dc_power, T_threshold, verbose=False))
+    (hydro_energy, solar_energy), *stages['step_energy'] = measure(step_energy, repeat)
+
+    # Battery simulation of the hydro and solar harvest
+    def battery_loop():
+        return (battery.simulate(gen_power / 60.0, params, minutes=minutes),
+                battery.simulate(dc_power / 60.0, params, minutes=weather_minutes))
+    (hydro_result, solar_result), *stages['battery_loop'] = measure(battery_loop, repeat)
+
+    # Result writing: 1-minute series to the site store and result table
+    def result_writing():
+        site_store.write_site('hydro_' + site, interpolated.assign(gen_power=gen_power), store_dir)
+        site_store.write_site('solar_' + site, interpolated_weather.assign(dc_power=dc_power), store_dir)
+        pd.DataFrame({'site_no': [site],
+                      'AveEner_Hydro': [hydro_energy.average_energy],
+                      'PerOfftime_Hydro': [100 * hydro_result.fraction_sampleloss],
+                      'PerjoulOvFl_Hydro': [hydro_result.fraction_overflow],
+                      'AveEner_solar': [solar_energy.average_energy],
+                      'PerOfftime_solar': [100 * solar_result.fraction_sampleloss],
+                      'PerjoulOvFl_solar': [solar_result.fraction_overflow]}).to_csv(
+            os.path.join(store_dir, 'Benchmark_' + site + '.csv'), sep=',')
+    result, *stages['result_writing'] = measure(result_writing, repeat)
+
+    return stages, len(interpolated)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of every stage of the simulation pipeline on synthetic data')
+    parser.add_argument('--days', type=float, default=365,
+                        help='record length of every site in days (default: 365)')
+    parser.add_argument('--sites', type=int, default=1,
+                        help='number of synthetic sites (default: 1)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs of every stage, the best one is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic data of the first site (default: 0)')
+    parser.add_argument('--output', default=os.path.join('./', 'results/Benchmark.json'),
+                        help='report file (default: results/Benchmark.json)')
+    parser.add_argument('--baseline', default=os.path.join('./', 'results/Benchmark_Baseline.json'),
+                        help='baseline report the run is compared with (default: results/Benchmark_Baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save this run as the baseline instead of comparing with it')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown of a stage reported as a regression (default: 0.25)')
+    args = parser.parse_args()
+
+    # pvlib version of the report
+    import pvlib
+
+    params = battery.default_params(5)
+    # Compiles the battery kernel (if numba is installed) before any timing
+    battery.simulate(np.zeros(10), params)
+
+    totals = {stage: {'seconds': 0.0, 'peak_memory': 0} for stage in STAGES}
+    total_minutes = 0
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(args.sites):
+            site = 'synthetic{:02d}'.format(i)
+            latitude, longitude, time_zone = 35.0 + (i % 10), -85.0 - (i % 10), 'US/Eastern'
+
+            # Synthetic raw files, written before the timings
+            flow_file = os.path.join(folder, site + '_72255.txt')
+            weather_file = os.path.join(folder, 'concatenate_' + site + '.csv')
+            synthetic.write_raw_flow(synthetic.synthetic_raw_flow(args.days, seed=args.seed + i, time_zone=time_zone,
+                                                                  site_no=site), flow_file)
+            synthetic.synthetic_weather(args.days, seed=args.seed + i, latitude=latitude).to_csv(weather_file, index=False)
+
+            stages, site_minutes = benchmark_site(flow_file, weather_file, os.path.join(folder, 'store'), site,
+                                                  time_zone, latitude, longitude, params, args.repeat)
+            for stage, (seconds, peak) in stages.items():
+                totals[stage]['seconds'] += seconds
+                totals[stage]['peak_memory'] = max(totals[stage]['peak_memory'], peak)
+            total_minutes += site_minutes
+            print("Site " + site + " benchmarked (" + str(i + 1) + " of " + str(args.sites) + ")")
+
+    report = {'config': {'version': BENCHMARK_VERSION, 'days': args.days, 'sites': args.sites, 'repeat': args.repeat, 'seed': args.seed,
+                         'minutes': total_minutes, 'date': now.isoformat(timespec='seconds'),
+                         'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                         'pvlib': pvlib.__version__, 'numba_jit': battery.JIT, 'cpus': os.cpu_count()},
+              'stages': {stage: {'seconds': totals[stage]['seconds'],
+                                 'minutes_per_second': total_minutes / max(totals[stage]['seconds'], 1e-12),
+                                 'peak_memory_mb': totals[stage]['peak_memory'] / 2**20}
+                         for stage in STAGES}}
+
+    print("\n{:<22}{:>12}{:>20}{:>16}".format('Stage', 'Seconds', 'Minutes/second', 'Peak MB'))
+    for stage, metrics in report['stages'].items():
+        print("{:<22}{:>12.4f}{:>20.4g}{:>16.1f}".format(stage, metrics['seconds'], metrics['minutes_per_second'],
+                                                          metrics['peak_memory_mb']))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("\nBaseline saved to " + args.baseline)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if any(baseline['config'].get(key) != report['config'][key] for key in ['version', 'days', 'sites', 'seed']):
+            print("\nBaseline " + args.baseline + " was run with another benchmark version, days, sites or seed, not compared")
+        else:
+            print("\n{:<22}{:>12}{:>12}".format('Stage', 'Baseline', 'Ratio'))
+            for stage, metrics in report['stages'].items():
+                if stage not in baseline['stages']:
+                    continue
+                ratio = metrics['seconds'] / max(baseline['stages'][stage]['seconds'], 1e-12)
+                flag = '  REGRESSION' if ratio > 1 + args.tolerance else ''
+                print("{:<22}{:>12.4f}{:>12.2f}{}".format(stage, baseline['stages'][stage]['seconds'], ratio, flag))
+                if flag:
+                    regressions.append(stage)
+
+    print('Time spent to benchmark: ', datetime.datetime.now() - now)
+
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,180 @@
+# This code computes, for every USGS site, the distribution of the sample loss and of the overflow when the turbine, PV
+# and battery constants are uncertain (see ensemble): every member of the ensemble draws its own turbine and PV factors,
+# canopy factor and battery efficiencies, and the per-site percentiles of the metrics are written
+import os
+import math
+import argparse
+import datetime
+import collections
+import numpy as np
+import pandas as pd
+import turbine
+import battery
+import timeseries
+import parallel
+import site_store
+import canopy
+import scenarios
+import ensemble
+
+
+now = datetime.datetime.now()
+
+# Uncertain harvest factors, multiplying the nominal harvest of the sources listed in SOURCE_FACTORS
+FACTORS = {'turbine': ensemble.triangular(0.8, 1.0, 1.1),  # Water Lily output against the fitted transfer function
+           'pv': ensemble.normal(1.0, 0.05, low=0.0),  # PV module efficiency against the Sandia model
+           'canopy': ensemble.uniform(0.5, 1.5)}  # deciduous canopy shading factors against the monthly estimate
+SOURCE_FACTORS = {'waterlily': ['turbine'], 'pv': ['pv'], 'pv_deciduous': ['pv', 'canopy']}
+
+# Uncertain battery parameters (the other ones keep the values of battery.default_params)
+BATTERY = {'nbat_in': ensemble.uniform(0.85, 0.95),  # battery's charge efficiency
+           'nbat_out': ensemble.uniform(0.65, 0.75),  # battery's discharge efficiency
+           'ncc': ensemble.uniform(0.85, 0.95)}  # charge controller efficiency
+
+# Nominal scenarios (see SolarReducedSolarHydroAndCombined_Simulations), the solar ones need the SolarAnywhere data
+HYDRO_SCENARIOS = [scenarios.Scenario('Hydro only', {'waterlily': 2.0})]  # Use two WaterLily
+SOLAR_SCENARIOS = [scenarios.Scenario('Solar without any tree canopy', {'pv': 1.0}),
+                   scenarios.Scenario('Solar with tree canopy (decidouos)', {'pv_deciduous': 1.0}),
+                   scenarios.Scenario('Hydro + reduced Solar (deciduous tree canopy)', {'waterlily': 2.0, 'pv_deciduous': 1.0})]
+
+# Deciduous canopy shading factor on the first day of each month, Jan:Dec (see SolarReducedSolarHydroAndCombined_Simulations)
+MONTHLY_REDUCTION = [0.45, 0.45, 0.45, 0.45, 0.25, 0.14, 0.08, 0.07, 0.05, 0.08, 0.25, 0.45]
+
+# Harvest sources of the last sites read by this worker process, reused by the next batches of members of the site
+_site_sources = collections.OrderedDict()
+
+
+# Power (W) of the harvest sources of a site, each one on its own 1-minute grid (the solar and hydro records do not
+# cover the same period, see scenarios)
+def site_sources(site_no, USGS_site_file, time_zone, latitude, longitude, with_solar):
+
+    if site_no in _site_sources:
+        return _site_sources[site_no]
+
+    # 1-minute flow of the 2010-2014 period, preprocessed once in the site store
+    interpolated = site_store.load_hydro(USGS_site_file, time_zone, verbose=True)
+    sources = {'waterlily': pd.Series(turbine.waterlilyv2_power(interpolated['flow']), index=interpolated.index,
+                                      name='waterlily')}
+
+    if with_solar:
+        # pvlib is only needed with the solar sources
+        import SolarPVLib_Simulations
+        if SolarPVLib_Simulations.module is None:
+            SolarPVLib_Simulations.load_components()
+
+        weather = site_store.load_solar(site_no, time_zone, verbose=True)
+        dc_power = SolarPVLib_Simulations.module_dc_power(weather, latitude, longitude, 0)
+        reduction = canopy.get_profile(weather.index, canopy.monthly_anchors(MONTHLY_REDUCTION), years=range(2010, 2016, 1))
+        sources['pv'] = pd.Series(dc_power, index=weather.index, name='pv')
+        sources['pv_deciduous'] = pd.Series(dc_power * reduction, index=weather.index, name='pv_deciduous')
+
+    _site_sources.clear()
+    _site_sources[site_no] = sources
+
+    return _site_sources[site_no]
+
+
+# Sample loss and overflow of a range of members for every scenario of a site. Each scenario runs on the minutes
+# shared by its sources, the scenarios on the same grid are simulated in one pass per batch
+def simulate_members(site_no, USGS_site_file, time_zone, latitude, longitude, with_solar, scenario_list, members,
+                     batch_size, verify=False):
+
+    sources = site_sources(site_no, USGS_site_file, time_zone, latitude, longitude, with_solar)
+
+    n_members = len(members.params.eload_setup)
+    results = {}
+    for index, positions in scenarios.scenario_grids(sources, scenario_list):
+        grid_scenarios = [scenario_list[s] for s in positions]
+        source_names = [name for name in sources if any(name in scenario.weights for scenario in grid_scenarios)]
+        power = scenarios.source_matrix(sources, source_names, index)
+
+        weights = np.vstack([ensemble.member_weights(scenario.weights, SOURCE_FACTORS, source_names, members)
+                             for scenario in grid_scenarios])
+        params = battery.BatteryParams(*[np.tile(field, len(grid_scenarios)) for field in members.params])
+
+        result = ensemble.simulate_members(power, weights, params, minutes=timeseries.minute_offsets(index),
+                                           batch_size=batch_size, verify=verify)
+
+        for s, scenario in enumerate(grid_scenarios):
+            results[scenario.name] = (result.fraction_sampleloss[s * n_members:(s + 1) * n_members],
+                                      result.fraction_overflow[s * n_members:(s + 1) * n_members])
+
+    return {scenario.name: results[scenario.name] for scenario in scenario_list}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Monte Carlo ensembles of the USGS sites over the uncertain turbine, '
+                                                 'PV and battery constants')
+    parser.add_argument('--members', type=int, default=1000,
+                        help='number of members of the ensemble (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the draws, the same members are used for every site (default: 0)')
+    parser.add_argument('--sampling-interval', type=float, default=5,
+                        help='minutes between two samples (default: 5)')
+    parser.add_argument('--communication-interval', type=float, default=None,
+                        help='minutes between two communications (default: every 24 samples)')
+    parser.add_argument('--percentiles', type=float, nargs='+', default=list(ensemble.PERCENTILES),
+                        help='percentiles of the metrics written for every site (default: 5 50 95)')
+    parser.add_argument('--batch-size', type=int, default=ensemble.ENSEMBLE_BATCH,
+                        help='members simulated in one pass over the harvest (default: ' + str(ensemble.ENSEMBLE_BATCH) + ')')
+    parser.add_argument('--solar', action='store_true',
+                        help='add the PV and canopy-reduced PV scenarios (needs the SolarAnywhere data)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs, 1 runs serially)')
+    parser.add_argument('--verify', action='store_true',
+                        help='check every member against its own battery.simulate_batch run (one pass per member)')
+    args = parser.parse_args()
+
+    Site_IDCoordinates_file = os.path.join(site_store.DATA_DIR, 'USGS_Sites_12_10_2019_42sites_INFOandMissingReportMerged.csv')
+    df_ = pd.read_csv(Site_IDCoordinates_file, encoding="ISO-8859-1", dtype={'site_no': str},
+                      usecols=[0, 1, 2, 3, 4, 5, 6, 9, 10, 11])
+
+    params = battery.default_params(args.sampling_interval, args.communication_interval)
+    members = ensemble.draw_members(args.members, FACTORS, params, BATTERY, seed=args.seed)
+    scenario_list = HYDRO_SCENARIOS + (SOLAR_SCENARIOS if args.solar else [])
+
+    sites = {}
+    for i, row in df_.iterrows():
+        USGS_site_file = 'time_zone_converted_' + row['site_no'] + '_72255.txt'
+        if not os.path.isfile(os.path.join(site_store.HYDRO_DIR, USGS_site_file)):
+            continue
+        if args.solar and not os.path.isfile(os.path.join(site_store.SOLAR_DIR, 'concatenate_' + row['site_no'] + '.csv')):
+            continue
+        # TODO: Altitude must be corrected from USGS website
+        sites[row['site_no']] = (USGS_site_file, row['Time_zone'], round(float(row['dec_lat_va']), 3),
+                                 round(float(row['dec_long_va']), 3))
+
+    # Members of a site are split in as many parts as needed to keep every worker busy (the sources of a site are then
+    # computed once per part)
+    workers = args.workers or os.cpu_count() or 1
+    parts = max(1, math.ceil(workers / max(len(sites), 1)))
+    bounds = [int(bound) for bound in np.linspace(0, args.members, min(parts, args.members) + 1)]
+    site_args = {}
+    for site_no, (USGS_site_file, time_zone, latitude, longitude) in sites.items():
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            part = ensemble.Members({name: values[first:last] for name, values in members.factors.items()},
+                                    battery.BatteryParams(*[field[first:last] for field in members.params]))
+            site_args[(site_no, first)] = (site_no, USGS_site_file, time_zone, latitude, longitude, args.solar,
+                                           scenario_list, part, args.batch_size, args.verify)
+
+    print('Simulation of ' + str(args.members) + ' members has begun...')
+    results = parallel.map_sites(simulate_members, site_args, workers=args.workers)
+
+    columns = (['site_no', 'Scenario', 'Members'] + ['PerOfftime_P{:g}'.format(q) for q in args.percentiles] +
+               ['PerjoulOvFl_P{:g}'.format(q) for q in args.percentiles])
+    rows = []
+    for site_no in sites:
+        if not all((site_no, first) in results for first in bounds[:-1]):
+            continue
+        for scenario in scenario_list:
+            sampleloss = np.concatenate([results[(site_no, first)][scenario.name][0] for first in bounds[:-1]])
+            overflow = np.concatenate([results[(site_no, first)][scenario.name][1] for first in bounds[:-1]])
+            rows.append([site_no, scenario.name, len(sampleloss)] +
+                        list(ensemble.percentiles(100 * sampleloss, args.percentiles).values()) +
+                        list(ensemble.percentiles(overflow, args.percentiles).values()))
+
+    df_[['site_no', 'station_nm']].merge(pd.DataFrame(rows, columns=columns), on='site_no').to_csv(
+        os.path.join('./', 'results/Ensemble_Simulation.csv'), sep=',')
+
+    print('Time spent to simulate all sites: ', datetime.datetime.now() - now)
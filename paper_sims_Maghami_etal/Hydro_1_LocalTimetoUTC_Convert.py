@@ -3,7 +3,6 @@ import os
 import datetime
 import numpy as np
 import pandas as pd
-import datetime
 
 
 now = datetime.datetime.now()
@@ -24,28 +23,57 @@ def timezone_translator(tz):
     }.get(tz, None)
 
 
-# Search for all flow data files in the folder (txt files)
-Data_files = [f for f in os.listdir('./data_files/Hydro_data_files/Raw_data') if
-              os.path.isfile(os.path.join('./data_files/Hydro_data_files/Raw_data', f)) and 'txt' in f]
+def utc_offset(tz):
+    # Hours to add to the local time of the tz code to get UTC ('Etc/GMT+5' is 5 hours behind UTC)
+    etc_zone = timezone_translator(tz)
+    if etc_zone is None:
+        return None
+    return pd.Timedelta(hours=int(etc_zone.replace('Etc/GMT', '')))
+
+
+def to_utc(str_timestamp, tz):
+    # Parses all local timestamps at once and shifts each group of records sharing a tz code by its offset
+    local = pd.to_datetime(str_timestamp, format='%Y-%m-%d %H:%M')
+    offsets = pd.Series(pd.NaT, index=str_timestamp.index, dtype='timedelta64[ns]')
+    for tz_code, rows in tz.groupby(tz).groups.items():
+        offset = utc_offset(tz_code)
+        if offset is None:
+            print("Unknown time zone code " + str(tz_code) + ", " + str(len(rows)) + " records skipped")
+            continue
+        offsets.loc[rows] = offset
+
+    return (local + offsets).dt.tz_localize('UTC')
+
 
-Data_files = os.path
+# Records of a raw USGS file (tab separated, after its 30 line header)
+def read_raw_file(path):
+    return pd.read_csv(path, delimiter='\t', skiprows=30,
+                       names=['agency', 'station', 'str_timestamp', 'tz', 'flow', 'type'], dtype={'flow': float})
 
-# Print information on data found
-print("Files found(" + str(len(Data_files)) + "):")
-print(Data_files)
 
-for File_name in Data_files:
+if __name__ == '__main__':
+
+    # Search for all flow data files in the folder (txt files)
+    Data_files = [f for f in os.listdir('./data_files/Hydro_data_files/Raw_data') if
+                  os.path.isfile(os.path.join('./data_files/Hydro_data_files/Raw_data', f)) and 'txt' in f]
+
+    # Print information on data found
+    print("Files found(" + str(len(Data_files)) + "):")
+    print(Data_files)
+
+    for File_name in Data_files:
         print("Reading file: " + File_name)
 
         [File_id, extension] = File_name.split('.', 1)
 
-        df = pd.read_csv(os.path.join('./data_files/Hydro_data_files/Raw_data', File_name),
-                         delimiter='\t', skiprows=30,
-                         names=['agency', 'station', 'str_timestamp', 'tz', 'flow', 'type'], converters={"flow": float})
+        df = read_raw_file(os.path.join('./data_files/Hydro_data_files/Raw_data', File_name))
 
-        df['timestamp'] = df.apply(lambda x: pd.Timestamp(x['str_timestamp'], tz=timezone_translator(x['tz'])), axis=1)
-        df = df.sort_values(by='timestamp', ascending=True)
+        df['timestamp'] = to_utc(df['str_timestamp'], df['tz'])
+        df = df.dropna(subset=['timestamp'])
+        df = df.sort_values(by='timestamp', ascending=True, kind='stable')
         df.set_index('timestamp', inplace=True)
         df[['flow']].to_csv('./data_files/Hydro_data_files/Processed_data/time_zone_converted_' + File_id + '.txt')
 
-        print('File ' + File_name + ' converted and saved!')
\ No newline at end of file
+        print('File ' + File_name + ' converted and saved!')
+
+    print('Time spent to convert: ', datetime.datetime.now() - now)
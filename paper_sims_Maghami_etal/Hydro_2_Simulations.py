@@ -1,11 +1,20 @@
 import os
-import statistics
+import sys
+import argparse
 import datetime
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import datetime
 import turbine
+import battery
+import timeseries
+import parallel
+import site_store
+import fleet
+import incremental
+import events
+import native
 
 
 now = datetime.datetime.now()
@@ -14,208 +23,222 @@ now = datetime.datetime.now()
 # ------------------------------- Hydro powerharvesting --------------------------------------------
 # --------------------------------------------------------------------------------------------------
 
-def timezone_translator_formasking(tz):
-    return {
-        'US/Eastern': '-0500',
-        'US/Central': '-0600',
-        'US/Mountain': '-0700',
-        'US/Pacific': '-0800'
-    }.get(tz, None)
-
-def StepEnergy(minutes, Gen_power, T_threshold, verbose=True):
-
-    dt=0
-    delta_t=[]
-    step_energy=[]
-    for i in range(1,len(minutes)):
-        dt = minutes[i]-minutes[i-1]
-        if dt<T_threshold:
-            step_energy.append((Gen_power[i-1]+Gen_power[i])*dt*60/2)
-            delta_t.append(dt)
-        else:
-            step_energy.append(0)
-            delta_t.append(0)
-            print("ignored!")
-
-    Total_time=sum(delta_t)
-    Total_energy=sum(step_energy)
-    Average_Energy=Total_energy/Total_time
-
-    if verbose==True:
-        print("Total time(months): "+str(Total_time/(30*24*60)))
-        print("Total energy(kwh): "+str(Total_energy/3600000))
-        print("Average energy(Joules in one minute step): "+str(Average_Energy))
-
-
-    return [step_energy, Total_time,Total_energy, Average_Energy]
-
-
-# Read file containing USGS siteID and lat-lon from SolarAnywhere.
-Site_IDCoordinates_file = os.path.join(os.path.dirname(__file__), './data_files/USGS_Sites_12_10_2019_42sites_INFOandMissingReportMerged.csv')
-df_ = pd.read_csv(Site_IDCoordinates_file, encoding="ISO-8859-1", dtype={'site_no': str},
-                  usecols=[0, 1, 2, 3, 4, 5, 6, 9, 10, 11])
-
-
-# Search for all flow data files in the folder (txt files)
-Data_files = [f for f in os.listdir('./data_files/Hydro_data_files/Processed_data') if
-              os.path.isfile(os.path.join('./data_files/Hydro_data_files/Processed_data', f)) and 'txt' in f]
-
-# Print information on data found
-print("Files found(" + str(len(Data_files)) + "):")
-print(Data_files)
-
-
-# create empty list to append the filename in the target USGS observation data directory
-median_genpower = []
-mean_genpower = []
-Total_time_list = []
-Percentage_offTime_list = []
-Percentage_Joules_overflow_list = []
-Average_Energy_list = []
-
-
-
-# Simulations parameters
-Nbat_in = 0.9 # battery's charge efficiency
-Nbat_out = 0.7 # battery's discharge efficiency
-Bnom = (1/Nbat_out)*400 # in Wh
-Binit = 1.0*Bnom # in Wh
-# Eleak = 0 # in Wh
-Eleak = 0.66/3600 # in Wh (2% self-discharge in one month=> 0.02*400Wh/(30days*24days*60min)
-Psleep = 3.7*60*(10**-6) # Power when system is in idle/sleep mode
-
-
-Ncc = 0.9 # charge controller efficiency
-Bth = 0.3*Bnom # battery charge threshold to turn back on after power failure
-Batt_status = 1 # initial status of the battery is on
-
-# rho = 1/60 # step is one minute (conversion factor w to wh)
-# Pcc = 0 # Power dissipated by the charge controller
-# Pvr = 0 # Power dissipated by the voltage regulator
-# Psys = 14.38 # Power consumption of electronic components (controller, sensor and communications)
-# T_on = 1 # Time the station remains on (used to calculate average energy consumption)
+# Simulations parameters (see battery.default_params for the battery and load model constants)
 Sampling_interval = 5 # Time between two wake up events
 Communication_interval = 24 * Sampling_interval # We communicate the samples every 24 measurement
-#
-# Duty_cycle = T_on/Sampling_interval # Duty cycle (fraction of the time the system stays on)
-# sumDCsysPsys = Duty_cycle*Psys # Average power consumption of the system
-#
-# # Equations available on page 73 of the reference paper
-#
-# Eload_setup = rho*(Pcc+Pvr+sumDCsysPsys) # target power consumption for the load
-Eload_setup = (14.38*60/(Sampling_interval*60) + 60*Psleep*(1-9/(Sampling_interval*60)-60/(Communication_interval*60)))/3600
-
+params = battery.default_params(Sampling_interval, Communication_interval)
 
-n = 0
-for USGS_site_file in Data_files:
-
-    print("Reading file: " + USGS_site_file)
 
-    flow_velocity_file = os.path.join(os.path.dirname(__file__), './data_files/Hydro_data_files/Processed_data/' + USGS_site_file)
-    df = pd.read_csv(flow_velocity_file)
+# Flow to power conversion of two Water Lily turbines, or of two turbines of a saved curve (turbine.TurbineCurve.save)
+# when screening candidate turbines
+def power_function(turbine_curve=None):
 
-    df['timestamp'] = df.apply(lambda x: pd.Timestamp(x['timestamp'], tz=df_['Time_zone'][n]), axis=1)
-    df.set_index('timestamp', inplace=True)
+    if turbine_curve is None:
+        return lambda flow: 2 * turbine.waterlilyv2_power(flow) #Use two WaterLily
 
-    mask = (df.index >= ('2010-01-01 01:00:00' + timezone_translator_formasking(df_['Time_zone'][n]))) & \
-           (df.index <= ('2015-01-01 00:00:00' + timezone_translator_formasking(df_['Time_zone'][n])))
+    curve = turbine.TurbineCurve.load(turbine_curve)
 
-    df = df.loc[mask]
+    return lambda flow: 2 * curve.power(flow)
 
-    upsampled = df.resample('1T')
-    # print(upsampled.head(61))
-    interpolated = upsampled.interpolate(method='linear')
-    # print(interpolated.head(61))
-    print('interpolated')
 
-    minutes = []
-    for i in range(0, len(interpolated.index)):
-        minutes.append(int(((abs(interpolated.index[i] - interpolated.index[0])).total_seconds()) / 60))
+# Minute by minute simulation of the 1-minute series of a site (run by run of constant harvest when event_driven)
+def simulate_site(USGS_site_file, time_zone, fleet_path=None, event_driven=False, turbine_curve=None, fast_path=None):
 
-    Total_time1 = minutes[-1] - minutes[0]
+    print("Reading file: " + USGS_site_file)
 
+    # 1-minute flow of the 2010-2014 period, preprocessed once in the site store
+    interpolated = site_store.load_hydro(USGS_site_file, time_zone, verbose=True)
 
-    # flow_velocity = interpolated['flow'].tolist()
+    minutes = timeseries.minute_offsets(interpolated.index)
 
     total_sim_steps = minutes[-1]  # in minutes
 
-    # Creation of vectors to be used in the simulation
-    Eh = np.zeros(total_sim_steps)
-    Ebat_in = np.zeros(total_sim_steps)
-    Ebat_out = np.zeros(total_sim_steps)
-    B = np.zeros(total_sim_steps)
-    Eload = np.zeros(total_sim_steps)
-    Overflow = np.zeros(total_sim_steps)
-
-    gen_power = turbine.waterlilyv2(interpolated)
-    gen_power = gen_power['power'].tolist()
-
-    gen_power = [power * 2 for power in gen_power] #Use two WaterLily
+    gen_power = power_function(turbine_curve)(interpolated['flow'])
 
     T_threshold = 24 * 60  # 1 day (in minutes) it is used when interpolating the missing data, if the gap is greater than one
     # day, the gap is ignored
-    [step_energy, Total_time, Total_energy, Average_Energy] = StepEnergy(minutes, gen_power, T_threshold, verbose=True)
-
-    Average_Energy_list.append(Average_Energy * Sampling_interval)
+    step_energy, Total_time, Total_energy, Average_Energy, gaps = timeseries.step_energy(minutes, gen_power, T_threshold, verbose=True)
 
-    Eh = [x / 60.0 for x in gen_power] #convert watt-min to watt-hour
-    Eh = np.asarray(Eh)
+    Eh = gen_power / 60.0 #convert watt-min to watt-hour
 
-    Total_time_list.append(total_sim_steps / (24.0 * 60.0))  # convert from minutes to days
-    median_genpower.append(statistics.median(gen_power))
-    mean_genpower.append(statistics.mean(gen_power))
+    if fleet_path is not None:
+        # Each worker writes its own row of the fleet harvest matrix
+        fleet.store_site(fleet.open_fleet(fleet_path, mode='r+'), USGS_site_file.split('_')[3], Eh, interpolated.index[0])
 
+    # Battery simulation over the simulation period (run by run of constant harvest in the event-driven mode, as
+    # the harvest is zero whenever the flow is below the turbine cut-in)
+    if event_driven:
+        result = events.simulate_events(Eh, params, minutes=minutes, verbose=True)
+    else:
+        result = battery.simulate(Eh, params, minutes=minutes, fast_path=fast_path, verbose=True)
 
+    print('Time spent to simulate: ', datetime.datetime.now()-now)
 
-    # initial conditions
-    Eload[0] = Eload_setup
-    Ebat_out[0] = (Eload[0] / Nbat_out) + Eleak
-    Ebat_in[0] = min(Nbat_in * Ncc * Eh[0], max(0, Nbat_out * Bnom - Binit - Ebat_out[0]))
-    B[0] = max(0, min(Nbat_out * Bnom, Binit + Ebat_in[0] - Ebat_out[0]))
-    Overflow[0] = max(0, Nbat_in * Ncc * Eh[0] - Ebat_in[0])
+    return {'GPMean_Hydro': timeseries.sequential_sum(gen_power) / len(gen_power),
+            'GPMedian_Hydro': np.median(gen_power),
+            'AveEner_Hydro': Average_Energy * Sampling_interval,  # in 5 minutes
+            'TotalTime_Hydro': total_sim_steps / (24.0 * 60.0),  # convert from minutes to days
+            'PerOfftime_Hydro': 100*result.fraction_sampleloss,
+            'PerjoulOvFl_Hydro': result.fraction_overflow}
 
 
+# Same simulation as simulate_site, reading, interpolating and simulating chunk_days of data at a time so the memory
+# use does not depend on the record length. The battery state and the running totals are carried from chunk to chunk
+# and give the same results, except the median power which needs the whole series (NaN in this mode).
+# With a checkpoint file, the run starts from the state saved by the previous run and only simulates the new records
+def simulate_site_streaming(USGS_site_file, time_zone, chunk_days, checkpoint_file=None, turbine_curve=None, fast_path=None):
 
-    for k in range(1, total_sim_steps):
+    print("Streaming file: " + USGS_site_file)
 
-        Eload[k] = Batt_status * Eload_setup
+    checkpoint = incremental.load_checkpoint(checkpoint_file) if checkpoint_file is not None else None
+    power = power_function(turbine_curve)
 
-        Ebat_out[k] = (Eload[k] / Nbat_out) + Eleak
+    checkpoint = incremental.advance(USGS_site_file.split('_')[3],
+                                     lambda offset: site_store.hydro_records_from(
+                                         USGS_site_file, time_zone, offset, open_ended=checkpoint_file is not None),
+                                     lambda interpolated: power(interpolated['flow']),
+                                     params, checkpoint, chunk_minutes=int(chunk_days * 24 * 60), fast_path=fast_path)
+    if checkpoint_file is not None:
+        incremental.save_checkpoint(checkpoint_file, checkpoint)
 
-        # original version: Ebat_in[d] = min(Nbat_in * Epv(d,omega),min(0,Nbat_out*Bnom - B[d-1] - Ebat_out[d]))
-        Ebat_in[k] = min(Nbat_in * Ncc * Eh[k], max(0, Nbat_out * Bnom - B[k - 1] - Ebat_out[k]))
+    metrics = incremental.checkpoint_metrics(checkpoint)
 
-        B[k] = max(0, min(Nbat_out * Bnom, B[k - 1] + Ebat_in[k] - Ebat_out[k]))
+    print("Total time(months): " + str(metrics.total_time / (30 * 24 * 60)))
+    print("Total energy(kwh): " + str(metrics.total_energy / 3600000))
+    print("Percentage overflow: {:.2%}".format(metrics.fraction_overflow))
+    print("Percentage sample loss: {:.2%}".format(metrics.fraction_sampleloss))
+    print('Time spent to simulate: ', datetime.datetime.now()-now)
 
-        Overflow[k] = max(0, Nbat_in * Ncc * Eh[k] - Ebat_in[k])
+    return {'GPMean_Hydro': metrics.mean_power,
+            'GPMedian_Hydro': np.nan,
+            'AveEner_Hydro': metrics.average_energy * Sampling_interval,  # in 5 minutes
+            'TotalTime_Hydro': metrics.last_minute / (24.0 * 60.0),  # convert from minutes to days
+            'PerOfftime_Hydro': 100*metrics.fraction_sampleloss,
+            'PerjoulOvFl_Hydro': metrics.fraction_overflow}
 
-        if B[k] == 0:
-            Batt_status = 0
-            Eload[k] = 0
-        if (Batt_status == 0) and (B[k] >= Bth):
-            Batt_status = 1
 
+# Same simulation as simulate_site, on the 15-minute records instead of the 1-minute interpolated series (see native).
+# The power and energy totals of the 1-minute series follow from the power summed over the simulated minutes, only the
+# median power needs the whole series (NaN in this mode)
+def simulate_site_native(USGS_site_file, time_zone):
 
+    print("Reading file: " + USGS_site_file)
 
-    fraction_overflow = sum(Overflow) / (sum(Nbat_in * Ncc * Eh) + 0.000000000000001) # Added to avoid div by 0 in case
-    print("Percentage overflow: {:.2%}".format(fraction_overflow))
+    samples = site_store.hydro_samples(USGS_site_file, time_zone).dropna(subset=['flow'])
+    sample_minutes = timeseries.minute_offsets(samples.index)
+    flow = samples['flow'].to_numpy(dtype=np.float64)
 
-    fraction_sampleloss = np.count_nonzero(Eload == 0) / len(Eload)
-    print("Percentage sample loss: {:.2%}".format(fraction_sampleloss))
+    result = native.simulate_native(sample_minutes, flow, native.waterlilyv2_harvest(2), params, verbose=True) #Use two WaterLily
 
+    total_sim_steps = sample_minutes[-1]  # in minutes
+    first_power, last_power = 2 * turbine.waterlilyv2_power(flow[[0, -1]])
 
-    Percentage_offTime_list.append(100*fraction_sampleloss)
-    Percentage_Joules_overflow_list.append(fraction_overflow)
+    # Trapezoidal energy of the 1-minute steps (see timeseries.step_energy), in Joules
+    Total_energy = (result.power_sum + last_power - (first_power + last_power) / 2) * 60
+    Average_Energy = Total_energy / total_sim_steps
 
     print('Time spent to simulate: ', datetime.datetime.now()-now)
-    n += 1
 
+    return {'GPMean_Hydro': (result.power_sum + last_power) / (total_sim_steps + 1),
+            'GPMedian_Hydro': np.nan,
+            'AveEner_Hydro': Average_Energy * Sampling_interval,  # in 5 minutes
+            'TotalTime_Hydro': total_sim_steps / (24.0 * 60.0),  # convert from minutes to days
+            'PerOfftime_Hydro': 100*result.fraction_sampleloss,
+            'PerjoulOvFl_Hydro': result.fraction_overflow}
+
+
+if __name__ == '__main__':
+
+    # Options shared by several modes
+    fleet_option = argparse.ArgumentParser(add_help=False)
+    fleet_option.add_argument('--fleet', default=None,
+                              help='folder of a memory-mapped fleet harvest matrix to fill with the harvest of all sites')
+    curve_option = argparse.ArgumentParser(add_help=False)
+    curve_option.add_argument('--turbine-curve', default=None,
+                              help='turbine curve file (turbine.TurbineCurve.save) used instead of the Water Lily model, '
+                                   'the results are written to results/Hydro_Simulation_<curve file name>.csv')
+    fast_path_option = argparse.ArgumentParser(add_help=False)
+    fast_path_option.add_argument('--fast-path', action='store_true', default=None,
+                                  help='compute the stretches where the battery never runs out with vectorized prefix '
+                                       'sums (default only when numba is not installed, see battery.simulate_chunk)')
+
+    parser = argparse.ArgumentParser(description='Hydro power harvesting simulations of the USGS sites (minute mode '
+                                                 'when no mode is given)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs, 1 runs serially)')
+    parser.set_defaults(fleet=None, turbine_curve=None, fast_path=None)
+    modes = parser.add_subparsers(dest='mode', metavar='mode')
+    modes.add_parser('minute', parents=[fleet_option, curve_option, fast_path_option],
+                     help='simulate the 1-minute series minute by minute (default)')
+    modes.add_parser('event-driven', parents=[fleet_option, curve_option],
+                     help='simulate the 1-minute series run by run of constant harvest')
+    streaming = modes.add_parser('streaming', parents=[curve_option, fast_path_option],
+                                 help='stream the data in chunks of days (bounded memory, no median power)')
+    streaming.add_argument('--chunk-days', type=float, default=30,
+                           help='days read, interpolated and simulated at a time (default: 30)')
+    streaming.add_argument('--incremental', action='store_true',
+                           help='only simulate the records after the checkpoint of the previous incremental run of '
+                                'each site (data after 2015 included) and update the results')
+    modes.add_parser('native', help='simulate from the 15-minute records without interpolating them to 1 minute '
+                                    '(Water Lily model only, no median power)')
+    args = parser.parse_args()
+    if args.mode is None:
+        args = parser.parse_args(sys.argv[1:] + ['minute'])
+    if args.turbine_curve is not None:
+        print("Turbine curve: " + turbine.TurbineCurve.load(args.turbine_curve).name)
+
+    # Read file containing USGS siteID and lat-lon from SolarAnywhere.
+    Site_IDCoordinates_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), './data_files/USGS_Sites_12_10_2019_42sites_INFOandMissingReportMerged.csv')
+    df_ = pd.read_csv(Site_IDCoordinates_file, encoding="ISO-8859-1", dtype={'site_no': str},
+                      usecols=[0, 1, 2, 3, 4, 5, 6, 9, 10, 11])
+
+
+    # Search for all flow data files in the folder (txt files)
+    Data_files = [f for f in os.listdir('./data_files/Hydro_data_files/Processed_data') if
+                  os.path.isfile(os.path.join('./data_files/Hydro_data_files/Processed_data', f)) and 'txt' in f]
+
+    # Print information on data found
+    print("Files found(" + str(len(Data_files)) + "):")
+    print(Data_files)
+
+    # Sites are matched to their file by site number (time_zone_converted_<site_no>_72255.txt)
+    time_zones = dict(zip(df_['site_no'], df_['Time_zone']))
+    site_args = {}
+    for USGS_site_file in sorted(Data_files):
+        site_no = USGS_site_file.split('_')[3]
+        if site_no not in time_zones:
+            print("Site " + site_no + " is not in the site table, file " + USGS_site_file + " skipped")
+            continue
+        if args.mode == 'streaming':
+            checkpoint_file = os.path.join(incremental.CHECKPOINT_DIR, 'hydro_' + site_no + '.json') if args.incremental else None
+            site_args[site_no] = (USGS_site_file, time_zones[site_no], args.chunk_days, checkpoint_file,
+                                  args.turbine_curve, args.fast_path)
+        elif args.mode == 'native':
+            site_args[site_no] = (USGS_site_file, time_zones[site_no])
+        else:
+            site_args[site_no] = (USGS_site_file, time_zones[site_no], args.fleet, args.mode == 'event-driven',
+                                  args.turbine_curve, args.fast_path)
+
+    if args.fleet is not None:
+        # Common UTC grid covering the simulation period of every site
+        periods = [site_store.simulation_period(time_zone) for USGS_site_file, time_zone, *options in site_args.values()]
+        fleet.create_fleet(args.fleet, list(site_args), min(start for start, end in periods), max(end for start, end in periods))
+
+    simulate = {'minute': simulate_site, 'event-driven': simulate_site, 'streaming': simulate_site_streaming,
+                'native': simulate_site_native}[args.mode]
+    results = parallel.map_sites(simulate, site_args, workers=args.workers)
+
+    for column in ['GPMean_Hydro', 'GPMedian_Hydro', 'AveEner_Hydro', 'TotalTime_Hydro', 'PerOfftime_Hydro', 'PerjoulOvFl_Hydro']:
+        df_[column] = [results[site_no][column] if site_no in results else np.nan for site_no in df_['site_no']]
+
+    if args.turbine_curve is None:
+        df_.to_csv(os.path.join('./', 'results/Hydro_Simulation.csv'), sep=',')
+    else:
+        df_.to_csv(os.path.join('./', 'results/Hydro_Simulation_' + os.path.splitext(os.path.basename(args.turbine_curve))[0] + '.csv'), sep=',')
 
-df_['GPMean_Hydro'] = mean_genpower
-df_['GPMedian_Hydro'] = median_genpower
-df_['AveEner_Hydro'] = Average_Energy_list  # in 5 minutes
-df_['TotalTime_Hydro'] = Total_time_list
-df_['PerOfftime_Hydro'] = Percentage_offTime_list
-df_['PerjoulOvFl_Hydro'] = Percentage_Joules_overflow_list
+    if args.fleet is not None:
+        metrics = fleet.fleet_metrics(fleet.open_fleet(args.fleet))
+        print("Fleet harvest of " + str(np.count_nonzero(metrics.minutes)) + " sites: " + str(np.sum(metrics.total_energy)) +
+              " Wh in total, peak of " + str(np.max(metrics.fleet_total)) + " Wh in one minute")
 
-df_.to_csv(os.path.join('./', 'results/Hydro_Simulation.csv'), sep=',')
+    print('Time spent to simulate all sites: ', datetime.datetime.now()-now)
@@ -0,0 +1,66 @@
+# This code finds, for every USGS site, the smallest sampling interval meeting a maximum sample loss and the largest
+# sampling interval meeting a maximum overflow (see interval_search), instead of simulating a list of intervals
+import os
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+import turbine
+import timeseries
+import site_store
+import fleet
+import interval_search
+
+
+now = datetime.datetime.now()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Critical sampling interval of the USGS sites (hydro harvesting)')
+    parser.add_argument('--max-sampleloss', type=float, default=0.0,
+                        help='maximum fraction of lost samples (default: 0, no sample loss)')
+    parser.add_argument('--max-overflow', type=float, default=None,
+                        help='maximum fraction of overflowed energy (default: not searched)')
+    parser.add_argument('--interval-range', type=int, nargs=2, default=[1, 60],
+                        help='smallest and largest sampling interval searched, in minutes')
+    parser.add_argument('--communication-interval', type=float, default=24 * 5,
+                        help='minutes between two communications (default: 120, as in the sampling interval study)')
+    parser.add_argument('--fleet', default=None,
+                        help='read the harvest from a fleet matrix written by Hydro_2_Simulations.py minute --fleet')
+    args = parser.parse_args()
+
+    Site_IDCoordinates_file = os.path.join(site_store.DATA_DIR, 'USGS_Sites_12_10_2019_42sites_INFOandMissingReportMerged.csv')
+    df_ = pd.read_csv(Site_IDCoordinates_file, encoding="ISO-8859-1", dtype={'site_no': str},
+                      usecols=[0, 1, 2, 3, 4, 5, 6, 9, 10, 11])
+
+    if args.fleet is not None:
+        result = interval_search.fleet_intervals(fleet.open_fleet(args.fleet), args.max_sampleloss, args.max_overflow,
+                                                 args.interval_range, args.communication_interval, verbose=True)
+    else:
+        time_zones = dict(zip(df_['site_no'], df_['Time_zone']))
+        harvest = {}
+        minutes = {}
+        for USGS_site_file in sorted(os.listdir(site_store.HYDRO_DIR)):
+            if 'txt' not in USGS_site_file or USGS_site_file.split('_')[3] not in time_zones:
+                continue
+            site_no = USGS_site_file.split('_')[3]
+            interpolated = site_store.load_hydro(USGS_site_file, time_zones[site_no], verbose=True)
+            minutes[site_no] = timeseries.minute_offsets(interpolated.index)
+
+            gen_power = 2 * turbine.waterlilyv2_power(interpolated['flow']) #Use two WaterLily
+            harvest[site_no] = gen_power / 60.0 #convert watt-min to watt-hour
+
+        result = interval_search.critical_intervals(harvest, args.max_sampleloss, args.max_overflow,
+                                                    args.interval_range, args.communication_interval,
+                                                    minutes=minutes, verbose=True)
+
+    min_interval = dict(zip(result.sites, result.min_interval))
+    max_interval = dict(zip(result.sites, result.max_interval))
+    df_['MinSamplingInterval'] = [min_interval.get(site_no, np.nan) for site_no in df_['site_no']]
+    df_['MaxSamplingInterval'] = [max_interval.get(site_no, np.nan) for site_no in df_['site_no']]
+
+    df_.to_csv(os.path.join('./', 'results/Hydro_SamplingInterval.csv'), sep=',')
+
+    print(str(result.simulations) + ' simulations in ' + str(result.passes) + ' passes')
+    print('Time spent to search all sites: ', datetime.datetime.now() - now)
@@ -0,0 +1,64 @@
+# This code computes, for every USGS site, the minimum battery capacity (Bnom) giving zero sample loss with two
+# WaterLily turbines (see sizing), instead of simulating a grid of capacities
+import os
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+import turbine
+import timeseries
+import site_store
+import fleet
+import battery
+import sizing
+
+
+now = datetime.datetime.now()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Minimum battery capacity of the USGS sites (hydro harvesting)')
+    parser.add_argument('--sampling-interval', type=float, default=5,
+                        help='minutes between two samples (default: 5)')
+    parser.add_argument('--communication-interval', type=float, default=None,
+                        help='minutes between two communications (default: every 24 samples)')
+    parser.add_argument('--verify', action='store_true',
+                        help='check every capacity with the full battery model')
+    parser.add_argument('--fleet', default=None,
+                        help='read the harvest from a fleet matrix written by Hydro_2_Simulations.py minute --fleet')
+    args = parser.parse_args()
+
+    Site_IDCoordinates_file = os.path.join(site_store.DATA_DIR, 'USGS_Sites_12_10_2019_42sites_INFOandMissingReportMerged.csv')
+    df_ = pd.read_csv(Site_IDCoordinates_file, encoding="ISO-8859-1", dtype={'site_no': str},
+                      usecols=[0, 1, 2, 3, 4, 5, 6, 9, 10, 11])
+
+    params = battery.default_params(args.sampling_interval, args.communication_interval)
+
+    if args.fleet is not None:
+        result = sizing.fleet_capacities(fleet.open_fleet(args.fleet), params, verify=args.verify, verbose=True)
+    else:
+        time_zones = dict(zip(df_['site_no'], df_['Time_zone']))
+        sites, capacities = [], []
+        for USGS_site_file in sorted(os.listdir(site_store.HYDRO_DIR)):
+            if 'txt' not in USGS_site_file or USGS_site_file.split('_')[3] not in time_zones:
+                continue
+            site_no = USGS_site_file.split('_')[3]
+            interpolated = site_store.load_hydro(USGS_site_file, time_zones[site_no], verbose=True)
+            minutes = timeseries.minute_offsets(interpolated.index)
+
+            gen_power = 2 * turbine.waterlilyv2_power(interpolated['flow']) #Use two WaterLily
+            Eh = gen_power / 60.0 #convert watt-min to watt-hour
+            sites.append(site_no)
+            capacities.append(sizing.min_capacity(Eh, params, minutes=minutes, verify=args.verify, verbose=True))
+
+        result = sizing.FleetSizing(sites, *[np.array(field) for field in zip(*capacities)])
+
+    for column, values in [('MinBnom', result.bnom), ('MinCapacity', result.capacity),
+                           ('MaxDrawdown', result.max_drawdown), ('SampleLoss', result.sampleloss)]:
+        values = dict(zip(result.sites, values))
+        df_[column] = [values.get(site_no, np.nan) for site_no in df_['site_no']]
+
+    df_.to_csv(os.path.join('./', 'results/Hydro_BatterySizing.csv'), sep=',')
+
+    print('Time spent to size all sites: ', datetime.datetime.now() - now)
@@ -0,0 +1,55 @@
+# This code preprocesses the hydro and solar data of all USGS sites into the site store (see site_store), so the
+# simulation scripts read 1-minute binary columns instead of re-parsing and re-interpolating the raw files
+import os
+import argparse
+import datetime
+import pandas as pd
+import parallel
+import site_store
+
+
+now = datetime.datetime.now()
+
+
+def store_hydro(USGS_site_file, time_zone):
+    return len(site_store.load_hydro(USGS_site_file, time_zone, verbose=True))
+
+
+def store_solar(USGSSiteID, tz):
+    return len(site_store.load_solar(USGSSiteID, tz, verbose=True))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Preprocess the USGS site data into the site store')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs, 1 runs serially)')
+    args = parser.parse_args()
+
+    Site_IDCoordinates_file = os.path.join(site_store.DATA_DIR, 'USGS_Sites_12_10_2019_42sites_INFOandMissingReportMerged.csv')
+    df_ = pd.read_csv(Site_IDCoordinates_file, encoding="ISO-8859-1", dtype={'site_no': str},
+                      usecols=[0, 1, 2, 3, 4, 5, 6, 9, 10, 11])
+    time_zones = dict(zip(df_['site_no'], df_['Time_zone']))
+
+    # Hydro: time_zone_converted_<site_no>_72255.txt
+    hydro_args = {}
+    if os.path.isdir(site_store.HYDRO_DIR):
+        for USGS_site_file in sorted(os.listdir(site_store.HYDRO_DIR)):
+            if 'txt' not in USGS_site_file or USGS_site_file.split('_')[3] not in time_zones:
+                continue
+            hydro_args[USGS_site_file] = (USGS_site_file, time_zones[USGS_site_file.split('_')[3]])
+
+    # Solar: concatenate_<site_no>.csv
+    solar_args = {}
+    if os.path.isdir(site_store.SOLAR_DIR):
+        for Solar_file in sorted(os.listdir(site_store.SOLAR_DIR)):
+            site_no = Solar_file.split('_')[1].split('.')[0] if 'csv' in Solar_file else None
+            if site_no not in time_zones:
+                continue
+            solar_args[site_no] = (site_no, time_zones[site_no])
+
+    print("Preprocessing " + str(len(hydro_args)) + " hydro and " + str(len(solar_args)) + " solar files...")
+    parallel.map_sites(store_hydro, hydro_args, workers=args.workers)
+    parallel.map_sites(store_solar, solar_args, workers=args.workers)
+
+    print('Time spent to preprocess: ', datetime.datetime.now() - now)
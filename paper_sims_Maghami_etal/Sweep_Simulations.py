@@ -0,0 +1,143 @@
+# This code simulates every combination of a grid of design parameters (sampling interval, communication interval,
+# battery size, number of turbines and PV tilt) for every USGS site and writes the results as a labeled cube (see
+# sweep), instead of editing the constants of the simulation scripts and running them again. Combinations that only
+# change the load or the battery share the harvest of their group and are simulated in one pass
+import os
+import argparse
+import datetime
+import collections
+import numpy as np
+import pandas as pd
+import turbine
+import battery
+import timeseries
+import parallel
+import site_store
+import scenarios
+import sweep
+
+
+now = datetime.datetime.now()
+
+# Metrics of the result cube
+METRICS = ['PerOfftime', 'PerjoulOvFl', 'GPMean']
+
+# Harvest sources of the last sites and tilts read by this worker process, reused by the next groups of the site
+_site_power = collections.OrderedDict()
+
+
+# Power (W) of one source of a site on its 1-minute grid ('waterlily' for one Water Lily, or 'pv' with the tilt, None
+# for the latitude of the site), as a series indexed by the timestamps of the grid
+def site_power(source, site_no, USGS_site_file, time_zone, latitude, longitude, surface_tilt=None):
+
+    key = (source, site_no, surface_tilt)
+    if key in _site_power:
+        return _site_power[key]
+
+    if source == 'waterlily':
+        # 1-minute flow of the 2010-2014 period, preprocessed once in the site store
+        interpolated = site_store.load_hydro(USGS_site_file, time_zone, verbose=True)
+        power = turbine.waterlilyv2_power(interpolated['flow'])
+    else:
+        # pvlib is only needed with the solar source
+        import SolarPVLib_Simulations
+        if SolarPVLib_Simulations.module is None:
+            SolarPVLib_Simulations.load_components()
+        interpolated = site_store.load_solar(site_no, time_zone, verbose=True)
+        power = SolarPVLib_Simulations.module_dc_power(interpolated, latitude, longitude, 0, surface_tilt=surface_tilt)
+
+    _site_power[key] = pd.Series(power, index=interpolated.index, name=source)
+    while len(_site_power) > 4:
+        _site_power.popitem(last=False)
+
+    return _site_power[key]
+
+
+# Metrics of every load combination of one harvest group of a site, simulated in one pass. With the PV module, the
+# group runs on the minutes shared by the hydro and solar records (see scenarios)
+def simulate_group(site_no, USGS_site_file, time_zone, latitude, longitude, group, load_grid):
+
+    sources = {'waterlily': site_power('waterlily', site_no, USGS_site_file, time_zone, latitude, longitude)}
+    weights = {'waterlily': float(group.get('turbines', 2))}
+    if 'pv_tilt' in group:
+        # A NaN tilt on the cube axis is the latitude of the site
+        surface_tilt = None if np.isnan(group['pv_tilt']) else float(group['pv_tilt'])
+        sources['pv'] = site_power('pv', site_no, USGS_site_file, time_zone, latitude, longitude, surface_tilt)
+        weights['pv'] = 1.0
+        if weights['waterlily'] == 0:
+            # Solar only, on the grid of the solar records
+            del weights['waterlily']
+
+    index = scenarios.scenario_grid(sources, weights)
+    gen_power = scenarios.compose(sources, weights, index)
+
+    Eh = gen_power / 60.0 #convert watt-min to watt-hour
+    result = battery.simulate_batch(Eh, sweep.load_params(load_grid), minutes=timeseries.minute_offsets(index))
+
+    return {'PerOfftime': 100 * result.fraction_sampleloss[0],
+            'PerjoulOvFl': result.fraction_overflow[0],
+            'GPMean': np.full(result.fraction_overflow.shape[1], timeseries.sequential_sum(gen_power) / len(gen_power))}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Parameter sweep of the USGS sites, written as a labeled result cube')
+    parser.add_argument('--sampling-interval', type=float, nargs='+', default=[5],
+                        help='minutes between two samples (default: 5)')
+    parser.add_argument('--communication-interval', type=float, nargs='+', default=[None],
+                        help='minutes between two communications (default: every 24 samples)')
+    parser.add_argument('--bnom', type=float, nargs='+', default=[battery.default_params().bnom],
+                        help='nominal battery capacities in Wh (default: the battery of the paper)')
+    parser.add_argument('--turbines', type=float, nargs='+', default=[2],
+                        help='numbers of Water Lily turbines (default: 2, 0 simulates solar only)')
+    parser.add_argument('--solar', action='store_true',
+                        help='add the PV module to the harvest (needs the SolarAnywhere data)')
+    parser.add_argument('--pv-tilt', type=float, nargs='+', default=[np.nan],
+                        help='tilts of the PV module in degrees, with --solar (default: latitude of the site)')
+    parser.add_argument('--output', default=os.path.join('./', 'results/Sweep.npz'),
+                        help='result cube file (default: results/Sweep.npz)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs, 1 runs serially)')
+    args = parser.parse_args()
+
+    Site_IDCoordinates_file = os.path.join(site_store.DATA_DIR, 'USGS_Sites_12_10_2019_42sites_INFOandMissingReportMerged.csv')
+    df_ = pd.read_csv(Site_IDCoordinates_file, encoding="ISO-8859-1", dtype={'site_no': str},
+                      usecols=[0, 1, 2, 3, 4, 5, 6, 9, 10, 11])
+
+    grid = {'sampling_interval': args.sampling_interval,
+            'communication_interval': args.communication_interval,
+            'bnom': args.bnom,
+            'turbines': args.turbines}
+    if args.solar:
+        grid['pv_tilt'] = args.pv_tilt
+    load_grid = {axis: values for axis, values in grid.items() if axis in sweep.LOAD_AXES}
+    groups = sweep.harvest_groups(grid)
+
+    sites = {}
+    for i, row in df_.iterrows():
+        USGS_site_file = 'time_zone_converted_' + row['site_no'] + '_72255.txt'
+        if not os.path.isfile(os.path.join(site_store.HYDRO_DIR, USGS_site_file)):
+            continue
+        if args.solar and not os.path.isfile(os.path.join(site_store.SOLAR_DIR, 'concatenate_' + row['site_no'] + '.csv')):
+            continue
+        # TODO: Altitude must be corrected from USGS website
+        sites[row['site_no']] = (USGS_site_file, row['Time_zone'], round(float(row['dec_lat_va']), 3),
+                                 round(float(row['dec_long_va']), 3))
+
+    # One task per site and harvest group, every load combination of the group is simulated by the same task
+    site_args = {}
+    for site_no, (USGS_site_file, time_zone, latitude, longitude) in sites.items():
+        for g, group in enumerate(groups):
+            site_args[(site_no, g)] = (site_no, USGS_site_file, time_zone, latitude, longitude, group, load_grid)
+
+    print('Sweep of ' + str(len(groups) * len(sweep.load_params(load_grid).bnom)) + ' combinations over ' +
+          str(len(sites)) + ' sites has begun...')
+    results = parallel.map_sites(simulate_group, site_args, workers=args.workers)
+
+    cube = sweep.empty_cube(list(sites), grid, METRICS)
+    for (site_no, g), metrics in results.items():
+        sweep.store_group(cube, site_no, groups[g], metrics)
+    sweep.write_cube(args.output, cube)
+
+    print('Result cube ' + str(dict(zip(cube.dims, [len(coord) for coord in cube.coords]))) + ' written to ' + args.output)
+    print('Time spent to simulate all sites: ', datetime.datetime.now() - now)
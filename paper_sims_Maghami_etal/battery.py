@@ -0,0 +1,537 @@
+#################################################################################
+#
+# Module: battery
+#
+# Description: Energy storage and consumption model of the self-powered
+#              monitoring station (Buchli et al., 2014). All simulation scripts
+#              share this kernel instead of carrying their own copy of the
+#              per-minute battery loop.
+#
+#              The inner loop is compiled with numba when it is installed and
+#              falls back to plain Python otherwise (same results, slower).
+#              Without numba, stretches where the battery never runs out are
+#              computed with vectorized bounded prefix sums instead (see
+#              _no_outage_block).
+#
+#################################################################################
+
+import collections
+import numpy as np
+from timeseries import sequential_sum
+
+try:
+    from numba import njit, config
+    JIT = not config.DISABLE_JIT
+except ImportError:
+    # numba is optional, the kernels then run as regular Python functions
+    JIT = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+# Power when system is in idle/sleep mode
+PSLEEP = 3.7*60*(10**-6)
+
+# Battery and load parameters of the simulations (energies are in Wh per one minute step)
+BatteryParams = collections.namedtuple('BatteryParams', ['nbat_in', 'nbat_out', 'bnom', 'binit', 'eleak', 'ncc', 'bth',
+                                                         'eload_setup'])
+
+# Steps of a block of the no-outage fast path, and battery level (as a fraction
+# of b_max) below which a step is left to the stepwise kernel. Blocks keep the
+# rounding of the prefix sums far below the guard
+FAST_PATH_BLOCK = 2**16
+FAST_PATH_GUARD = 1e-9
+
+# Trajectories and summary metrics of one battery simulation
+SimulationResult = collections.namedtuple('SimulationResult', ['eload', 'ebat_out', 'ebat_in', 'b', 'overflow',
+                                                               'batt_status', 'fraction_overflow',
+                                                               'fraction_sampleloss'])
+
+# Battery level, status and running counters carried from one chunk of a
+# simulation to the next (overflow and charge are in Wh)
+BatteryState = collections.namedtuple('BatteryState', ['b', 'batt_status', 'n_steps', 'n_off', 'overflow_sum',
+                                                       'charge_sum'])
+
+
+#################################################################################
+#
+# Function: eload_setup
+#
+# Description: Energy consumed by the station in one minute step for a given
+#              sampling and communication interval (page 73 of the reference
+#              paper)
+#
+# Input:    sampling_interval (minutes between two wake up events)
+#
+# Optional: communication_interval (minutes, defaults to 24 samples)
+#           psleep
+#
+# Output: returns the load energy in Wh per minute
+#
+#################################################################################
+
+def eload_setup(sampling_interval, communication_interval=None, psleep=PSLEEP):
+
+    if communication_interval is None:
+        # We communicate the samples every 24 measurement
+        communication_interval = 24 * sampling_interval
+
+    return (14.38*60/(sampling_interval*60) + 60*psleep*(1-9/(sampling_interval*60)-60/(communication_interval*60)))/3600
+
+
+#################################################################################
+#
+# Function: default_params
+#
+# Description: Builds the battery/load parameters used in the paper simulations
+#
+# Optional: sampling_interval
+#           communication_interval
+#           any BatteryParams field to override (e.g. bnom=..., nbat_out=...)
+#
+# Output: returns a BatteryParams
+#
+#################################################################################
+
+def default_params(sampling_interval=5, communication_interval=None, **overrides):
+
+    nbat_in = overrides.pop('nbat_in', 0.9)  # battery's charge efficiency
+    nbat_out = overrides.pop('nbat_out', 0.7)  # battery's discharge efficiency
+    bnom = overrides.pop('bnom', (1/nbat_out)*400)  # in Wh
+    params = dict(nbat_in=nbat_in,
+                  nbat_out=nbat_out,
+                  bnom=bnom,
+                  binit=1.0*bnom,  # in Wh
+                  eleak=0.66/3600,  # in Wh (2% self-discharge in one month)
+                  ncc=0.9,  # charge controller efficiency
+                  bth=0.3*bnom,  # battery charge threshold to turn back on after power failure
+                  eload_setup=eload_setup(sampling_interval, communication_interval))
+    params.update(overrides)
+
+    return BatteryParams(**params)
+
+
+# Harvest steps covered by a simulation, the whole series unless minute offsets
+# of the samples are given (one step per elapsed minute)
+def _simulation_steps(eh, minutes):
+
+    if minutes is None:
+        return eh
+
+    total_sim_steps = int(minutes[-1] - minutes[0])  # in minutes
+    return eh[..., :total_sim_steps]
+
+
+# Harvest samples after the simulated steps (with minute offsets, the last
+# sample only closes the final step). They are not simulated, but as in the
+# original scripts, which summed the whole Eh series, their charge counts in the
+# harvested energy of the overflow fraction
+def _closing_samples(eh, minutes):
+
+    if minutes is None:
+        return eh[..., :0]
+
+    total_sim_steps = int(minutes[-1] - minutes[0])  # in minutes
+    return eh[..., total_sim_steps:]
+
+
+# One minute of the battery recursion, shared by every kernel (stepwise,
+# batched, event-driven, native and ensemble). From the level b_prev and the
+# status at the start of the step and the charge reaching the battery
+# (Nbat_in*Ncc*Eh, in Wh), returns Eload (zero when the station is off or the
+# battery runs out during the step), Ebat_out, Ebat_in, the new level, the
+# overflow and the new status. The cache of a kernel does not track the
+# functions it calls from other modules, so the kernels of other modules
+# calling it are not cached on disk.
+@njit(cache=True)
+def _battery_step(charge, b_prev, batt_status, eload_setup, nbat_out, b_max, bth, eleak):
+
+    eload = batt_status * eload_setup
+
+    ebat_out = (eload / nbat_out) + eleak
+
+    # original version: Ebat_in[d] = min(Nbat_in * Epv(d,omega),min(0,Nbat_out*Bnom - B[d-1] - Ebat_out[d]))
+    ebat_in = min(charge, max(0.0, b_max - b_prev - ebat_out))
+
+    b = max(0.0, min(b_max, b_prev + ebat_in - ebat_out))
+
+    overflow = max(0.0, charge - ebat_in)
+
+    if b == 0:
+        batt_status = 0
+        eload = 0.0
+    if (batt_status == 0) and (b >= bth):
+        batt_status = 1
+
+    return eload, ebat_out, ebat_in, b, overflow, batt_status
+
+
+# Per-minute battery recursion. Arrays are filled in place and the battery
+# status at the end of the run is returned.
+@njit(cache=True)
+def _battery_kernel(eh, eload_setup, nbat_in, nbat_out, ncc, bnom, bth, eleak, b_prev, batt_status,
+                    eload, ebat_out, ebat_in, b, overflow):
+
+    b_max = nbat_out * bnom
+    for k in range(eh.shape[0]):
+
+        eload[k], ebat_out[k], ebat_in[k], b[k], overflow[k], batt_status = _battery_step(
+            nbat_in * ncc * eh[k], b_prev, batt_status, eload_setup, nbat_out, b_max, bth, eleak)
+
+        b_prev = b[k]
+
+    return batt_status
+
+
+# Vectorized battery recursion while the station is on and never runs out.
+# Every step then draws o = Eload_setup/Nbat_out + Eleak and, once the level is
+# at most b_max - o, y = B + 2*o follows the bounded cumulative sum
+# y[k] = min(y[k-1] + charge[k] - o, b_max), i.e. the cumulative sum minus its
+# running excess over b_max. Arrays are filled in place up to the first step
+# whose level comes within the guard of zero; the number of filled steps is
+# returned and the stepwise kernel takes over from there.
+def _no_outage_block(charge, eload_setup, ebat_out_on, b_max, b_prev, eload, ebat_out, ebat_in, b, overflow):
+
+    z = (b_prev + 2 * ebat_out_on) + np.cumsum(charge - ebat_out_on)
+    level = z - np.maximum.accumulate(np.maximum(z - b_max, 0.0)) - 2 * ebat_out_on
+
+    low = np.flatnonzero(level <= FAST_PATH_GUARD * b_max)
+    done = low[0] if len(low) else len(level)
+
+    b[:done] = level[:done]
+    previous = np.concatenate(([b_prev], level[:done - 1])) if done else level[:0]
+    ebat_in[:done] = np.minimum(charge[:done], np.maximum(0.0, b_max - previous - ebat_out_on))
+    overflow[:done] = np.maximum(0.0, charge[:done] - ebat_in[:done])
+    eload[:done] = eload_setup
+    ebat_out[:done] = ebat_out_on
+
+    return done
+
+
+# Battery recursion over a whole chunk, on the no-outage fast path where it
+# applies and on the stepwise kernel elsewhere. Returns the final status.
+def _battery_steps(eh, params, b_prev, batt_status, eload, ebat_out, ebat_in, b, overflow, fast_path):
+
+    kernel_params = (params.eload_setup, params.nbat_in, params.nbat_out, params.ncc, params.bnom, params.bth,
+                     params.eleak)
+    if not fast_path:
+        return _battery_kernel(eh, *kernel_params, b_prev, batt_status, eload, ebat_out, ebat_in, b, overflow)
+
+    b_max = params.nbat_out * params.bnom
+    ebat_out_on = (params.eload_setup / params.nbat_out) + params.eleak
+    charge = params.nbat_in * params.ncc * eh
+
+    k = 0
+    while k < eh.shape[0]:
+        end = min(eh.shape[0], k + FAST_PATH_BLOCK)
+        if batt_status == 1 and b_prev > b_max - ebat_out_on:
+            # A full battery first comes down to the bounded regime step by step
+            end = k + 1
+        elif batt_status == 1:
+            k += _no_outage_block(charge[k:end], params.eload_setup, ebat_out_on, b_max, b_prev,
+                                  eload[k:end], ebat_out[k:end], ebat_in[k:end], b[k:end], overflow[k:end])
+            b_prev = b[k - 1] if k else b_prev
+            if k == end:
+                continue
+        # Stepwise from the first possible outage to the end of the block
+        batt_status = _battery_kernel(eh[k:end], *kernel_params, b_prev, batt_status,
+                                      eload[k:end], ebat_out[k:end], ebat_in[k:end], b[k:end], overflow[k:end])
+        b_prev = b[end - 1]
+        k = end
+
+    return batt_status
+
+
+#################################################################################
+#
+# Function: initial_state
+#
+# Description: State of a battery at the start of a simulation
+#
+# Input:    params (BatteryParams)
+#
+# Optional: batt_status (initial status of the battery, 1 is on)
+#
+# Output: returns a BatteryState
+#
+#################################################################################
+
+def initial_state(params, batt_status=1):
+
+    return BatteryState(params.binit, batt_status, 0, 0, 0.0, 0.0)
+
+
+# Fraction of harvested energy that overflowed and fraction of lost samples so far
+def state_metrics(state):
+
+    fraction_overflow = state.overflow_sum / (state.charge_sum + 0.000000000000001)  # Added to avoid div by 0 in case
+    fraction_sampleloss = state.n_off / max(state.n_steps, 1)
+
+    return fraction_overflow, fraction_sampleloss
+
+
+#################################################################################
+#
+# Function: simulate_chunk
+#
+# Description: Advances a battery simulation over the next chunk of a harvested
+#              energy time series. Running the chunks of a series one after the
+#              other gives the same trajectories, final state and metrics as
+#              simulating the whole series at once
+#
+# Input:    eh (harvested energy in Wh per minute step for this chunk)
+#           params (BatteryParams)
+#           state (BatteryState at the start of the chunk, see initial_state)
+#
+# Optional: fast_path (vectorized no-outage regime; trajectories agree with the
+#                      stepwise kernel up to rounding. None uses it only when
+#                      numba is not installed, the compiled kernel being about
+#                      as fast; the scripts expose it as --fast-path)
+#
+# Output: returns the SimulationResult of the chunk (its metrics cover every
+#         step since the start of the simulation) and the BatteryState at the
+#         end of the chunk
+#
+#################################################################################
+
+def simulate_chunk(eh, params, state, fast_path=None):
+
+    eh = np.ascontiguousarray(eh, dtype=np.float64)
+    total_sim_steps = eh.shape[0]
+
+    # Creation of vectors to be used in the simulation
+    eload = np.zeros(total_sim_steps)
+    ebat_out = np.zeros(total_sim_steps)
+    ebat_in = np.zeros(total_sim_steps)
+    b = np.zeros(total_sim_steps)
+    overflow = np.zeros(total_sim_steps)
+
+    if fast_path is None:
+        fast_path = not JIT
+    batt_status = _battery_steps(eh, params, state.b, state.batt_status, eload, ebat_out, ebat_in, b, overflow,
+                                 fast_path)
+
+    state = BatteryState(b[-1] if total_sim_steps else state.b, batt_status,
+                         state.n_steps + total_sim_steps,
+                         state.n_off + np.count_nonzero(eload == 0),
+                         sequential_sum(overflow, state.overflow_sum),
+                         sequential_sum(params.nbat_in * params.ncc * eh, state.charge_sum))
+    fraction_overflow, fraction_sampleloss = state_metrics(state)
+
+    return SimulationResult(eload, ebat_out, ebat_in, b, overflow, batt_status, fraction_overflow,
+                            fraction_sampleloss), state
+
+
+#################################################################################
+#
+# Function: simulate
+#
+# Description: Simulates the battery level of the station for a harvested
+#              energy time series (one value per minute step)
+#
+# Input:    eh (harvested energy in Wh per minute step)
+#           params (BatteryParams)
+#
+# Optional: minutes (int64 minute offsets of the harvest samples, e.g. from
+#                    timeseries.minute_offsets; the simulation then covers
+#                    minutes[-1] - minutes[0] steps and the samples after them
+#                    only count in the harvested energy of the overflow
+#                    fraction)
+#           batt_status (initial status of the battery, 1 is on)
+#           fast_path (see simulate_chunk)
+#           verbose
+#
+# Output: returns a SimulationResult with the Eload, Ebat_out, Ebat_in, B and
+#         Overflow trajectories, the final battery status, the fraction of
+#         harvested energy that overflowed and the fraction of lost samples
+#
+#################################################################################
+
+def simulate(eh, params, minutes=None, batt_status=1, fast_path=None, verbose=False):
+
+    eh = np.asarray(eh)
+    result, state = simulate_chunk(_simulation_steps(eh, minutes), params, initial_state(params, batt_status),
+                                   fast_path)
+
+    closing = _closing_samples(eh, minutes)
+    if len(closing):
+        state = state._replace(charge_sum=sequential_sum(params.nbat_in * params.ncc * closing, state.charge_sum))
+        result = result._replace(fraction_overflow=state_metrics(state)[0])
+
+    if verbose==True:
+        print("Percentage overflow: {:.2%}".format(result.fraction_overflow))
+        print("Percentage sample loss: {:.2%}".format(result.fraction_sampleloss))
+
+    return result
+
+
+# Final state and summary metrics of a batch of battery simulations, one entry
+# per (harvest series, parameter set) pair
+BatchResult = collections.namedtuple('BatchResult', ['b', 'batt_status', 'fraction_overflow', 'fraction_sampleloss'])
+
+
+# Battery recursion advancing every scenario in the same pass over time. A
+# scenario simulates steps[s] values of row[s] of eh from column first[s] with
+# parameter set s. Scenario state and counters are updated in place. Compiled
+# for float64 and float32 harvest, the charge is computed in float64.
+@njit(cache=True)
+def _battery_scenario_kernel(eh, row, first, steps, eload_setup, nbat_in, nbat_out, ncc, bnom, bth, eleak,
+                             b, batt_status, n_off, overflow_sum, charge_sum):
+
+    n_scenarios = row.shape[0]
+    n_steps = 0
+    for s in range(n_scenarios):
+        n_steps = max(n_steps, steps[s])
+
+    for k in range(n_steps):
+        for s in range(n_scenarios):
+            if k >= steps[s]:
+                continue
+
+            charge = nbat_in[s] * ncc[s] * eh[row[s], first[s] + k]
+            eload, ebat_out, ebat_in, b[s], overflow, batt_status[s] = _battery_step(
+                charge, b[s], batt_status[s], eload_setup[s], nbat_out[s], nbat_out[s] * bnom[s], bth[s], eleak[s])
+
+            overflow_sum[s] += overflow
+            charge_sum[s] += charge
+
+            if eload == 0:
+                n_off[s] += 1
+
+
+#################################################################################
+#
+# Function: broadcast_params
+#
+# Description: Turns a BatteryParams whose fields are scalars or equal length
+#              vectors into a BatteryParams of contiguous float64 vectors
+#
+# Input:    params (BatteryParams)
+#
+# Output: returns the vectorized BatteryParams
+#
+#################################################################################
+
+def broadcast_params(params):
+
+    fields = np.broadcast_arrays(*[np.atleast_1d(np.asarray(value, dtype=np.float64)) for value in params])
+    if fields[0].ndim != 1:
+        raise ValueError("Error: battery parameters must be scalars or 1-D vectors")
+
+    return BatteryParams(*[np.ascontiguousarray(field) for field in fields])
+
+
+#################################################################################
+#
+# Function: simulate_scenarios
+#
+# Description: Simulates independent scenarios in a single pass over time,
+#              each one on its own harvest row, window and parameter set
+#              (e.g. every site of a fleet with its own sampling interval)
+#
+# Input:    eh (2-D array of harvest rows in Wh per minute step, or a 1-D
+#               series used by every scenario; float64 and float32 memory
+#               maps are read in place)
+#           rows (harvest row of every scenario)
+#           params (BatteryParams, scalars or one value per scenario)
+#
+# Optional: first (first column of every scenario, 0 by default)
+#           steps (steps of every scenario, up to the end of the row by
+#                  default)
+#           closing (samples after the steps of every scenario that only
+#                    count in the harvested energy of its overflow fraction,
+#                    see simulate; 0 by default)
+#           batt_status (initial status of the battery, 1 is on)
+#
+# Output: returns a BatchResult with one entry per scenario
+#
+#################################################################################
+
+def simulate_scenarios(eh, rows, params, first=0, steps=None, closing=0, batt_status=1):
+
+    eh = np.asarray(eh)
+    if eh.ndim == 1:
+        eh = eh[None, :]
+    if eh.dtype != np.float64 and eh.dtype != np.float32:
+        eh = eh.astype(np.float64)
+
+    rows = np.ascontiguousarray(np.atleast_1d(rows), dtype=np.int64)
+    n_scenarios = rows.shape[0]
+    first = np.ascontiguousarray(np.broadcast_to(first, (n_scenarios,)), dtype=np.int64)
+    if steps is None:
+        steps = eh.shape[1] - first
+    steps = np.ascontiguousarray(np.broadcast_to(steps, (n_scenarios,)), dtype=np.int64)
+    closing = np.broadcast_to(np.asarray(closing, dtype=np.int64), (n_scenarios,))
+    if n_scenarios and (first.min() < 0 or (first + steps + closing).max() > eh.shape[1]):
+        raise ValueError("Error: scenario windows must lie within the harvest rows")
+
+    params = BatteryParams(*[np.ascontiguousarray(np.broadcast_to(field, (n_scenarios,)))
+                             for field in broadcast_params(params)])
+
+    b = params.binit.copy()
+    status = np.full(n_scenarios, batt_status, dtype=np.int64)
+    n_off = np.zeros(n_scenarios, dtype=np.int64)
+    overflow_sum = np.zeros(n_scenarios)
+    charge_sum = np.zeros(n_scenarios)
+
+    _battery_scenario_kernel(eh, rows, first, steps, params.eload_setup, params.nbat_in, params.nbat_out, params.ncc,
+                             params.bnom, params.bth, params.eleak, b, status, n_off, overflow_sum, charge_sum)
+
+    for s in np.flatnonzero(closing):
+        end = first[s] + steps[s]
+        charge_sum[s] = sequential_sum(params.nbat_in[s] * params.ncc[s] * eh[rows[s], end:end + closing[s]],
+                                       charge_sum[s])
+
+    fraction_overflow = overflow_sum / (charge_sum + 0.000000000000001)  # Added to avoid div by 0 in case
+    fraction_sampleloss = n_off / np.maximum(steps, 1)
+
+    return BatchResult(b, status, fraction_overflow, fraction_sampleloss)
+
+
+#################################################################################
+#
+# Function: simulate_batch
+#
+# Description: Simulates several scenarios in a single pass over time. Every
+#              harvest series is combined with every parameter set, so a
+#              17 sampling intervals by 6 harvest series study runs once
+#
+# Input:    eh (harvested energy in Wh per minute step, 1-D for a single series
+#               or 2-D with one series per row)
+#           params (BatteryParams, each field a scalar or a vector with one
+#                   entry per parameter set, e.g. built by
+#                   default_params(np.array([1, 2, 5])))
+#
+# Optional: minutes (int64 minute offsets of the harvest samples, see simulate)
+#           batt_status (initial status of the battery, 1 is on)
+#           verbose
+#
+# Output: returns a BatchResult whose fields are arrays shaped
+#         (number of harvest series, number of parameter sets)
+#
+#################################################################################
+
+def simulate_batch(eh, params, minutes=None, batt_status=1, verbose=False):
+
+    eh = np.ascontiguousarray(np.atleast_2d(eh), dtype=np.float64)
+    n_harvest = eh.shape[0]
+    n_steps = _simulation_steps(eh, minutes).shape[1]
+    params = broadcast_params(params)
+    n_params = params.eload_setup.shape[0]
+
+    # One scenario per (harvest series, parameter set) pair, harvest major
+    result = simulate_scenarios(eh, np.repeat(np.arange(n_harvest), n_params),
+                                BatteryParams(*[np.tile(field, n_harvest) for field in params]),
+                                steps=n_steps, closing=eh.shape[1] - n_steps, batt_status=batt_status)
+    b, status, fraction_overflow, fraction_sampleloss = [field.reshape(n_harvest, n_params) for field in result]
+
+    if verbose==True:
+        for h in range(n_harvest):
+            for p in range(n_params):
+                print("Scenario (" + str(h) + ", " + str(p) + ") percentage overflow: {:.2%}, percentage sample loss: {:.2%}"
+                      .format(fraction_overflow[h, p], fraction_sampleloss[h, p]))
+
+    return BatchResult(b, status, fraction_overflow, fraction_sampleloss)
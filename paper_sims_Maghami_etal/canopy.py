@@ -0,0 +1,176 @@
+#################################################################################
+#
+# Module: canopy
+#
+# Description: Per-minute shading factor of a deciduous tree canopy, from a
+#              table of factors given on anchor days (the first day of every
+#              month in the paper). Every minute of an anchor day takes its
+#              factor and the minutes in between are linearly interpolated by
+#              position, as DataFrame.interpolate(method='linear') does after
+#              filling the anchor days: minutes before the first anchor stay
+#              NaN and minutes after the last one keep its factor. Anchor days
+#              are located on the time grid with a binary search on the index
+#              instead of comparing the date of every minute, and profiles are
+#              kept in memory per time grid so the sites sharing a grid reuse
+#              them.
+#
+#################################################################################
+
+import hashlib
+import datetime
+import collections
+import numpy as np
+import pandas as pd
+
+
+# Profiles kept in memory, oldest dropped first
+CACHE_SIZE = 8
+
+_profiles = collections.OrderedDict()
+
+
+#################################################################################
+#
+# Function: monthly_anchors
+#
+# Description: Anchor table of a factor given on the first day of every month
+#
+# Input:    monthly_factors (12 factors, January to December)
+#
+# Output: returns a dict of (month, day) -> factor
+#
+#################################################################################
+
+def monthly_anchors(monthly_factors):
+
+    if len(monthly_factors) != 12:
+        raise ValueError("Error: a monthly table needs 12 factors, January to December")
+
+    return {(month, 1): float(factor) for month, factor in enumerate(monthly_factors, start=1)}
+
+
+#################################################################################
+#
+# Function: daily_anchors
+#
+# Description: Anchor table of a factor given for every day of the year
+#
+# Input:    daily_factors (365 factors, January 1st to December 31st of a non
+#                          leap year; February 29th takes the factor of
+#                          February 28th)
+#
+# Output: returns a dict of (month, day) -> factor
+#
+#################################################################################
+
+def daily_anchors(daily_factors):
+
+    if len(daily_factors) != 365:
+        raise ValueError("Error: a daily table needs 365 factors, January 1st to December 31st")
+
+    anchors = {}
+    for day_of_year, factor in enumerate(daily_factors):
+        day = datetime.date(2001, 1, 1) + datetime.timedelta(days=day_of_year)
+        anchors[(day.month, day.day)] = float(factor)
+    anchors[(2, 29)] = anchors[(2, 28)]
+
+    return anchors
+
+
+# Profile key of a time grid and anchor table
+def _cache_key(index, anchors, years):
+
+    digest = hashlib.sha1()
+    digest.update(str(index.tz).encode())
+    digest.update(repr(sorted(anchors.items())).encode())
+    digest.update(repr(list(years)).encode())
+    digest.update(np.ascontiguousarray(index.asi8).tobytes())
+
+    return digest.hexdigest()
+
+
+#################################################################################
+#
+# Function: compute_profile
+#
+# Description: Per-minute factor of an anchor table on a time grid
+#
+# Input:    index (sorted DatetimeIndex of the time grid; anchor days are local
+#                  days of its time zone)
+#           anchors (dict of (month, day) -> factor, see monthly_anchors)
+#           years (years whose anchor days are filled)
+#
+# Output: returns a float64 NumPy array with one factor per row of the index
+#
+#################################################################################
+
+def compute_profile(index, anchors, years):
+
+    if hasattr(index, 'as_unit'):
+        index = index.as_unit('ns')
+    stamps = index.asi8
+
+    # First and last row of every anchor day on the grid
+    positions = []
+    factors = []
+    for year in years:
+        for (month, day), factor in sorted(anchors.items()):
+            try:
+                first_day = datetime.date(year, month, day)
+            except ValueError:  # February 29th of a non leap year
+                continue
+            start = pd.Timestamp(first_day).tz_localize(index.tz)
+            end = pd.Timestamp(first_day + datetime.timedelta(days=1)).tz_localize(index.tz)
+            first, last = np.searchsorted(stamps, [start.value, end.value])
+            if last > first:
+                positions += [first, last - 1]
+                factors += [factor, factor]
+
+    if not positions:
+        return np.full(len(index), np.nan)
+
+    return np.interp(np.arange(len(index)), np.array(positions, dtype=np.float64), np.array(factors),
+                     left=np.nan)
+
+
+#################################################################################
+#
+# Function: get_profile
+#
+# Description: Per-minute factor of an anchor table, computed once per time
+#              grid
+#
+# Input:    index (DatetimeIndex of the time grid)
+#           anchors (dict of (month, day) -> factor)
+#
+# Optional: years (years whose anchor days are filled; default: every year of
+#                  the index)
+#           verbose
+#
+# Output: returns a read-only float64 NumPy array
+#
+#################################################################################
+
+def get_profile(index, anchors, years=None, verbose=False):
+
+    if years is None:
+        years = range(index[0].year, index[-1].year + 1) if len(index) else []
+
+    key = _cache_key(index, anchors, years)
+    if key in _profiles:
+        _profiles.move_to_end(key)
+        if verbose==True:
+            print('Canopy profile read from the cache')
+        return _profiles[key]
+
+    profile = compute_profile(index, anchors, years)
+    profile.setflags(write=False)
+
+    _profiles[key] = profile
+    while len(_profiles) > CACHE_SIZE:
+        _profiles.popitem(last=False)
+
+    if verbose==True:
+        print('Canopy profile computed for ' + str(len(index)) + ' time steps')
+
+    return profile
@@ -0,0 +1,293 @@
+#################################################################################
+#
+# Module: ensemble
+#
+# Description: Monte Carlo ensembles over the uncertain model constants. Each
+#              member draws multiplicative factors of the harvest sources
+#              (turbine transfer function, PV module, canopy shading, ...) and
+#              battery parameters (charge, discharge and charge controller
+#              efficiencies, ...). Every harvest source is computed once per
+#              site; a member only changes the weights of the sources and its
+#              parameter set, so the members are simulated together in one
+#              pass over time per batch, the harvest of each member being
+#              combined on the fly instead of stored.
+#
+#################################################################################
+
+import collections
+import numpy as np
+import battery
+from battery import njit, _battery_step
+
+
+# Members simulated together in one pass over the sources (their state stays in
+# cache while the sources are read once per batch)
+ENSEMBLE_BATCH = 256
+
+# Percentiles reported by default
+PERCENTILES = (5, 50, 95)
+
+# Probability distribution of one factor or parameter: kind ('fixed',
+# 'uniform', 'triangular' or 'normal') and its parameters
+Distribution = collections.namedtuple('Distribution', ['kind', 'parameters'])
+
+# Harvest factors (dict of factor name -> array) and battery parameters
+# (BatteryParams of arrays) of every member
+Members = collections.namedtuple('Members', ['factors', 'params'])
+
+# Final status and summary metrics of every member
+EnsembleResult = collections.namedtuple('EnsembleResult', ['batt_status', 'fraction_overflow', 'fraction_sampleloss'])
+
+
+def fixed(value):
+    return Distribution('fixed', (float(value),))
+
+
+def uniform(low, high):
+    return Distribution('uniform', (float(low), float(high)))
+
+
+def triangular(low, mode, high):
+    return Distribution('triangular', (float(low), float(mode), float(high)))
+
+
+# Normal distribution truncated to [low, high] (values outside are drawn again)
+def normal(mean, std, low=-np.inf, high=np.inf):
+    return Distribution('normal', (float(mean), float(std), float(low), float(high)))
+
+
+#################################################################################
+#
+# Function: draw
+#
+# Description: Draws values of a distribution
+#
+# Input:    distribution (Distribution)
+#           n (number of values)
+#           rng (numpy Generator)
+#
+# Output: returns a float64 NumPy array of n values
+#
+#################################################################################
+
+def draw(distribution, n, rng):
+
+    kind, parameters = distribution
+    if kind == 'fixed':
+        return np.full(n, parameters[0])
+    if kind == 'uniform':
+        return rng.uniform(parameters[0], parameters[1], n)
+    if kind == 'triangular':
+        return rng.triangular(parameters[0], parameters[1], parameters[2], n)
+    if kind == 'normal':
+        mean, std, low, high = parameters
+        values = rng.normal(mean, std, n)
+        outside = (values < low) | (values > high)
+        while np.any(outside):
+            values[outside] = rng.normal(mean, std, np.count_nonzero(outside))
+            outside = (values < low) | (values > high)
+        return values
+
+    raise ValueError("Error: distribution " + str(kind) + " is not currently supported")
+
+
+#################################################################################
+#
+# Function: draw_members
+#
+# Description: Draws the members of an ensemble. The draws only depend on the
+#              seed and on the order of the factors and battery parameters
+#
+# Input:    n (number of members)
+#           factors (dict of harvest factor name -> Distribution)
+#           params (BatteryParams of the nominal scalar values)
+#
+# Optional: battery_params (dict of BatteryParams field -> Distribution,
+#                           the other fields keep their nominal value)
+#           seed
+#
+# Output: returns a Members
+#
+#################################################################################
+
+def draw_members(n, factors, params, battery_params=None, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    drawn = {name: draw(distribution, n, rng) for name, distribution in factors.items()}
+
+    fields = {field: np.full(n, float(value)) for field, value in params._asdict().items()}
+    for field, distribution in (battery_params or {}).items():
+        if field not in fields:
+            raise ValueError("Error: unknown battery parameter " + str(field))
+        fields[field] = draw(distribution, n, rng)
+
+    return Members(drawn, battery.BatteryParams(**fields))
+
+
+#################################################################################
+#
+# Function: member_weights
+#
+# Description: Weights of the harvest sources of a scenario for every member
+#
+# Input:    weights (dict of source name -> nominal weight, as in
+#                    scenarios.Scenario)
+#           source_factors (dict of source name -> names of the factors
+#                           multiplying it)
+#           sources (names of the sources, in the order of the source matrix)
+#           members (Members)
+#
+# Output: returns a (members, sources) array
+#
+#################################################################################
+
+def member_weights(weights, source_factors, sources, members):
+
+    n = len(members.params.eload_setup)
+    member_weights = np.zeros((n, len(sources)))
+    for name, weight in weights.items():
+        if name not in sources:
+            raise ValueError("Error: unknown harvest source " + str(name))
+        column = np.full(n, float(weight))
+        for factor in source_factors.get(name, ()):
+            column = column * members.factors[factor]
+        member_weights[:, list(sources).index(name)] = column
+
+    return member_weights
+
+
+# Battery recursion of every member in the same pass over time, the harvest of
+# member s being its weighted sum of the source powers (W). Member state and
+# counters are updated in place (battery._battery_step does each minute).
+# Not cached on disk (see battery._battery_step).
+@njit
+def _ensemble_kernel(power, weights, n_steps, eload_setup, nbat_in, nbat_out, ncc, bnom, bth, eleak,
+                     b, batt_status, n_off, overflow_sum, charge_sum):
+
+    n_members = weights.shape[0]
+    n_sources = weights.shape[1]
+
+    for k in range(n_steps):
+        for s in range(n_members):
+
+            harvest = weights[s, 0] * power[0, k]
+            for j in range(1, n_sources):
+                harvest += weights[s, j] * power[j, k]
+            eh = harvest / 60.0 #convert watt-min to watt-hour
+
+            charge = nbat_in[s] * ncc[s] * eh
+            eload, ebat_out, ebat_in, b[s], overflow, batt_status[s] = _battery_step(
+                charge, b[s], batt_status[s], eload_setup[s], nbat_out[s], nbat_out[s] * bnom[s], bth[s], eleak[s])
+
+            overflow_sum[s] += overflow
+            charge_sum[s] += charge
+
+            if eload == 0:
+                n_off[s] += 1
+
+
+#################################################################################
+#
+# Function: simulate_members
+#
+# Description: Simulates the battery of every member, batch_size members per
+#              pass over the harvest sources
+#
+# Input:    power (2-D array with the power in W of one harvest source per
+#                  row, all on the same 1-minute grid)
+#           weights (member weights of the sources, see member_weights)
+#           params (BatteryParams, scalars or one value per member)
+#
+# Optional: minutes (int64 minute offsets of the grid, see battery.simulate)
+#           batch_size
+#           batt_status (initial status of the battery, 1 is on)
+#           verify (simulates every member again with battery.simulate_batch
+#                   on its stored harvest and raises if the results differ;
+#                   one pass over time per member)
+#           verbose
+#
+# Output: returns an EnsembleResult with one entry per member
+#
+#################################################################################
+
+def simulate_members(power, weights, params, minutes=None, batch_size=ENSEMBLE_BATCH, batt_status=1, verify=False,
+                     verbose=False):
+
+    sources = np.atleast_2d(power)
+    closing = np.asarray(battery._closing_samples(sources, minutes), dtype=np.float64)
+    power = np.ascontiguousarray(battery._simulation_steps(sources, minutes), dtype=np.float64)
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    n_members = weights.shape[0]
+    if weights.shape[1] != power.shape[0]:
+        raise ValueError("Error: member weights must have one column per harvest source")
+    params = battery.BatteryParams(*[np.broadcast_to(field, (n_members,))
+                                     for field in battery.broadcast_params(params)])
+
+    status = np.full(n_members, batt_status, dtype=np.int64)
+    n_off = np.zeros(n_members, dtype=np.int64)
+    overflow_sum = np.zeros(n_members)
+    charge_sum = np.zeros(n_members)
+
+    for first in range(0, n_members, batch_size):
+        batch = slice(first, min(first + batch_size, n_members))
+        batch_params = battery.BatteryParams(*[np.ascontiguousarray(field[batch]) for field in params])
+        b = batch_params.binit.copy()
+        _ensemble_kernel(power, np.ascontiguousarray(weights[batch]), power.shape[1], batch_params.eload_setup,
+                         batch_params.nbat_in, batch_params.nbat_out, batch_params.ncc, batch_params.bnom,
+                         batch_params.bth, batch_params.eleak, b, status[batch], n_off[batch], overflow_sum[batch],
+                         charge_sum[batch])
+        if verbose==True:
+            print("Members " + str(batch.start) + " to " + str(batch.stop - 1) + " simulated")
+
+    # Samples after the simulated steps only count in the harvested energy (see battery.simulate)
+    for s in range(n_members if closing.shape[1] else 0):
+        harvest = weights[s, 0] * closing[0]
+        for j in range(1, closing.shape[0]):
+            harvest += weights[s, j] * closing[j]
+        charge_sum[s] = battery.sequential_sum(params.nbat_in[s] * params.ncc[s] * (harvest / 60.0), charge_sum[s])
+
+    fraction_overflow = overflow_sum / (charge_sum + 0.000000000000001)  # Added to avoid div by 0 in case
+    fraction_sampleloss = n_off / max(power.shape[1], 1)
+
+    if verify==True:
+        _verify(sources, weights, params, minutes, batt_status, status, fraction_overflow, fraction_sampleloss)
+
+    return EnsembleResult(status, fraction_overflow, fraction_sampleloss)
+
+
+# Simulates every member separately with battery.simulate_batch on its harvest, summed source by source as in
+# _ensemble_kernel, and checks the results of simulate_members against it
+def _verify(power, weights, params, minutes, batt_status, status, fraction_overflow, fraction_sampleloss):
+
+    for s in range(weights.shape[0]):
+        harvest = weights[s, 0] * power[0]
+        for j in range(1, power.shape[0]):
+            harvest = harvest + weights[s, j] * power[j]
+
+        result = battery.simulate_batch(harvest / 60.0, battery.BatteryParams(*[field[s] for field in params]),
+                                        minutes=minutes, batt_status=batt_status)
+
+        if (result.batt_status[0, 0] != status[s] or
+                not np.allclose([fraction_overflow[s], fraction_sampleloss[s]],
+                                [result.fraction_overflow[0, 0], result.fraction_sampleloss[0, 0]], rtol=1e-12, atol=0)):
+            raise RuntimeError("Error: ensemble member " + str(s) + " does not match its battery.simulate_batch run")
+
+
+#################################################################################
+#
+# Function: percentiles
+#
+# Description: Percentiles of a metric over the members
+#
+# Input:    values (metric of every member)
+#
+# Optional: q (percentiles, see PERCENTILES)
+#
+# Output: returns a dict of percentile -> value
+#
+#################################################################################
+
+def percentiles(values, q=PERCENTILES):
+
+    return dict(zip(q, np.percentile(np.asarray(values, dtype=np.float64), q)))
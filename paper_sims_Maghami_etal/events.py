@@ -0,0 +1,169 @@
+#################################################################################
+#
+# Module: events
+#
+# Description: Event-driven battery simulation. The harvest series is run
+#              length encoded (hydro harvest is exactly zero whenever the flow
+#              is below the turbine cut-in, solar all night) and every run of
+#              constant input is crossed in closed form: while no bound is hit
+#              the battery level changes by the same amount every minute.
+#              Only the minutes around an event (battery full, empty or back
+#              past Bth) are stepped with the per-minute recursion of
+#              battery, so events happen on the same minute as in
+#              battery.simulate; a level that no longer changes is held to the
+#              end of the run.
+#
+#################################################################################
+
+import collections
+import numpy as np
+import battery
+from battery import njit, _battery_step
+
+
+# Battery level and status at the end of every run of constant harvest, final
+# status, summary metrics (as in battery.simulate) and number of closed-form
+# jumps and single steps computed instead of one step per minute
+EventResult = collections.namedtuple('EventResult', ['run_starts', 'b', 'batt_status', 'fraction_overflow',
+                                                     'fraction_sampleloss', 'events'])
+
+
+#################################################################################
+#
+# Function: run_lengths
+#
+# Description: Run length encoding of a series
+#
+# Input:    values
+#
+# Output: returns the first index, length and value of every run of equal
+#         consecutive values
+#
+#################################################################################
+
+def run_lengths(values):
+
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), values[:0]
+
+    starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(values)])))
+
+    return starts, lengths, values[starts]
+
+
+# Crosses every run of constant charge. Closed-form jumps stop one minute short
+# of any bound, the minutes around it go through the per-minute recursion
+# (battery._battery_step) and a step leaving level and status
+# unchanged is repeated to the end of the run. End levels are written in place;
+# returns the final status, off steps, overflow, charge and computed events.
+# Not cached on disk, see battery._battery_step.
+@njit
+def _event_kernel(lengths, charges, eload_setup, nbat_out, bnom, bth, eleak, b_prev, batt_status, b_end):
+
+    b_max = nbat_out * bnom
+    n_off = 0
+    overflow_sum = 0.0
+    charge_sum = 0.0
+    events = 0
+
+    for r in range(lengths.shape[0]):
+        remaining = lengths[r]
+        charge = charges[r]
+        while remaining > 0:
+
+            ebat_out = ((batt_status * eload_setup) / nbat_out) + eleak
+            drift = charge - ebat_out
+
+            # Minutes left before the next possible event, while charge is fully stored and the level moves by drift
+            jump = 0
+            if charge <= b_max - b_prev - ebat_out and b_prev > 0:
+                if drift > 0:
+                    jump = int((b_max - ebat_out - charge - b_prev) / drift)
+                    if batt_status == 0:
+                        jump = min(jump, int((bth - b_prev) / drift) - 1)
+                elif drift < 0:
+                    jump = int(b_prev / -drift) - 1
+                jump = min(jump - 1, remaining - 1)
+
+            if jump > 0:
+                b_prev = b_prev + jump * drift
+                charge_sum += jump * charge
+                if batt_status == 0:
+                    n_off += jump
+                remaining -= jump
+                events += 1
+
+            # One minute of the per-minute recursion
+            eload, ebat_out, ebat_in, b, overflow, status = _battery_step(charge, b_prev, batt_status, eload_setup,
+                                                                          nbat_out, b_max, bth, eleak)
+
+            overflow_sum += overflow
+            charge_sum += charge
+            if eload == 0:
+                n_off += 1
+            remaining -= 1
+            events += 1
+
+            # A step that leaves level and status unchanged repeats itself to the end of the run
+            if b == b_prev and status == batt_status and remaining > 0:
+                overflow_sum += remaining * overflow
+                charge_sum += remaining * charge
+                if eload == 0:
+                    n_off += remaining
+                remaining = 0
+                events += 1
+
+            b_prev = b
+            batt_status = status
+
+        b_end[r] = b_prev
+
+    return batt_status, n_off, overflow_sum, charge_sum, events
+
+
+#################################################################################
+#
+# Function: simulate_events
+#
+# Description: Simulates the battery of the station run by run of constant
+#              harvest instead of minute by minute. Metrics match
+#              battery.simulate up to the rounding of the closed-form jumps
+#
+# Input:    eh (harvested energy in Wh per minute step)
+#           params (BatteryParams)
+#
+# Optional: minutes (int64 minute offsets of the harvest samples, see
+#                    battery.simulate)
+#           batt_status (initial status of the battery, 1 is on)
+#           verbose
+#
+# Output: returns an EventResult
+#
+#################################################################################
+
+def simulate_events(eh, params, minutes=None, batt_status=1, verbose=False):
+
+    eh = np.asarray(eh, dtype=np.float64)
+    closing = battery._closing_samples(eh, minutes)
+    eh = battery._simulation_steps(eh, minutes)
+
+    run_starts, lengths, values = run_lengths(eh)
+    charges = np.ascontiguousarray(params.nbat_in * params.ncc * values)
+    b_end = np.zeros(len(run_starts))
+
+    batt_status, n_off, overflow_sum, charge_sum, events = _event_kernel(
+        lengths, charges, params.eload_setup, params.nbat_out, params.bnom, params.bth, params.eleak,
+        float(params.binit), batt_status, b_end)
+    charge_sum = battery.sequential_sum(params.nbat_in * params.ncc * closing, charge_sum)
+
+    fraction_overflow = overflow_sum / (charge_sum + 0.000000000000001)  # Added to avoid div by 0 in case
+    fraction_sampleloss = n_off / max(len(eh), 1)
+
+    if verbose==True:
+        print("Percentage overflow: {:.2%}".format(fraction_overflow))
+        print("Percentage sample loss: {:.2%}".format(fraction_sampleloss))
+        print(str(events) + " events instead of " + str(len(eh)) + " steps")
+
+    return EventResult(run_starts, b_end, batt_status, fraction_overflow, fraction_sampleloss, events)
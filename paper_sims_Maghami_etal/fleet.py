@@ -0,0 +1,232 @@
+#################################################################################
+#
+# Module: fleet
+#
+# Description: Fleet-wide harvest matrix (sites x minutes) backed by a
+#              memory-mapped .npy file. Every site occupies one row on a
+#              common 1-minute UTC grid; worker processes write their own rows
+#              and the battery kernel reads them back without copies. Fleet
+#              metrics are computed over blocks of minutes so the matrix never
+#              has to fit in memory.
+#
+#################################################################################
+
+import os
+import json
+import collections
+import numpy as np
+import pandas as pd
+import battery
+from timeseries import NS_PER_MINUTE
+
+
+Fleet = collections.namedtuple('Fleet', ['harvest', 'offsets', 'lengths', 'sites', 'start', 'path'])
+
+# Per site energy totals (Wh), means and peaks (Wh per minute) over the valid
+# minutes of every row, and the fleet harvest of every minute of the grid
+FleetMetrics = collections.namedtuple('FleetMetrics', ['sites', 'total_energy', 'mean_energy', 'peak_energy',
+                                                       'minutes', 'fleet_total'])
+
+
+# UTC nanoseconds of a timestamp (naive timestamps are taken as UTC)
+def _utc_ns(timestamp):
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.tz_convert('UTC').as_unit('ns').value
+
+
+#################################################################################
+#
+# Function: create_fleet
+#
+# Description: Creates an empty fleet harvest matrix on disk
+#
+# Input:    path (folder of the fleet files)
+#           sites (list of site keys, one row each)
+#           start, end (first and last minute of the grid, timestamps)
+#
+# Optional: dtype (float32 halves the file size)
+#
+# Output: returns the Fleet, opened for writing
+#
+#################################################################################
+
+def create_fleet(path, sites, start, end, dtype=np.float64):
+
+    start_ns = _utc_ns(start)
+    n_minutes = (_utc_ns(end) - start_ns) // NS_PER_MINUTE + 1
+
+    os.makedirs(path, exist_ok=True)
+    harvest = np.lib.format.open_memmap(os.path.join(path, 'harvest.npy'), mode='w+', dtype=dtype,
+                                        shape=(len(sites), n_minutes))
+    offsets = np.lib.format.open_memmap(os.path.join(path, 'offsets.npy'), mode='w+', dtype=np.int64,
+                                        shape=(len(sites),))
+    lengths = np.lib.format.open_memmap(os.path.join(path, 'lengths.npy'), mode='w+', dtype=np.int64,
+                                        shape=(len(sites),))
+    offsets.flush()
+    lengths.flush()
+
+    with open(os.path.join(path, 'sites.json'), 'w') as f:
+        json.dump({'sites': list(sites), 'start': pd.Timestamp(start_ns, tz='UTC').isoformat(), 'freq': '1min',
+                   'units': 'Wh per minute'}, f, indent=2)
+
+    return Fleet(harvest, offsets, lengths, list(sites), pd.Timestamp(start_ns, tz='UTC'), path)
+
+
+#################################################################################
+#
+# Function: open_fleet
+#
+# Description: Opens an existing fleet harvest matrix
+#
+# Input:    path
+#
+# Optional: mode ('r' to read, 'r+' to let a process write its rows)
+#
+#################################################################################
+
+def open_fleet(path, mode='r'):
+
+    with open(os.path.join(path, 'sites.json')) as f:
+        layout = json.load(f)
+
+    harvest = np.load(os.path.join(path, 'harvest.npy'), mmap_mode=mode)
+    offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mode)
+    lengths = np.load(os.path.join(path, 'lengths.npy'), mmap_mode=mode)
+
+    return Fleet(harvest, offsets, lengths, layout['sites'], pd.Timestamp(layout['start']), path)
+
+
+#################################################################################
+#
+# Function: store_site
+#
+# Description: Writes the harvest series of one site in its row
+#
+# Input:    fleet (opened with mode 'r+' or from create_fleet)
+#           site
+#           eh (harvested energy per minute, Wh)
+#           start (timestamp of the first value of eh)
+#
+#################################################################################
+
+def store_site(fleet, site, eh, start):
+
+    row = fleet.sites.index(site)
+    offset = (_utc_ns(start) - _utc_ns(fleet.start)) // NS_PER_MINUTE
+    length = len(eh)
+    if offset < 0 or offset + length > fleet.harvest.shape[1]:
+        raise ValueError("Site " + str(site) + " does not fit in the fleet time grid")
+
+    fleet.harvest[row, offset:offset + length] = eh
+    fleet.offsets[row] = offset
+    fleet.lengths[row] = length
+    fleet.harvest.flush()
+    fleet.offsets.flush()
+    fleet.lengths.flush()
+
+
+#################################################################################
+#
+# Function: site_harvest
+#
+# Description: Returns the valid part of the row of a site (a view, no copy)
+#
+#################################################################################
+
+def site_harvest(fleet, site):
+
+    row = fleet.sites.index(site)
+
+    return fleet.harvest[row, fleet.offsets[row]:fleet.offsets[row] + fleet.lengths[row]]
+
+
+#################################################################################
+#
+# Function: fleet_metrics
+#
+# Description: Computes the per site and fleet-wide harvest metrics, reading
+#              the matrix in blocks of minutes
+#
+# Input:    fleet
+#
+# Optional: block_bytes (memory budget of one block)
+#
+# Output: returns a FleetMetrics
+#
+#################################################################################
+
+def fleet_metrics(fleet, block_bytes=64 * 2**20):
+
+    n_sites, n_minutes = fleet.harvest.shape
+    offsets = np.asarray(fleet.offsets)
+    ends = offsets + np.asarray(fleet.lengths)
+
+    total_energy = np.zeros(n_sites)
+    peak_energy = np.full(n_sites, -np.inf)
+    fleet_total = np.zeros(n_minutes)
+
+    block = max(1, block_bytes // max(1, n_sites * fleet.harvest.itemsize))
+    for first in range(0, n_minutes, block):
+        last = min(first + block, n_minutes)
+        columns = np.arange(first, last)
+        valid = (columns >= offsets[:, None]) & (columns < ends[:, None])
+        values = np.where(valid, fleet.harvest[:, first:last], 0.0)
+
+        total_energy += values.sum(axis=1)
+        peak_energy = np.maximum(peak_energy, np.where(valid, values, -np.inf).max(axis=1))
+        fleet_total[first:last] = values.sum(axis=0)
+
+    minutes = ends - offsets
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_energy = np.where(minutes > 0, total_energy / minutes, np.nan)
+    peak_energy[minutes == 0] = np.nan
+
+    return FleetMetrics(list(fleet.sites), total_energy, mean_energy, peak_energy, minutes, fleet_total)
+
+
+#################################################################################
+#
+# Function: simulate_fleet
+#
+# Description: Runs the battery simulation of every stored site directly on
+#              its row of the memory-mapped matrix
+#
+# Input:    fleet
+#           params (BatteryParams, scalars or vectors of parameter sets)
+#
+# Optional: batt_status, verbose
+#
+# Output: returns a battery.BatchResult with arrays shaped (sites, parameter
+#         sets); sites without data are NaN. As in the simulation scripts, the
+#         last sample of a site only closes its final step and is not simulated
+#         (its harvest counts in the overflow fraction)
+#
+#################################################################################
+
+def simulate_fleet(fleet, params, batt_status=1, verbose=False):
+
+    params = battery.broadcast_params(params)
+    n_params = params.bnom.shape[0]
+    b = np.full((len(fleet.sites), n_params), np.nan)
+    status = np.zeros((len(fleet.sites), n_params), dtype=np.int64)
+    fraction_overflow = np.full((len(fleet.sites), n_params), np.nan)
+    fraction_sampleloss = np.full((len(fleet.sites), n_params), np.nan)
+
+    for row, site in enumerate(fleet.sites):
+        if fleet.lengths[row] < 2:
+            continue
+        # One scenario per parameter set on the row of the site
+        result = battery.simulate_scenarios(fleet.harvest, np.full(n_params, row), params, first=fleet.offsets[row],
+                                            steps=fleet.lengths[row] - 1, closing=1, batt_status=batt_status)
+        b[row] = result.b
+        status[row] = result.batt_status
+        fraction_overflow[row] = result.fraction_overflow
+        fraction_sampleloss[row] = result.fraction_sampleloss
+
+        if verbose==True:
+            print("Site " + str(site) + ": overflow " + str(fraction_overflow[row]) + ", sample loss " +
+                  str(fraction_sampleloss[row]))
+
+    return battery.BatchResult(b, status, fraction_overflow, fraction_sampleloss)
@@ -0,0 +1,202 @@
+#################################################################################
+#
+# Module: incremental
+#
+# Description: Incremental simulation of a site as new data arrives. The end
+#              of every run is saved as a checkpoint (last raw record, battery
+#              level and status, running energy, overflow and sample loss
+#              totals, byte offset reached in the raw file); the next run only
+#              reads, interpolates and simulates the records appended after
+#              it. Advancing a checkpoint over new
+#              records gives the same results as simulating the whole record
+#              again in one streaming run.
+#
+#################################################################################
+
+import os
+import json
+import tempfile
+import collections
+import numpy as np
+import pandas as pd
+import battery
+import timeseries
+
+
+# Default location of the checkpoints, next to the input data
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_files', 'checkpoints')
+
+CHECKPOINT_VERSION = 2
+
+# State of a site at the end of a run. last_record is the last raw record
+# (UTC nanoseconds, time zone and column values), held_eh the harvest of the
+# last 1-minute sample, which is simulated with the next records, and offset
+# the byte offset of the raw file the next run reads from
+Checkpoint = collections.namedtuple('Checkpoint', ['site', 'params', 'start_ns', 'last_record', 'battery', 'energy',
+                                                   'power_sum', 'n_samples', 'held_eh', 'offset'])
+
+# Summary metrics of a checkpoint, over every minute simulated so far
+CheckpointMetrics = collections.namedtuple('CheckpointMetrics', ['mean_power', 'total_time', 'total_energy',
+                                                                 'average_energy', 'last_minute',
+                                                                 'fraction_overflow', 'fraction_sampleloss'])
+
+
+# Battery parameters as a JSON list, to check a checkpoint is advanced with the parameters it was started with
+def _params_list(params):
+    return [float(value) for value in params]
+
+
+#################################################################################
+#
+# Function: save_checkpoint, load_checkpoint
+#
+# Description: Write and read a checkpoint as JSON (floats round-trip exactly)
+#
+#################################################################################
+
+def save_checkpoint(path, checkpoint):
+
+    values = checkpoint._asdict()
+    values['version'] = CHECKPOINT_VERSION
+    values['battery'] = {'b': float(checkpoint.battery.b), 'batt_status': int(checkpoint.battery.batt_status),
+                         'n_steps': int(checkpoint.battery.n_steps), 'n_off': int(checkpoint.battery.n_off),
+                         'overflow_sum': float(checkpoint.battery.overflow_sum),
+                         'charge_sum': float(checkpoint.battery.charge_sum)}
+    values['energy'] = checkpoint.energy._asdict() if checkpoint.energy is not None else None
+
+    # Written to a temporary file and renamed, so an interrupted run leaves the previous checkpoint intact
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(values, f, indent=2)
+    os.replace(temp_file, path)
+
+
+def load_checkpoint(path):
+
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as f:
+        values = json.load(f)
+    if values.pop('version', None) != CHECKPOINT_VERSION:
+        return None
+
+    values['battery'] = battery.BatteryState(**values['battery'])
+    if values['energy'] is not None:
+        values['energy'] = timeseries.StepEnergyState(**values['energy'])
+
+    return Checkpoint(**values)
+
+
+#################################################################################
+#
+# Function: advance
+#
+# Description: Simulates the records that follow a checkpoint
+#
+# Input:    site
+#           read_records (function of a byte offset of the raw file returning
+#                         an iterable of (raw DataFrame, byte offset after
+#                         it) in chronological order, e.g.
+#                         site_store.hydro_records_from; records at or
+#                         before the checkpoint are skipped)
+#           harvest (function of a 1-minute DataFrame returning the harvested
+#                    power in Watts of every row)
+#           params (BatteryParams)
+#
+# Optional: checkpoint (None starts a new simulation)
+#           chunk_minutes (1-minute rows interpolated and simulated at a time)
+#           T_threshold (minutes, see timeseries.step_energy)
+#           fast_path (see battery.simulate_chunk)
+#
+# Output: returns the Checkpoint at the end of the records
+#
+#################################################################################
+
+def advance(site, read_records, harvest, params, checkpoint=None, chunk_minutes=30*24*60, T_threshold=24*60, fast_path=None):
+
+    if checkpoint is None:
+        checkpoint = Checkpoint(site, _params_list(params), None, None, battery.initial_state(params), None,
+                                0.0, 0, None, 0)
+    elif checkpoint.params != _params_list(params):
+        raise ValueError("Checkpoint of site " + str(site) + " was simulated with other battery parameters")
+
+    resume_ns = checkpoint.last_record['ns'] if checkpoint.last_record is not None else None
+    last_record = {'offset': checkpoint.offset}
+
+    def new_records():
+        if checkpoint.last_record is not None:
+            # The last record of the previous run is the left neighbour of the first new minutes
+            index = pd.DatetimeIndex([pd.Timestamp(resume_ns, tz='UTC')]).tz_convert(checkpoint.last_record['tz'])
+            yield pd.DataFrame({column: [value] for column, value in checkpoint.last_record['values'].items()},
+                               index=index)
+        # Only the bytes appended since the previous run are read and parsed
+        for frame, offset in read_records(checkpoint.offset):
+            last_record['offset'] = offset
+            if resume_ns is not None:
+                frame = frame.loc[frame.index > pd.Timestamp(resume_ns, tz='UTC')]
+            if len(frame):
+                last_record['frame'] = frame.iloc[-1:]
+            yield frame
+
+    start_ns = checkpoint.start_ns
+    state = checkpoint.battery
+    energy = checkpoint.energy
+    power_sum = checkpoint.power_sum
+    n_samples = checkpoint.n_samples
+    held_eh = np.array([checkpoint.held_eh]) if checkpoint.held_eh is not None else np.empty(0)
+
+    for interpolated in timeseries.stream_minutes(new_records(), chunk_minutes):
+
+        index = interpolated.index.as_unit('ns') if hasattr(interpolated.index, 'as_unit') else interpolated.index
+        ns = index.asi8
+        if start_ns is None:
+            start_ns = int(ns[0])
+        minutes = (ns - start_ns) // timeseries.NS_PER_MINUTE
+        if energy is not None:
+            # Minutes up to the last record of the previous run were already simulated
+            new = minutes > energy.last_minute
+            interpolated, minutes = interpolated.loc[new], minutes[new]
+            if len(minutes) == 0:
+                continue
+
+        gen_power = np.asarray(harvest(interpolated), dtype=np.float64)
+
+        step_energy, energy = timeseries.step_energy_chunk(minutes, gen_power, T_threshold, energy)
+        power_sum = timeseries.sequential_sum(gen_power, power_sum)
+        n_samples += len(gen_power)
+
+        # The last sample only closes the final step, it is simulated with the next records
+        Eh = np.concatenate((held_eh, gen_power / 60.0)) #convert watt-min to watt-hour
+        result, state = battery.simulate_chunk(Eh[:-1], params, state, fast_path)
+        held_eh = Eh[-1:]
+
+    if 'frame' not in last_record:
+        # No new records
+        return checkpoint._replace(offset=last_record['offset'])
+
+    frame = last_record['frame']
+    index = frame.index.as_unit('ns') if hasattr(frame.index, 'as_unit') else frame.index
+    record = {'ns': int(index.asi8[0]), 'tz': str(index.tz),
+              'values': {str(column): float(frame[column].iloc[0]) for column in frame.columns}}
+
+    return Checkpoint(site, _params_list(params), start_ns, record, state, energy, power_sum, n_samples,
+                      float(held_eh[0]) if len(held_eh) else None, last_record['offset'])
+
+
+# Summary metrics of everything simulated up to a checkpoint
+def checkpoint_metrics(checkpoint):
+
+    Total_time, Total_energy, Average_Energy = timeseries.energy_totals(checkpoint.energy)
+    state = checkpoint.battery
+    if checkpoint.held_eh is not None:
+        # The held sample only closes the final step, its charge still counts in the harvested energy (see
+        # battery.simulate)
+        params = battery.BatteryParams(*checkpoint.params)
+        state = state._replace(charge_sum=timeseries.sequential_sum([params.nbat_in * params.ncc * checkpoint.held_eh],
+                                                                    state.charge_sum))
+    fraction_overflow, fraction_sampleloss = battery.state_metrics(state)
+
+    return CheckpointMetrics(checkpoint.power_sum / checkpoint.n_samples, Total_time, Total_energy, Average_Energy,
+                             checkpoint.energy.last_minute, fraction_overflow, fraction_sampleloss)
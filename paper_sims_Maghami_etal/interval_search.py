@@ -0,0 +1,162 @@
+#################################################################################
+#
+# Module: interval_search
+#
+# Description: Critical sampling interval of every site, found by bisection
+#              instead of simulating a hand-picked list of intervals. The load
+#              energy Eload_setup decreases with the sampling interval, so the
+#              sample loss decreases and the overflow increases with it: the
+#              intervals meeting a maximum sample loss are [min_interval, ...]
+#              and those meeting a maximum overflow are [..., max_interval].
+#              Every bisection step (of both criteria) runs as one pass of the
+#              battery scenario kernel, over all the sites of a fleet matrix
+#              or over one site at a time for separate series, which are read
+#              where they are instead of being gathered in one buffer.
+#
+#################################################################################
+
+import collections
+import numpy as np
+import battery
+
+
+# Per site smallest interval meeting max_sampleloss and largest interval meeting
+# max_overflow (NaN when no interval of the range does), number of simulated
+# (site, interval) scenarios and of passes over time
+IntervalSearch = collections.namedtuple('IntervalSearch', ['sites', 'min_interval', 'max_interval', 'simulations',
+                                                           'passes'])
+
+
+#################################################################################
+#
+# Function: critical_intervals
+#
+# Description: Bisection of the sampling interval for every site
+#
+# Input:    harvest (dict of site -> harvested energy in Wh per minute step,
+#                    simulated as with battery.simulate)
+#
+# Optional: minutes (dict of site -> int64 minute offsets of its harvest
+#                    samples, see battery.simulate; sites without offsets are
+#                    simulated over their whole series)
+#           max_sampleloss (maximum fraction of lost samples, None skips it)
+#           max_overflow (maximum fraction of overflowed energy, None skips it)
+#           interval_range (smallest and largest sampling interval searched,
+#                           integer minutes)
+#           communication_interval (minutes, None communicates every 24
+#                                   samples, see battery.eload_setup)
+#           params_overrides (dict of other BatteryParams fields, see
+#                             battery.default_params)
+#           verbose
+#
+# Output: returns an IntervalSearch
+#
+#################################################################################
+
+def critical_intervals(harvest, max_sampleloss=0.0, max_overflow=None, interval_range=(1, 60),
+                       communication_interval=None, params_overrides=None, minutes=None, verbose=False):
+
+    sites = list(harvest)
+    minutes = minutes or {}
+    min_interval = np.full(len(sites), np.nan)
+    max_interval = np.full(len(sites), np.nan)
+    simulations = 0
+    passes = 0
+
+    for i, site in enumerate(sites):
+        eh = np.asarray(harvest[site])
+        steps = len(battery._simulation_steps(eh, minutes.get(site)))
+        search = _search([site], eh[None, :], np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                         np.array([steps]), np.array([len(eh) - steps]), max_sampleloss, max_overflow, interval_range,
+                         communication_interval, params_overrides, verbose)
+        min_interval[i], max_interval[i] = search.min_interval[0], search.max_interval[0]
+        simulations += search.simulations
+        passes += search.passes
+
+    return IntervalSearch(sites, min_interval, max_interval, simulations, passes)
+
+
+#################################################################################
+#
+# Function: fleet_intervals
+#
+# Description: Same search on the rows of a fleet harvest matrix (see fleet),
+#              read in place from the memory map
+#
+# Input:    fleet
+#
+# Optional: see critical_intervals
+#
+#################################################################################
+
+def fleet_intervals(fleet, max_sampleloss=0.0, max_overflow=None, interval_range=(1, 60), communication_interval=None,
+                    params_overrides=None, verbose=False):
+
+    rows = np.flatnonzero(np.asarray(fleet.lengths) >= 2)
+
+    # As in the simulation scripts, the last sample of a site only closes its final step
+    return _search([fleet.sites[row] for row in rows], np.asarray(fleet.harvest), rows,
+                   np.asarray(fleet.offsets)[rows], np.asarray(fleet.lengths)[rows] - 1, np.ones(len(rows), dtype=np.int64),
+                   max_sampleloss, max_overflow, interval_range, communication_interval, params_overrides, verbose)
+
+
+# Bisection of the sites simulated on windows of eh (row, first column and steps of every site, followed by its
+# closing samples, see battery.simulate_scenarios)
+def _search(sites, eh, rows, first, steps, closing, max_sampleloss, max_overflow, interval_range, communication_interval,
+            params_overrides, verbose):
+
+    lo, hi = int(interval_range[0]), int(interval_range[1])
+    n_sites = len(sites)
+    params_overrides = params_overrides or {}
+
+    # Smallest interval meeting the sample loss: passing intervals are in [loss_lo, loss_hi), hi + 1 means none
+    loss_lo = np.full(n_sites, lo)
+    loss_hi = np.full(n_sites, hi + 1)
+    # Largest interval meeting the overflow: passing intervals are in (over_lo, over_hi], lo - 1 means none
+    over_lo = np.full(n_sites, lo - 1)
+    over_hi = np.full(n_sites, hi)
+
+    evaluated = {}  # (site index, interval) -> (fraction_sampleloss, fraction_overflow)
+    passes = 0
+    while True:
+        loss_search = (loss_lo < loss_hi) if max_sampleloss is not None else np.zeros(n_sites, dtype=bool)
+        over_search = (over_lo < over_hi) if max_overflow is not None else np.zeros(n_sites, dtype=bool)
+        loss_mid = (loss_lo + loss_hi) // 2
+        over_mid = (over_lo + over_hi + 1) // 2
+
+        candidates = set(zip(np.flatnonzero(loss_search), loss_mid[loss_search]))
+        candidates |= set(zip(np.flatnonzero(over_search), over_mid[over_search]))
+        pending = sorted(candidate for candidate in candidates if candidate not in evaluated)
+        if not candidates:
+            break
+
+        if pending:
+            site_index = np.array([i for i, interval in pending], dtype=np.int64)
+            intervals = np.array([interval for i, interval in pending], dtype=np.float64)
+            params = battery.default_params(intervals, communication_interval, **params_overrides)
+            result = battery.simulate_scenarios(eh, rows[site_index], params, first=first[site_index],
+                                                steps=steps[site_index], closing=closing[site_index])
+            for k, candidate in enumerate(pending):
+                evaluated[candidate] = (result.fraction_sampleloss[k], result.fraction_overflow[k])
+            passes += 1
+            if verbose==True:
+                print("Pass " + str(passes) + ": " + str(len(pending)) + " simulations")
+
+        for i in np.flatnonzero(loss_search):
+            if evaluated[(i, loss_mid[i])][0] <= max_sampleloss:
+                loss_hi[i] = loss_mid[i]
+            else:
+                loss_lo[i] = loss_mid[i] + 1
+        for i in np.flatnonzero(over_search):
+            if evaluated[(i, over_mid[i])][1] <= max_overflow:
+                over_lo[i] = over_mid[i]
+            else:
+                over_hi[i] = over_mid[i] - 1
+
+    min_interval = np.where(loss_lo <= hi, loss_lo, np.nan) if max_sampleloss is not None else np.full(n_sites, np.nan)
+    max_interval = np.where(over_hi >= lo, over_hi, np.nan) if max_overflow is not None else np.full(n_sites, np.nan)
+
+    if verbose==True:
+        print(str(len(evaluated)) + " simulations in " + str(passes) + " passes for " + str(n_sites) + " sites")
+
+    return IntervalSearch(sites, min_interval, max_interval, len(evaluated), passes)
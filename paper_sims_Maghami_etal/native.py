@@ -0,0 +1,306 @@
+#################################################################################
+#
+# Module: native
+#
+# Description: Battery simulation at the native sampling of the flow records
+#              (15 minutes for USGS) instead of on the 1-minute interpolated
+#              series. Between two records the minute flow is the linear
+#              interpolation of resample('1min').interpolate(), so the
+#              turbine power is a polynomial of the minute within each range
+#              of minutes that stays below the cut-in, on the curve or
+#              saturated; its sum over any minutes is computed in closed form.
+#              An interval is crossed at once while the battery stays clear of
+#              its bounds (charge fully stored, level above zero and below
+#              Bth when off), stays full or stays empty. Only the intervals
+#              where the battery reaches a bound or changes status are
+#              stepped minute by minute, with the operations of the battery
+#              kernel, so the results are those of battery.simulate on the
+#              1-minute series up to rounding.
+#
+#              The harvest must be a non-decreasing function of the magnitude
+#              of the interpolated variable (as the turbine curves are). The
+#              solar harvest depends on the sun position of every minute and
+#              is not covered.
+#
+#################################################################################
+
+import collections
+import numpy as np
+from battery import njit, FAST_PATH_GUARD, _battery_step
+
+
+# Power of one device as a polynomial of the magnitude of the harvested
+# variable (coefficients of degree 0 to 3), zero at or below min_value and
+# saturated at or above max_value, times scale (number of devices)
+PolynomialHarvest = collections.namedtuple('PolynomialHarvest', ['coefficients', 'min_value', 'max_value', 'scale'])
+
+# Battery level at every sample after the first, final status, summary
+# metrics (as in battery.simulate), harvested power summed over the simulated
+# minutes (W, the last sample only closes the final step) and number of
+# closed-form intervals and single minutes computed
+NativeResult = collections.namedtuple('NativeResult', ['b', 'batt_status', 'fraction_overflow',
+                                                       'fraction_sampleloss', 'power_sum', 'steps'])
+
+
+#################################################################################
+#
+# Function: waterlilyv2_harvest
+#
+# Description: Second version of the Water Lily turbine transfer function (see
+#              turbine.waterlilyv2_power) as a PolynomialHarvest
+#
+# Optional: turbines (number of turbines)
+#           flow_unit
+#           fluid_density
+#
+# Output: returns a PolynomialHarvest
+#
+#################################################################################
+
+def waterlilyv2_harvest(turbines=2, flow_unit='feet/sec', fluid_density=1000):
+
+    if flow_unit=='feet/sec':
+        # Turbine parameters
+        min_flow = 1.6586 # in feet per second (1.82 Km/h)
+        max_flow = 10.4804 # in feet per second (11.5 Km/h)
+        to_kmh = 1.09728
+    else:
+        if flow_unit=='meters/sec':
+            # Turbine parameters
+            min_flow = 0.5056 # in meters per second (1.82 Km/h)
+            max_flow = 3.1944 # in meters per second (11.5 Km/h)
+            to_kmh = 3.6
+        else:
+            # If flow unit is not feet/sec nor meters/sec
+            raise NameError("Error: flow velocity unit "+flow_unit+" is not currently supported")
+
+    # P = 0.1056*(v_kmh^2) + 0.0669*(v_kmh) - 0.4709 in Watts, proportional to fluid density
+    density = fluid_density/1000
+    coefficients = np.array([-0.4709*density, 0.0669*to_kmh*density, 0.1056*(to_kmh**2)*density, 0.0])
+
+    return PolynomialHarvest(coefficients, min_flow, max_flow, float(turbines))
+
+
+# Harvested power (W) of one interpolated value
+@njit(cache=True)
+def _power(x, coefficients, min_value, max_value, scale):
+
+    a = abs(x)
+    if not a > min_value:
+        return 0.0
+    if a >= max_value:
+        a = max_value
+
+    return scale * (((coefficients[3] * a + coefficients[2]) * a + coefficients[1]) * a + coefficients[0])
+
+
+# 0 below the cut-in, 1 on the curve, 2 saturated
+@njit(cache=True)
+def _regime(x, min_value, max_value):
+
+    a = abs(x)
+    if not a > min_value:
+        return 0
+    if a >= max_value:
+        return 2
+    return 1
+
+
+# End (exclusive) of the minutes from first on with the regime of minute first,
+# the regime being monotone over [first, last)
+@njit(cache=True)
+def _regime_end(x0, slope, first, last, min_value, max_value):
+
+    regime = _regime(slope * first + x0, min_value, max_value)
+    if _regime(slope * (last - 1) + x0, min_value, max_value) == regime:
+        return last
+
+    lo = first
+    hi = last - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if _regime(slope * mid + x0, min_value, max_value) == regime:
+            lo = mid
+        else:
+            hi = mid
+
+    return hi
+
+
+# Harvested power (W) summed over the minutes [first, last) of an interval
+# whose minute values are x0 + slope*j
+@njit(cache=True)
+def _power_sum(x0, slope, first, last, coefficients, min_value, max_value, scale):
+
+    total = 0.0
+    j = first
+    while j < last:
+
+        # The magnitude, hence the regime, is monotone until the interpolated value changes sign
+        positive = slope * j + x0 > 0
+        piece_end = last
+        if (slope * (last - 1) + x0 > 0) != positive:
+            lo = j
+            hi = last - 1
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if (slope * mid + x0 > 0) == positive:
+                    lo = mid
+                else:
+                    hi = mid
+            piece_end = hi
+
+        while j < piece_end:
+            end = _regime_end(x0, slope, j, piece_end, min_value, max_value)
+            regime = _regime(slope * j + x0, min_value, max_value)
+            n = float(end - j)
+            if regime == 2:
+                total += n * _power(max_value, coefficients, min_value, max_value, scale)
+            elif regime == 1:
+                # Polynomial of k = minute - j, summed with the closed forms of sum(k^q) for k < n
+                sign = 1.0 if positive else -1.0
+                u0 = sign * (slope * j + x0)
+                w = sign * slope
+                c0, c1, c2, c3 = coefficients[0], coefficients[1], coefficients[2], coefficients[3]
+                e0 = ((c3 * u0 + c2) * u0 + c1) * u0 + c0
+                e1 = w * ((3 * c3 * u0 + 2 * c2) * u0 + c1)
+                e2 = w * w * (3 * c3 * u0 + c2)
+                e3 = w * w * w * c3
+                s1 = n * (n - 1) / 2
+                s2 = (n - 1) * n * (2 * n - 1) / 6
+                total += scale * (e0 * n + e1 * s1 + e2 * s2 + e3 * s1 * s1)
+            j = end
+
+    return total
+
+
+# Battery recursion interval by interval. Levels at the end of every interval
+# are written in place; returns the final status, off minutes, overflow,
+# charge, power and computed steps
+# Not cached on disk as it calls battery._battery_step.
+@njit
+def _native_kernel(sample_minutes, values, coefficients, min_value, max_value, scale, eload_setup, nbat_in, nbat_out,
+                   ncc, bnom, bth, eleak, b_prev, batt_status, b_end):
+
+    b_max = nbat_out * bnom
+    guard = FAST_PATH_GUARD * b_max
+    n_off = 0
+    overflow_sum = 0.0
+    charge_sum = 0.0
+    power_sum = 0.0
+    steps = 0
+
+    for i in range(sample_minutes.shape[0] - 1):
+        length = sample_minutes[i + 1] - sample_minutes[i]
+        x0 = values[i]
+        slope = (values[i + 1] - values[i]) / length if length > 0 else 0.0
+
+        j = 0
+        while j < length:
+            n = length - j
+            ebat_out = ((batt_status * eload_setup) / nbat_out) + eleak
+
+            # Charge range over the rest of the interval, at its ends unless the flow changes sign
+            x_first = slope * j + x0
+            x_last = slope * (length - 1) + x0
+            c_first = nbat_in * ncc * (_power(x_first, coefficients, min_value, max_value, scale) / 60.0)
+            c_last = nbat_in * ncc * (_power(x_last, coefficients, min_value, max_value, scale) / 60.0)
+            c_max = max(c_first, c_last)
+            c_min = min(c_first, c_last) if (x_first > 0) == (x_last > 0) else 0.0
+
+            # Charge fully stored, level above zero (and below Bth when off) for all the remaining minutes
+            free = (b_prev + max(0.0, (n - 1) * (c_max - ebat_out)) + c_max <= b_max - ebat_out - guard
+                    and b_prev + n * min(0.0, c_min - ebat_out) > guard
+                    and (batt_status == 1 or b_prev + n * max(0.0, c_max - ebat_out) < bth - guard))
+            # Battery kept full, the surplus overflows
+            full = (batt_status == 1 and c_min >= ebat_out
+                    and b_max - 2 * ebat_out - guard <= b_prev <= b_max - ebat_out)
+            # Battery empty and off, the harvest does not cover the leakage
+            empty = batt_status == 0 and b_prev == 0 and c_max <= ebat_out
+
+            if free or full or empty:
+                power = _power_sum(x0, slope, j, length, coefficients, min_value, max_value, scale)
+                charge = nbat_in * ncc * (power / 60.0)
+                if free:
+                    b_prev = b_prev + (charge - n * ebat_out)
+                elif full:
+                    overflow_sum += charge - ((b_max - 2 * ebat_out) - b_prev + n * ebat_out)
+                    b_prev = b_max - 2 * ebat_out
+                if batt_status == 0:
+                    n_off += n
+                power_sum += power
+                charge_sum += charge
+                steps += 1
+                break
+
+            # One minute of the per-minute recursion (see battery._battery_step)
+            power = _power(x_first, coefficients, min_value, max_value, scale)
+            charge = nbat_in * ncc * (power / 60.0)
+            eload, ebat_out, ebat_in, b, overflow, batt_status = _battery_step(charge, b_prev, batt_status, eload_setup,
+                                                                               nbat_out, b_max, bth, eleak)
+            overflow_sum += overflow
+            if eload == 0:
+                n_off += 1
+            power_sum += power
+            charge_sum += charge
+            b_prev = b
+            steps += 1
+            j += 1
+
+        b_end[i] = b_prev
+
+    return batt_status, n_off, overflow_sum, charge_sum, power_sum, steps
+
+
+#################################################################################
+#
+# Function: simulate_native
+#
+# Description: Simulates the battery of the station from the native samples
+#              of the harvested variable, as battery.simulate does on the
+#              series interpolated to 1 minute
+#
+# Input:    sample_minutes (int64 minute offsets of the samples, e.g. from
+#                           timeseries.minute_offsets of the records index)
+#           values (harvested variable at the samples, e.g. flow velocity;
+#                   missing values are dropped as interpolate() fills them)
+#           harvest (PolynomialHarvest)
+#           params (BatteryParams)
+#
+# Optional: batt_status (initial status of the battery, 1 is on)
+#           verbose
+#
+# Output: returns a NativeResult
+#
+#################################################################################
+
+def simulate_native(sample_minutes, values, harvest, params, batt_status=1, verbose=False):
+
+    sample_minutes = np.asarray(sample_minutes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    sample_minutes = np.ascontiguousarray(sample_minutes[valid])
+    values = np.ascontiguousarray(values[valid])
+
+    coefficients = np.ascontiguousarray(harvest.coefficients, dtype=np.float64)
+    b_end = np.zeros(max(len(values) - 1, 0))
+    batt_status, n_off, overflow_sum, charge_sum, power_sum, steps = _native_kernel(
+        sample_minutes, values, coefficients, float(harvest.min_value), float(harvest.max_value),
+        float(harvest.scale), params.eload_setup, params.nbat_in, params.nbat_out, params.ncc, params.bnom, params.bth,
+        params.eleak, float(params.binit), batt_status, b_end)
+    if len(values):
+        # The last sample only closes the final step, its charge still counts in the harvested energy (see
+        # battery.simulate)
+        charge_sum += params.nbat_in * params.ncc * (_power(values[-1], coefficients, float(harvest.min_value),
+                                                            float(harvest.max_value), float(harvest.scale)) / 60.0)
+
+    total_sim_steps = int(sample_minutes[-1] - sample_minutes[0]) if len(sample_minutes) else 0
+    fraction_overflow = overflow_sum / (charge_sum + 0.000000000000001)  # Added to avoid div by 0 in case
+    fraction_sampleloss = n_off / max(total_sim_steps, 1)
+
+    if verbose==True:
+        print("Percentage overflow: {:.2%}".format(fraction_overflow))
+        print("Percentage sample loss: {:.2%}".format(fraction_sampleloss))
+        print(str(steps) + " steps instead of " + str(total_sim_steps) + " minutes")
+
+    return NativeResult(b_end, batt_status, fraction_overflow, fraction_sampleloss, power_sum, steps)
@@ -0,0 +1,71 @@
+#################################################################################
+#
+# Module: parallel
+#
+# Description: Runs independent per-site simulations on a pool of worker
+#              processes. Results are keyed by site so they can be merged into
+#              the site tables in a deterministic order, whatever the order in
+#              which the workers finish.
+#
+#################################################################################
+
+import os
+import concurrent.futures
+
+
+#################################################################################
+#
+# Function: map_sites
+#
+# Description: Calls function(*args) for every site on a process pool
+#
+# Input:    function (module level function, it must be picklable)
+#           site_args (dict of site key -> tuple of arguments)
+#
+# Optional: workers (number of worker processes, defaults to the number of
+#                    CPUs; 1 runs everything in the calling process)
+#           initializer, initargs (run once in each worker before any site,
+#                                  e.g. to load data shared by all sites)
+#           verbose
+#
+# Output: returns a dict of site key -> result, in the order of site_args.
+#         Sites whose simulation raised an exception are reported and left out
+#
+#################################################################################
+
+def map_sites(function, site_args, workers=None, initializer=None, initargs=(), verbose=True):
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(site_args)))
+
+    results = {}
+    if workers == 1:
+        # Serial run in the calling process (useful for debugging and profiling)
+        if initializer is not None:
+            initializer(*initargs)
+        for site, args in site_args.items():
+            try:
+                results[site] = function(*args)
+            except Exception as error:
+                print("Site " + str(site) + " failed: " + repr(error))
+                continue
+            if verbose==True:
+                print("Site " + str(site) + " completed (" + str(len(results)) + " of " + str(len(site_args)) + ")")
+
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                                                    initargs=initargs) as executor:
+            futures = {executor.submit(function, *args): site for site, args in site_args.items()}
+            for future in concurrent.futures.as_completed(futures):
+                site = futures[future]
+                try:
+                    results[site] = future.result()
+                except Exception as error:
+                    print("Site " + str(site) + " failed: " + repr(error))
+                    continue
+                if verbose==True:
+                    print("Site " + str(site) + " completed (" + str(len(results)) + " of " + str(len(site_args)) + ")")
+
+    # Deterministic order, independent of the order in which the sites finished
+    return {site: results[site] for site in site_args if site in results}
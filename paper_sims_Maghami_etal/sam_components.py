@@ -0,0 +1,79 @@
+#################################################################################
+#
+# Module: sam_components
+#
+# Description: Registry of the SAM module and inverter parameter sets used by
+#              the PV simulations. The full SAM tables are only parsed when a
+#              component is not in the cache yet or the cache is stale (new
+#              pvlib release or modified SAM library files); otherwise the
+#              selected parameter sets are loaded from small pickle files.
+#
+#################################################################################
+
+import os
+import glob
+import pickle
+import tempfile
+
+
+# Default location of the cache, next to the input data
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_files', 'cache', 'sam_components')
+
+
+# Identifies the pvlib release and SAM library files the cached parameter sets were read from
+def _fingerprint():
+
+    import pvlib
+
+    library_files = sorted(glob.glob(os.path.join(os.path.dirname(pvlib.__file__), 'data', 'sam-library-*.csv')))
+
+    return (pvlib.__version__,) + tuple((os.path.basename(f), os.path.getmtime(f), os.path.getsize(f))
+                                        for f in library_files)
+
+
+#################################################################################
+#
+# Function: get_component
+#
+# Description: Returns the parameter set of one module or inverter
+#
+# Input:    database (SAM database name as in pvlib.pvsystem.retrieve_sam,
+#                     e.g. 'SandiaMod' or 'cecinverter')
+#           name (column of the component in the database)
+#
+# Optional: cache_dir (None disables the cache)
+#           verbose
+#
+# Output: returns the parameter set as a pandas Series
+#
+#################################################################################
+
+def get_component(database, name, cache_dir=CACHE_DIR, verbose=False):
+
+    fingerprint = _fingerprint()
+
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, database.lower() + '__' + name + '.pkl')
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'rb') as f:
+                cached_fingerprint, component = pickle.load(f)
+            if cached_fingerprint == fingerprint:
+                return component
+            if verbose==True:
+                print("SAM cache of " + name + " is stale")
+
+    import pvlib
+
+    if verbose==True:
+        print("Reading SAM database " + database + " for " + name)
+    component = pvlib.pvsystem.retrieve_sam(database)[name]
+
+    if cache_dir is not None:
+        # Written to a temporary file and renamed, so concurrent workers never read a partial entry
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((fingerprint, component), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+
+    return component
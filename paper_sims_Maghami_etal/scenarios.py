@@ -0,0 +1,279 @@
+#################################################################################
+#
+# Module: scenarios
+#
+# Description: Harvest scenarios declared as weighted combinations of harvest
+#              sources (PV, canopy-reduced PV, turbines, ...). Every source is
+#              computed once as a power series on its own 1-minute grid (the
+#              solar and hydro records do not cover the same period). A
+#              scenario runs on the minutes shared by its sources; scenarios on
+#              the same grid only add one row to the harvest matrix and are
+#              simulated in a single battery pass (battery.simulate_batch).
+#
+#################################################################################
+
+import collections
+import numpy as np
+import battery
+import timeseries
+
+
+# A scenario named name harvests sum(weight * source power) over its weights
+# (dict of source name -> weight, summed in this order)
+Scenario = collections.namedtuple('Scenario', ['name', 'weights'])
+
+# Per scenario harvested energy (sum of the 1-minute power, W.min), average
+# energy in one minute step (Joules, see timeseries.step_energy), number of
+# simulated minutes and battery results shaped (scenarios, parameter sets)
+ScenarioResult = collections.namedtuple('ScenarioResult', ['names', 'energy', 'average_energy', 'steps',
+                                                           'fraction_overflow', 'fraction_sampleloss', 'batt_status'])
+
+
+#################################################################################
+#
+# Function: scenario_grid
+#
+# Description: Timestamps shared by the sources of a scenario
+#
+# Input:    sources (dict of source name -> power in W as a pandas Series
+#                    indexed by the timestamps of its 1-minute grid)
+#           weights (dict of source name -> weight)
+#
+# Output: returns the DatetimeIndex of the minutes covered by every source
+#
+#################################################################################
+
+def scenario_grid(sources, weights):
+
+    if not weights:
+        raise ValueError("Error: a scenario needs at least one source")
+
+    index = None
+    for name in weights:
+        if name not in sources:
+            raise ValueError("Error: unknown harvest source " + str(name))
+        source_index = sources[name].index
+        index = source_index if index is None else index.intersection(source_index)
+
+    if len(index) == 0:
+        raise ValueError("Error: harvest sources " + ", ".join(map(str, weights)) + " have no minute in common")
+
+    return index
+
+
+#################################################################################
+#
+# Function: scenario_grids
+#
+# Description: Groups scenarios by the grid of their sources
+#
+# Input:    sources (see scenario_grid)
+#           scenarios (list of Scenario)
+#
+# Output: returns a list of (grid, positions of its scenarios in the list), in
+#         order of first appearance
+#
+#################################################################################
+
+def scenario_grids(sources, scenarios):
+
+    grids = []
+    for s, scenario in enumerate(scenarios):
+        index = scenario_grid(sources, scenario.weights)
+        for grid in grids:
+            if grid[0].equals(index):
+                grid[1].append(s)
+                break
+        else:
+            grids.append((index, [s]))
+
+    return grids
+
+
+# Power of a source at the timestamps of a grid
+def _on_grid(source, index):
+
+    if source.index.equals(index):
+        return source.to_numpy(dtype=np.float64)
+
+    positions = source.index.get_indexer(index)
+    if np.any(positions < 0):
+        raise ValueError("Error: harvest source " + str(source.name) + " does not cover the scenario grid")
+
+    return source.to_numpy(dtype=np.float64)[positions]
+
+
+#################################################################################
+#
+# Function: source_matrix
+#
+# Description: Power of sources on one grid, one row each
+#
+# Input:    sources (see scenario_grid)
+#           names (source names, in the order of the rows)
+#           index (grid, covered by every source)
+#
+# Output: returns a (sources, minutes) array in W
+#
+#################################################################################
+
+def source_matrix(sources, names, index):
+
+    power = np.empty((len(names), len(index)))
+    for j, name in enumerate(names):
+        if name not in sources:
+            raise ValueError("Error: unknown harvest source " + str(name))
+        power[j] = _on_grid(sources[name], index)
+
+    return power
+
+
+#################################################################################
+#
+# Function: compose
+#
+# Description: Power of one scenario
+#
+# Input:    sources (see scenario_grid)
+#           weights (dict of source name -> weight)
+#
+# Optional: index (grid of the scenario, the minutes shared by its sources by
+#                  default)
+#
+# Output: returns the power array in W on the grid
+#
+#################################################################################
+
+def compose(sources, weights, index=None):
+
+    if index is None:
+        index = scenario_grid(sources, weights)
+
+    power = None
+    for name, weight in weights.items():
+        if name not in sources:
+            raise ValueError("Error: unknown harvest source " + str(name))
+        source = _on_grid(sources[name], index)
+        if power is None:
+            power = weight * source
+        else:
+            power += weight * source
+
+    return power
+
+
+#################################################################################
+#
+# Function: harvest_matrix
+#
+# Description: Power of scenarios on one grid, one row each
+#
+# Input:    sources, scenarios (list of Scenario)
+#
+# Optional: index (common grid, the grid of the first scenario by default)
+#
+# Output: returns a (scenarios, minutes) array in W
+#
+#################################################################################
+
+def harvest_matrix(sources, scenarios, index=None):
+
+    if index is None:
+        index = scenario_grid(sources, scenarios[0].weights)
+
+    power = np.empty((len(scenarios), len(index)))
+    for s, scenario in enumerate(scenarios):
+        power[s] = compose(sources, scenario.weights, index)
+
+    return power
+
+
+#################################################################################
+#
+# Function: run_scenarios
+#
+# Description: Simulates every scenario on the minutes shared by its sources,
+#              in one battery pass per distinct grid
+#
+# Input:    sources (see scenario_grid)
+#           scenarios (list of Scenario)
+#           params (BatteryParams, scalars or vectors of parameter sets)
+#
+# Optional: T_threshold (minutes, see timeseries.step_energy)
+#           verify (simulates every scenario again on its own, its sources
+#                   joined by timestamp with pandas, and raises if the results
+#                   differ)
+#           verbose
+#
+# Output: returns a ScenarioResult
+#
+#################################################################################
+
+def run_scenarios(sources, scenarios, params, T_threshold=24*60, verify=False, verbose=False):
+
+    grids = scenario_grids(sources, scenarios)
+
+    energy = np.empty(len(scenarios))
+    average_energy = np.empty(len(scenarios))
+    steps = np.empty(len(scenarios), dtype=np.int64)
+    fraction_overflow, fraction_sampleloss, batt_status = None, None, None
+
+    for index, members in grids:
+        power = harvest_matrix(sources, [scenarios[s] for s in members], index)
+        minutes = timeseries.minute_offsets(index)
+
+        for row, s in enumerate(members):
+            if verbose==True:
+                print('\n' + scenarios[s].name)
+            energy[s] = timeseries.sequential_sum(power[row])
+            average_energy[s] = timeseries.step_energy(minutes, power[row], T_threshold, verbose=verbose).average_energy
+            steps[s] = minutes[-1]
+
+        Eh = power / 60.0 #convert watt-min to watt-hour
+        result = battery.simulate_batch(Eh, params, minutes=minutes)
+
+        if fraction_overflow is None:
+            shape = (len(scenarios), result.fraction_overflow.shape[1])
+            fraction_overflow, fraction_sampleloss = np.empty(shape), np.empty(shape)
+            batt_status = np.empty(shape, dtype=result.batt_status.dtype)
+        fraction_overflow[members] = result.fraction_overflow
+        fraction_sampleloss[members] = result.fraction_sampleloss
+        batt_status[members] = result.batt_status
+
+    if verify==True:
+        _verify(sources, scenarios, params, energy, steps, fraction_overflow, fraction_sampleloss)
+
+    if verbose==True:
+        for s, scenario in enumerate(scenarios):
+            for p in range(fraction_overflow.shape[1]):
+                print(scenario.name + " percentage overflow: {:.2%}, percentage sample loss: {:.2%}"
+                      .format(fraction_overflow[s, p], fraction_sampleloss[s, p]))
+
+    return ScenarioResult([scenario.name for scenario in scenarios], energy, average_energy, steps, fraction_overflow,
+                          fraction_sampleloss, batt_status)
+
+
+# Simulates every scenario separately (sources aligned by an inner join on their timestamps, one battery.simulate per
+# parameter set) and checks the batched results of run_scenarios against it
+def _verify(sources, scenarios, params, energy, steps, fraction_overflow, fraction_sampleloss):
+
+    import pandas as pd
+
+    params = battery.broadcast_params(params)
+    for s, scenario in enumerate(scenarios):
+        aligned = pd.concat([sources[name].rename(name) for name in scenario.weights], axis=1, join='inner')
+        power = None
+        for name, weight in scenario.weights.items():
+            source = weight * aligned[name].to_numpy(dtype=np.float64)
+            power = source if power is None else power + source
+        minutes = timeseries.minute_offsets(aligned.index)
+
+        expected = [timeseries.sequential_sum(power), minutes[-1]]
+        actual = [energy[s], steps[s]]
+        for p in range(params.eload_setup.shape[0]):
+            result = battery.simulate(power / 60.0, battery.BatteryParams(*[field[p] for field in params]), minutes=minutes)
+            expected += [result.fraction_overflow, result.fraction_sampleloss]
+            actual += [fraction_overflow[s, p], fraction_sampleloss[s, p]]
+
+        if not np.allclose(actual, expected, rtol=1e-12, atol=0):
+            raise RuntimeError("Error: scenario " + scenario.name + " does not match its separate simulation")
@@ -0,0 +1,452 @@
+#################################################################################
+#
+# Module: site_store
+#
+# Description: Columnar store of the preprocessed 1-minute site time series.
+#              The raw flow and weather files are parsed, masked, resampled to
+#              1 minute and interpolated once; each site is then saved as one
+#              folder holding a .npy file per column, the UTC timestamp index
+#              and a schema.json describing them. Simulation scripts read the
+#              columns back (memory-mapped) instead of re-parsing the raw files.
+#              A site entry keeps its files in version folders and a CURRENT
+#              file naming the version to read, so a rewrite switches readers
+#              over atomically.
+#
+#################################################################################
+
+import io
+import os
+import json
+import itertools
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import timeseries
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_files')
+
+# Default location of the store, next to the input data
+STORE_DIR = os.path.join(DATA_DIR, 'store')
+
+HYDRO_DIR = os.path.join(DATA_DIR, 'Hydro_data_files', 'Processed_data')
+SOLAR_DIR = os.path.join(DATA_DIR, 'Solar_data_files')
+
+SCHEMA_VERSION = 2
+
+# File of a site entry naming its current version folder
+POINTER_FILE = 'CURRENT'
+
+
+def timezone_translator_toUTCminusLocaltime(tz):
+    return {
+        'US/Eastern': '05:00:00',
+        'US/Central': '06:00:00',
+        'US/Mountain': '07:00:00',
+        'US/Pacific': '08:00:00',
+    }.get(tz, None)
+
+
+def timezone_translator_formasking(tz):
+    return {
+        'US/Eastern': '-0500',
+        'US/Central': '-0600',
+        'US/Mountain': '-0700',
+        'US/Pacific': '-0800'
+    }.get(tz, None)
+
+
+# Simulation period of the hydro data, in local standard time
+def simulation_period(time_zone):
+    return (pd.Timestamp('2010-01-01 01:00:00' + timezone_translator_formasking(time_zone)),
+            pd.Timestamp('2015-01-01 00:00:00' + timezone_translator_formasking(time_zone)))
+
+
+#################################################################################
+#
+# Function: write_site
+#
+# Description: Saves a time series frame to the store
+#
+# Input:    key (name of the site entry, e.g. 'hydro_04092750')
+#           frame (DataFrame of numeric columns with a tz-aware DatetimeIndex)
+#
+# Optional: store_dir
+#           source (dict of JSON values identifying the inputs, e.g. the raw
+#                   file and its modification time, see has_site)
+#
+# Output: returns the path of the site entry
+#
+#################################################################################
+
+def write_site(key, frame, store_dir=STORE_DIR, source=None):
+
+    index = frame.index
+    if hasattr(index, 'as_unit'):
+        index = index.as_unit('ns')
+
+    schema = {'version': SCHEMA_VERSION,
+              'key': key,
+              'tz': str(index.tz),
+              'start': index[0].isoformat() if len(index) else None,
+              'freq': index.freqstr if index.freq is not None else None,
+              'length': len(index),
+              'index': {'name': index.name, 'file': 'timestamp.npy', 'dtype': 'int64', 'unit': 'ns', 'reference': 'UTC'},
+              'columns': [],
+              'source': source}
+
+    # Written to a new version folder that the pointer file is switched to once complete, so concurrent workers never
+    # read a partial entry nor miss the entry while it is replaced
+    entry_dir = os.path.join(store_dir, key)
+    os.makedirs(entry_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=entry_dir, prefix='v_')
+
+    np.save(os.path.join(temp_dir, 'timestamp.npy'), np.ascontiguousarray(index.asi8))
+    for i, column in enumerate(frame.columns):
+        values = frame[column].to_numpy()
+        # Column names are free text (e.g. 'DNI (W/m^2))'), so the files are numbered
+        column_file = 'column_' + str(i) + '.npy'
+        np.save(os.path.join(temp_dir, column_file), np.ascontiguousarray(values))
+        schema['columns'].append({'name': str(column), 'file': column_file, 'dtype': values.dtype.str})
+
+    with open(os.path.join(temp_dir, 'schema.json'), 'w') as f:
+        json.dump(schema, f, indent=2)
+
+    replaced = _current_version(entry_dir)
+    pointer_fd, pointer_file = tempfile.mkstemp(dir=entry_dir, prefix='pointer_')
+    with os.fdopen(pointer_fd, 'w') as f:
+        f.write(os.path.basename(temp_dir))
+    os.replace(pointer_file, os.path.join(entry_dir, POINTER_FILE))
+
+    # Only the version this write replaced is removed, readers that still use it retry on the current version (see
+    # read_site). Other version folders may be in-progress writes of concurrent workers and are left alone
+    if replaced is not None and replaced != _current_version(entry_dir):
+        shutil.rmtree(os.path.join(entry_dir, replaced), ignore_errors=True)
+
+    return entry_dir
+
+
+# Name of the current version folder of a site entry, None if it is not stored
+def _current_version(entry_dir):
+
+    try:
+        with open(os.path.join(entry_dir, POINTER_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+# Folder holding the files of the current version of a site entry, None if it is not stored
+def _version_dir(key, store_dir):
+
+    version = _current_version(os.path.join(store_dir, key))
+
+    return None if version is None else os.path.join(store_dir, key, version)
+
+
+#################################################################################
+#
+# Function: read_schema
+#
+# Description: Returns the schema of a site entry, None if it is not stored
+#
+#################################################################################
+
+def read_schema(key, store_dir=STORE_DIR):
+
+    version_dir = _version_dir(key, store_dir)
+    if version_dir is None:
+        return None
+
+    try:
+        with open(os.path.join(version_dir, 'schema.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Replaced while it was read
+        return read_schema(key, store_dir) if _version_dir(key, store_dir) != version_dir else None
+
+
+#################################################################################
+#
+# Function: has_site
+#
+# Description: Checks whether a site entry is stored and up to date
+#
+# Input:    key
+#
+# Optional: store_dir
+#           source (when given, it must equal the source the entry was
+#                   written with)
+#
+#################################################################################
+
+def has_site(key, store_dir=STORE_DIR, source=None):
+
+    schema = read_schema(key, store_dir)
+    if schema is None or schema.get('version') != SCHEMA_VERSION:
+        return False
+
+    return source is None or schema.get('source') == source
+
+
+#################################################################################
+#
+# Function: read_site
+#
+# Description: Loads a site entry from the store
+#
+# Input:    key
+#
+# Optional: columns (list of column names, all columns by default)
+#           store_dir
+#           mmap_mode ('r' maps the column files, None reads them in memory)
+#
+# Output: returns a DataFrame indexed by the timestamps in the stored time zone,
+#         its columns are the memory-mapped arrays themselves (not copied)
+#
+#################################################################################
+
+def read_site(key, columns=None, store_dir=STORE_DIR, mmap_mode='r'):
+
+    while True:
+        version_dir = _version_dir(key, store_dir)
+        if version_dir is None:
+            raise FileNotFoundError("Site " + key + " is not in the store " + store_dir)
+        try:
+            return _read_version(version_dir, columns, mmap_mode)
+        except FileNotFoundError:
+            # The entry was rewritten and this version removed while it was read, read the new version
+            if _version_dir(key, store_dir) == version_dir:
+                raise
+
+
+# Loads the files of one version folder of a site entry (see read_site)
+def _read_version(version_dir, columns, mmap_mode):
+
+    with open(os.path.join(version_dir, 'schema.json')) as f:
+        schema = json.load(f)
+
+    timestamps = np.load(os.path.join(version_dir, schema['index']['file']), mmap_mode=mmap_mode)
+    index = pd.DatetimeIndex(np.asarray(timestamps).view('datetime64[ns]')).tz_localize('UTC').tz_convert(schema['tz'])
+    index.name = schema['index']['name']
+    if schema['freq'] is not None:
+        index.freq = schema['freq']
+
+    stored_columns = {column['name']: column['file'] for column in schema['columns']}
+    if columns is None:
+        columns = list(stored_columns)
+
+    # Without copy=False the frame constructor copies every column into memory
+    return pd.DataFrame({column: np.load(os.path.join(version_dir, stored_columns[column]), mmap_mode=mmap_mode)
+                         for column in columns}, index=index, copy=False)
+
+
+# Identifies a raw input file and the time zone its records are converted to
+def _source(path, tz):
+    return {'file': os.path.basename(path), 'mtime': os.path.getmtime(path), 'tz': tz}
+
+
+#################################################################################
+#
+# Function: hydro_samples, hydro_minutes
+#
+# Description: Reads a time zone converted USGS flow file and keeps the
+#              2010-2014 simulation period, at the native sampling of the file
+#              (hydro_samples) or interpolated to 1 minute (hydro_minutes)
+#
+# Input:    USGS_site_file (file name in Hydro_data_files/Processed_data)
+#           time_zone
+#
+# Output: returns a DataFrame with the 'flow' column
+#
+#################################################################################
+
+def hydro_samples(USGS_site_file, time_zone):
+
+    df = pd.read_csv(os.path.join(HYDRO_DIR, USGS_site_file))
+
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True).dt.tz_convert(time_zone)
+    df.set_index('timestamp', inplace=True)
+
+    start, end = simulation_period(time_zone)
+
+    return df.loc[(df.index >= start) & (df.index <= end)]
+
+
+def hydro_minutes(USGS_site_file, time_zone):
+
+    return hydro_samples(USGS_site_file, time_zone).resample('1min').interpolate(method='linear')
+
+
+#################################################################################
+#
+# Function: hydro_records, hydro_records_from, stream_hydro
+#
+# Description: Same series as hydro_minutes, read in chunks of records
+#              (hydro_records), from a byte offset of the file on
+#              (hydro_records_from) and interpolated in bounded chunks of
+#              minutes (stream_hydro, see timeseries.stream_minutes)
+#
+# Input:    USGS_site_file
+#           time_zone
+#
+# Optional: offset (byte offset returned with an earlier chunk, see
+#                   _csv_chunks)
+#           chunk_minutes (rows of the yielded chunks, 30 days by default)
+#           rows (records read from the file at a time)
+#           open_ended (keeps the records after the end of the simulation
+#                       period, for incremental runs on new data)
+#
+# Output: yield DataFrames with the 'flow' column (hydro_records_from yields
+#         them with the byte offset of the record after each one)
+#
+#################################################################################
+
+def hydro_records(USGS_site_file, time_zone, rows=100000, open_ended=False):
+
+    for df in pd.read_csv(os.path.join(HYDRO_DIR, USGS_site_file), chunksize=rows):
+        yield _hydro_frame(df, time_zone, open_ended)
+
+
+def hydro_records_from(USGS_site_file, time_zone, offset=0, rows=100000, open_ended=False):
+
+    for df, offset in _csv_chunks(os.path.join(HYDRO_DIR, USGS_site_file), offset, rows):
+        yield _hydro_frame(df, time_zone, open_ended), offset
+
+
+# Raw flow records indexed by local time and masked to the simulation period (see hydro_records)
+def _hydro_frame(df, time_zone, open_ended):
+
+    start, end = simulation_period(time_zone)
+
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True).dt.tz_convert(time_zone)
+    df.set_index('timestamp', inplace=True)
+    if open_ended==True:
+        return df.loc[df.index >= start]
+
+    return df.loc[(df.index >= start) & (df.index <= end)]
+
+
+def stream_hydro(USGS_site_file, time_zone, chunk_minutes=30*24*60, rows=100000):
+
+    return timeseries.stream_minutes(hydro_records(USGS_site_file, time_zone, rows), chunk_minutes)
+
+
+#################################################################################
+#
+# Function: solar_minutes
+#
+# Description: Reads the concatenated SolarAnywhere weather file of a site
+#              (local standard time) and interpolates it to 1 minute
+#
+# Input:    USGSSiteID
+#           tz
+#
+# Output: returns a DataFrame with the irradiance, temperature and wind columns
+#
+#################################################################################
+
+def solar_minutes(USGSSiteID, tz):
+
+    df = pd.read_csv(os.path.join(SOLAR_DIR, 'concatenate_' + USGSSiteID + '.csv'), encoding="ISO-8859-1",
+                     dtype={'site_no': str})
+
+    return _solar_frame(df, tz).resample('1min').interpolate(method='linear')
+
+
+# Records of the SolarAnywhere weather file of a site, read in chunks (see solar_minutes)
+def solar_records(USGSSiteID, tz, rows=100000):
+
+    for df in pd.read_csv(os.path.join(SOLAR_DIR, 'concatenate_' + USGSSiteID + '.csv'), encoding="ISO-8859-1",
+                          dtype={'site_no': str}, chunksize=rows):
+        yield _solar_frame(df, tz)
+
+
+# Same records from a byte offset of the file on, each chunk with the byte offset of the record after it (see
+# _csv_chunks)
+def solar_records_from(USGSSiteID, tz, offset=0, rows=100000):
+
+    for df, offset in _csv_chunks(os.path.join(SOLAR_DIR, 'concatenate_' + USGSSiteID + '.csv'), offset, rows,
+                                  encoding="ISO-8859-1", dtype={'site_no': str}):
+        yield _solar_frame(df, tz), offset
+
+
+# Weather records indexed by local time, the file being in local standard time
+def _solar_frame(df, tz):
+
+    df['Date_Time'] = pd.to_datetime(df['Date_Time']) + pd.Timedelta(timezone_translator_toUTCminusLocaltime(tz))
+    df['Date_Time'] = df['Date_Time'].dt.tz_localize('UTC')
+    df.set_index('Date_Time', inplace=True)
+    df.index = df.index.tz_convert(tz)
+
+    return df
+
+
+# Records of a CSV file from the byte offset of a record on, parsed rows at a time with the header of the file. Every
+# chunk is yielded with the byte offset of the record after it, so a later run reads only what was appended since.
+# An offset beyond the end of the file or inside a line (the file was rewritten) reads the file from its first record.
+# A last line without its end of line is left for the next run, as it may still be being written
+def _csv_chunks(path, offset=0, rows=100000, **kwargs):
+
+    with open(path, 'rb') as f:
+        header = f.readline()
+        first = f.tell()
+        if offset > first:
+            f.seek(offset - 1)
+            if f.read(1) != b'\n':
+                offset = first
+        else:
+            offset = first
+        f.seek(offset)
+
+        while True:
+            lines = list(itertools.islice(f, rows))
+            partial = len(lines) > 0 and not lines[-1].endswith(b'\n')
+            if partial:
+                lines.pop()
+            if not lines:
+                return
+            block = b''.join(lines)
+            offset += len(block)
+            yield pd.read_csv(io.BytesIO(header + block), **kwargs), offset
+            if partial:
+                return
+
+
+#################################################################################
+#
+# Function: load_hydro, load_solar
+#
+# Description: Return the 1-minute series of a site from the store, after
+#              (re)building the entry when it is missing or its raw file or
+#              time zone changed
+#
+# Output: returns a DataFrame (see hydro_minutes and solar_minutes)
+#
+#################################################################################
+
+def load_hydro(USGS_site_file, time_zone, store_dir=STORE_DIR, verbose=False):
+
+    key = 'hydro_' + os.path.splitext(USGS_site_file)[0]
+    source = _source(os.path.join(HYDRO_DIR, USGS_site_file), time_zone)
+
+    if not has_site(key, store_dir, source):
+        if verbose==True:
+            print("Preprocessing " + USGS_site_file)
+        write_site(key, hydro_minutes(USGS_site_file, time_zone), store_dir, source)
+
+    return read_site(key, store_dir=store_dir)
+
+
+def load_solar(USGSSiteID, tz, store_dir=STORE_DIR, verbose=False):
+
+    key = 'solar_' + USGSSiteID
+    source = _source(os.path.join(SOLAR_DIR, 'concatenate_' + USGSSiteID + '.csv'), tz)
+
+    if not has_site(key, store_dir, source):
+        if verbose==True:
+            print("Preprocessing solar data of " + USGSSiteID)
+        write_site(key, solar_minutes(USGSSiteID, tz), store_dir, source)
+
+    return read_site(key, store_dir=store_dir)
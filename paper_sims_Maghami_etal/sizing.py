@@ -0,0 +1,158 @@
+#################################################################################
+#
+# Module: sizing
+#
+# Description: Minimum battery capacity giving zero sample loss, computed in a
+#              single pass over the harvest instead of simulating a grid of
+#              capacities. While the station never runs out, every step draws
+#              o = Eload_setup/Nbat_out + Eleak and the charge is capped so the
+#              battery level stays at most b_max - 2*o (b_max = Nbat_out*Bnom).
+#              The distance to that cap follows the drawdown recursion
+#              dd = max(0, dd - (charge - o)), so the battery never empties as
+#              long as b_max > 2*o + max(dd). The battery is assumed to start
+#              full, as in the paper (Binit = Bnom). The first two steps store
+#              no charge and bring it down to min(b_max, Binit - o) - o, at
+#              dd = max(-o, b_max - Binit) below the cap; with a small Bnom
+#              (Binit - b_max < o) this start depends on the capacity sized, so
+#              the minimum is solved in closed form from the drawdown after the
+#              third step and the largest cumulated deficit from the third step
+#              on (see min_capacity).
+#
+#################################################################################
+
+import collections
+import numpy as np
+import battery
+from battery import njit
+
+
+# Nominal capacity Bnom and usable capacity b_max (Wh) just above the minimum,
+# largest drawdown (Wh) and, when verified, fraction of lost samples of the full
+# battery model with that capacity (NaN otherwise)
+CapacitySizing = collections.namedtuple('CapacitySizing', ['bnom', 'capacity', 'max_drawdown', 'sampleloss'])
+
+# Same per site of a fleet, as arrays
+FleetSizing = collections.namedtuple('FleetSizing', ['sites', 'bnom', 'capacity', 'max_drawdown', 'sampleloss'])
+
+# Steps of a full battery that store no charge (the level stays above b_max - o)
+TRANSIENT_STEPS = 2
+
+
+# Largest distance below the charge cap when the first step starts at the cap
+# and largest deficit sum(o - charge) of the steps from the first on (at least
+# zero), one pass
+@njit(cache=True)
+def _drawdown_kernel(eh, charge_efficiency, ebat_out):
+
+    dd = 0.0
+    max_dd = 0.0
+    deficit = 0.0
+    max_deficit = 0.0
+    for k in range(eh.shape[0]):
+        gain = charge_efficiency * eh[k] - ebat_out
+        deficit -= gain
+        max_deficit = max(max_deficit, deficit)
+        if k > 0:
+            dd = max(0.0, dd - gain)
+            max_dd = max(max_dd, dd)
+
+    return max_dd, max_deficit
+
+
+#################################################################################
+#
+# Function: min_capacity
+#
+# Description: Minimum battery capacity of one harvest series
+#
+# Input:    eh (harvested energy in Wh per minute step)
+#           params (BatteryParams; Bnom is sized, Binit and Bth keep their
+#                   ratio to it)
+#
+# Optional: minutes (int64 minute offsets of the harvest samples, see
+#                    battery.simulate)
+#           margin (relative margin above the minimum, which itself still
+#                   empties the battery once)
+#           verify (runs the full battery model with the sized capacity)
+#           verbose
+#
+# Output: returns a CapacitySizing
+#
+#################################################################################
+
+def min_capacity(eh, params, minutes=None, margin=1e-9, verify=False, verbose=False):
+
+    if params.binit < params.nbat_out * params.bnom:
+        raise ValueError("Error: battery sizing assumes the battery starts full (Binit >= Nbat_out*Bnom)")
+
+    eh = np.asarray(eh)
+    if eh.dtype != np.float64 and eh.dtype != np.float32:
+        # float32 rows of a fleet are read in place, the drawdown is computed in float64
+        eh = eh.astype(np.float64)
+    if minutes is not None:
+        eh = eh[:int(minutes[-1] - minutes[0])]
+
+    ebat_out = params.eload_setup / params.nbat_out + params.eleak
+    max_dd, max_deficit = _drawdown_kernel(np.ascontiguousarray(eh[TRANSIENT_STEPS:]), params.nbat_in * params.ncc,
+                                           ebat_out)
+
+    # The step after the transient starts at dd0 = max(-o, b_max - Binit) <= 0 below the cap, with Binit = ratio*b_max,
+    # and the drawdown is max(max_dd, dd0 + max_deficit) from then on. b_max > 2*o + dd0 + max_deficit holds for
+    # b_max > o + max_deficit and ratio*b_max > 2*o + max_deficit
+    ratio = params.binit / (params.nbat_out * params.bnom)
+    minimum = max(max_dd + 2 * ebat_out, max_deficit + ebat_out, (max_deficit + 2 * ebat_out) / ratio)
+    max_drawdown = minimum - 2 * ebat_out
+
+    capacity = minimum * (1 + margin)
+    bnom = capacity / params.nbat_out
+
+    sampleloss = np.nan
+    if verify==True:
+        sized = params._replace(bnom=bnom, binit=bnom * params.binit / params.bnom,
+                                bth=bnom * params.bth / params.bnom)
+        sampleloss = battery.simulate(eh, sized).fraction_sampleloss
+
+    if verbose==True:
+        print("Minimum Bnom: {:.4f} Wh (largest drawdown {:.4f} Wh)".format(bnom, max_drawdown))
+        if verify==True:
+            print("Percentage sample loss with this Bnom: {:.2%}".format(sampleloss))
+
+    return CapacitySizing(bnom, capacity, max_drawdown, sampleloss)
+
+
+#################################################################################
+#
+# Function: fleet_capacities
+#
+# Description: Minimum battery capacity of every site of a fleet harvest
+#              matrix (see fleet), read in place from the memory map
+#
+# Input:    fleet
+#           params (BatteryParams)
+#
+# Optional: see min_capacity
+#
+# Output: returns a FleetSizing (sites without data are NaN)
+#
+#################################################################################
+
+def fleet_capacities(fleet, params, margin=1e-9, verify=False, verbose=False):
+
+    n_sites = len(fleet.sites)
+    bnom = np.full(n_sites, np.nan)
+    capacity = np.full(n_sites, np.nan)
+    max_drawdown = np.full(n_sites, np.nan)
+    sampleloss = np.full(n_sites, np.nan)
+
+    for row, site in enumerate(fleet.sites):
+        if fleet.lengths[row] < 2:
+            continue
+        # As in the simulation scripts, the last sample of a site only closes its final step
+        eh = fleet.harvest[row, fleet.offsets[row]:fleet.offsets[row] + fleet.lengths[row] - 1]
+        sizing = min_capacity(eh, params, margin=margin, verify=verify)
+        bnom[row], capacity[row], max_drawdown[row], sampleloss[row] = sizing
+
+        if verbose==True:
+            print("Site " + str(site) + ": minimum Bnom {:.4f} Wh".format(sizing.bnom))
+
+    return FleetSizing(list(fleet.sites), bnom, capacity, max_drawdown, sampleloss)
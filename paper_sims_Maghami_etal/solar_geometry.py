@@ -0,0 +1,130 @@
+#################################################################################
+#
+# Module: solar_geometry
+#
+# Description: Persistent cache of the solar position and array geometry used
+#              by the PV simulations. Zenith, azimuth, airmass, extraterrestrial
+#              DNI and angle of incidence depend only on the site location,
+#              the surface orientation and the time grid, so they are computed
+#              once with pvlib, stored as raw .npy arrays and memory-mapped on
+#              every later run.
+#
+#################################################################################
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+# Default location of the cache, next to the input data
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_files', 'cache', 'solar_geometry')
+
+# Cached quantities
+FIELDS = ['apparent_zenith', 'azimuth', 'airmass_relative', 'airmass_absolute', 'dni_extra', 'aoi']
+
+
+# Cache key of a site, orientation and time grid (the time grid enters through its UTC nanoseconds)
+def _cache_key(times, latitude, longitude, altitude, surface_tilt, surface_azimuth, dtype):
+
+    import pvlib
+
+    if hasattr(times, 'as_unit'):
+        times = times.as_unit('ns')
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps([float(latitude), float(longitude), float(altitude), float(surface_tilt),
+                              float(surface_azimuth), np.dtype(dtype).str, pvlib.__version__]).encode())
+    digest.update(np.ascontiguousarray(times.asi8).tobytes())
+
+    return digest.hexdigest()
+
+
+#################################################################################
+#
+# Function: compute_geometry
+#
+# Description: Computes the solar position and array geometry with pvlib
+#
+# Input:    times (DatetimeIndex of the time grid)
+#           latitude
+#           longitude
+#           altitude (meters)
+#           surface_tilt
+#           surface_azimuth
+#
+# Output: returns a dict of FIELDS -> float64 NumPy arrays
+#
+#################################################################################
+
+def compute_geometry(times, latitude, longitude, altitude, surface_tilt, surface_azimuth):
+
+    import pvlib
+
+    solpos = pvlib.solarposition.get_solarposition(times, latitude, longitude)
+    dni_extra = pvlib.irradiance.get_extra_radiation(times)
+    airmass = pvlib.atmosphere.get_relative_airmass(solpos['apparent_zenith'])
+    pressure = pvlib.atmosphere.alt2pres(altitude)
+    am_abs = pvlib.atmosphere.get_absolute_airmass(airmass, pressure)
+    aoi = pvlib.irradiance.aoi(surface_tilt, surface_azimuth, solpos['apparent_zenith'], solpos['azimuth'])
+
+    return {'apparent_zenith': np.asarray(solpos['apparent_zenith'], dtype=np.float64),
+            'azimuth': np.asarray(solpos['azimuth'], dtype=np.float64),
+            'airmass_relative': np.asarray(airmass, dtype=np.float64),
+            'airmass_absolute': np.asarray(am_abs, dtype=np.float64),
+            'dni_extra': np.asarray(dni_extra, dtype=np.float64),
+            'aoi': np.asarray(aoi, dtype=np.float64)}
+
+
+#################################################################################
+#
+# Function: get_geometry
+#
+# Description: Returns the solar position and array geometry of a site, from
+#              the cache when it was already computed for the same inputs
+#
+# Input:    same as compute_geometry
+#
+# Optional: cache_dir (None disables the cache)
+#           dtype (storage type of the cached arrays, float32 halves the size
+#                  at the cost of about 1e-7 relative precision)
+#           as_series (wraps the arrays in pandas Series indexed by times)
+#
+# Output: returns a dict of FIELDS -> arrays (read-only memory maps when
+#         loaded from the cache) or Series
+#
+#################################################################################
+
+def get_geometry(times, latitude, longitude, altitude, surface_tilt, surface_azimuth, cache_dir=CACHE_DIR,
+                 dtype=np.float64, as_series=True):
+
+    if cache_dir is None:
+        geometry = compute_geometry(times, latitude, longitude, altitude, surface_tilt, surface_azimuth)
+
+    else:
+        key = _cache_key(times, latitude, longitude, altitude, surface_tilt, surface_azimuth, dtype)
+        entry_dir = os.path.join(cache_dir, key)
+
+        if not os.path.isdir(entry_dir):
+            geometry = compute_geometry(times, latitude, longitude, altitude, surface_tilt, surface_azimuth)
+
+            # Written to a temporary folder and renamed, so concurrent workers never read a partial entry
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_dir = tempfile.mkdtemp(dir=cache_dir)
+            for field in FIELDS:
+                np.save(os.path.join(temp_dir, field + '.npy'), geometry[field].astype(dtype))
+            try:
+                os.rename(temp_dir, entry_dir)
+            except OSError:
+                # Another process stored the same entry first
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+        geometry = {field: np.load(os.path.join(entry_dir, field + '.npy'), mmap_mode='r') for field in FIELDS}
+
+    if as_series==True:
+        geometry = {field: pd.Series(values, index=times) for field, values in geometry.items()}
+
+    return geometry
@@ -0,0 +1,238 @@
+#################################################################################
+#
+# Module: sweep
+#
+# Description: Parameter sweeps over a grid of design parameters (sampling and
+#              communication intervals, battery size, number of turbines, PV
+#              tilt, ...). The combinations are grouped by the parameters that
+#              change the harvest: the harvest of a group is computed once and
+#              all its load/battery combinations are simulated in one batch
+#              pass (battery.simulate_batch). Results are kept in a labeled
+#              cube, one axis per parameter after the site axis, written to a
+#              .npz file that can be sliced by parameter value later.
+#
+#################################################################################
+
+import os
+import itertools
+import collections
+import numpy as np
+import battery
+
+
+# Parameters that only change the load or the battery, any other axis of a
+# grid changes the harvest
+LOAD_AXES = ('sampling_interval', 'communication_interval', 'bnom')
+
+# Labeled result cube: dimension names (site first), coordinate values of
+# every dimension and dict of metric name -> array shaped by the coordinates
+Cube = collections.namedtuple('Cube', ['dims', 'coords', 'metrics'])
+
+
+#################################################################################
+#
+# Function: harvest_groups
+#
+# Description: Combinations of the harvest parameters of a grid
+#
+# Input:    grid (dict of parameter name -> list of values, in the order of
+#                 the cube axes)
+#
+# Optional: load_axes (see LOAD_AXES)
+#
+# Output: returns a list of dicts of harvest parameter name -> value (an empty
+#         dict when only load parameters are swept)
+#
+#################################################################################
+
+def harvest_groups(grid, load_axes=LOAD_AXES):
+
+    axes = [axis for axis in grid if axis not in load_axes]
+
+    return [dict(zip(axes, values)) for values in itertools.product(*[grid[axis] for axis in axes])]
+
+
+#################################################################################
+#
+# Function: load_params
+#
+# Description: Battery/load parameters of every combination of the load
+#              parameters of a grid, in the order of the cube axes
+#
+# Input:    grid (dict of parameter name -> list of values; a communication
+#                 interval of None or NaN communicates every 24 samples and a
+#                 missing bnom keeps the default battery)
+#
+# Optional: load_axes (see LOAD_AXES)
+#           overrides (other BatteryParams fields, see battery.default_params)
+#
+# Output: returns a BatteryParams of vectors, one entry per combination
+#
+#################################################################################
+
+def load_params(grid, load_axes=LOAD_AXES, **overrides):
+
+    axes = [axis for axis in grid if axis in load_axes]
+    combinations = list(itertools.product(*[grid[axis] for axis in axes]))
+    n = len(combinations)
+    values = {axis: np.array([np.nan if combination[i] is None else combination[i] for combination in combinations],
+                             dtype=np.float64) for i, axis in enumerate(axes)}
+
+    sampling_interval = values.get('sampling_interval', np.full(n, 5.0))
+    communication_interval = values.get('communication_interval', np.full(n, np.nan))
+    communication_interval = np.where(np.isnan(communication_interval), 24 * sampling_interval, communication_interval)
+    if 'bnom' in values:
+        overrides['bnom'] = values['bnom']
+
+    return battery.broadcast_params(battery.default_params(sampling_interval, communication_interval, **overrides))
+
+
+#################################################################################
+#
+# Function: empty_cube
+#
+# Description: Cube of NaN metrics for the sites and parameter grid of a sweep
+#
+# Input:    sites (site labels)
+#           grid (dict of parameter name -> list of values)
+#           metrics (metric names)
+#
+# Output: returns a Cube
+#
+#################################################################################
+
+def empty_cube(sites, grid, metrics):
+
+    dims = ['site'] + list(grid)
+    coords = [np.array(list(sites), dtype=str)] + [np.array([np.nan if value is None else value for value in grid[axis]],
+                                                            dtype=np.float64) for axis in grid]
+    shape = tuple(len(coord) for coord in coords)
+
+    return Cube(dims, coords, {name: np.full(shape, np.nan) for name in metrics})
+
+
+#################################################################################
+#
+# Function: store_group
+#
+# Description: Writes the metrics of one site and harvest group into a cube
+#
+# Input:    cube (Cube)
+#           site (site label)
+#           group (dict of harvest parameter name -> value, see harvest_groups)
+#           metrics (dict of metric name -> vector over the load combinations,
+#                    in the order of load_params)
+#
+# Output: none, the cube is updated in place
+#
+#################################################################################
+
+def store_group(cube, site, group, metrics):
+
+    index = [list(cube.coords[0]).index(site)]
+    load_shape = []
+    for dim, coord in zip(cube.dims[1:], cube.coords[1:]):
+        if dim in group:
+            index.append(_position(coord, group[dim]))
+        else:
+            index.append(slice(None))
+            load_shape.append(len(coord))
+
+    for name, values in metrics.items():
+        cube.metrics[name][tuple(index)] = np.asarray(values).reshape(load_shape)
+
+
+# Position of a value along a coordinate (None and NaN match each other)
+def _position(coord, value):
+
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        matches = np.flatnonzero(np.isnan(coord))
+    else:
+        matches = np.flatnonzero(coord == value)
+    if len(matches) == 0:
+        raise ValueError("Error: value " + str(value) + " is not on the axis")
+
+    return int(matches[0])
+
+
+#################################################################################
+#
+# Function: write_cube
+#
+# Description: Writes a cube to a .npz file (no pickled objects)
+#
+# Input:    path
+#           cube (Cube)
+#
+# Output: none
+#
+#################################################################################
+
+def write_cube(path, cube):
+
+    arrays = {'dims': np.array(cube.dims, dtype=str)}
+    for dim, coord in zip(cube.dims, cube.coords):
+        arrays['coord_' + dim] = coord
+    for name, values in cube.metrics.items():
+        arrays['metric_' + name] = values
+
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    np.savez(path, **arrays)
+
+
+#################################################################################
+#
+# Function: read_cube
+#
+# Description: Reads a cube written by write_cube
+#
+# Input:    path
+#
+# Output: returns a Cube
+#
+#################################################################################
+
+def read_cube(path):
+
+    with np.load(path) as data:
+        dims = [str(dim) for dim in data['dims']]
+        coords = [data['coord_' + dim] for dim in dims]
+        metrics = {key[len('metric_'):]: data[key] for key in data.files if key.startswith('metric_')}
+
+    return Cube(dims, coords, metrics)
+
+
+#################################################################################
+#
+# Function: select
+#
+# Description: Slice of a metric of a cube at given parameter values
+#
+# Input:    cube (Cube)
+#           metric (metric name)
+#           any dimension name=value (e.g. site='04092750', bnom=400), the
+#           other dimensions are kept
+#
+# Output: returns the array of the metric over the dimensions left, and their
+#         names
+#
+#################################################################################
+
+def select(cube, metric, **labels):
+
+    index = []
+    dims = []
+    for dim, coord in zip(cube.dims, cube.coords):
+        if dim not in labels:
+            index.append(slice(None))
+            dims.append(dim)
+        elif coord.dtype.kind in 'US':
+            matches = np.flatnonzero(coord == str(labels[dim]))
+            if len(matches) == 0:
+                raise ValueError("Error: " + str(labels[dim]) + " is not on the " + dim + " axis")
+            index.append(int(matches[0]))
+        else:
+            index.append(_position(coord, labels[dim]))
+
+    return cube.metrics[metric][tuple(index)], dims
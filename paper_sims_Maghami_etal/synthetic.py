@@ -0,0 +1,170 @@
+#################################################################################
+#
+# Module: synthetic
+#
+# Description: Deterministic synthetic inputs in the formats of the raw data
+#              files, for benchmarks and checks without the USGS downloads or
+#              the SolarAnywhere data (which cannot be redistributed). Flow
+#              records mimic a time zone converted USGS file (15-minute
+#              velocity in UTC with seasonal base flow, storm recessions,
+#              missing records and a multi-day outage) or the raw USGS file it
+#              is converted from (local time with a time zone code per record,
+#              see Hydro_1_LocalTimetoUTC_Convert); weather records mimic
+#              a concatenated SolarAnywhere file (hourly irradiance,
+#              temperature and wind in local standard time). The same seed
+#              always gives the same records.
+#
+#################################################################################
+
+import numpy as np
+import pandas as pd
+
+
+#################################################################################
+#
+# Function: synthetic_flow
+#
+# Description: Flow velocity records of a time zone converted USGS file
+#
+# Input:    days (record length)
+#
+# Optional: seed
+#           interval (minutes between two records)
+#           start (first record, UTC)
+#
+# Output: returns a DataFrame with the 'timestamp' (UTC text, as in the files)
+#         and 'flow' (feet/sec) columns
+#
+#################################################################################
+
+def synthetic_flow(days, seed=0, interval=15, start='2009-12-31 00:00:00'):
+
+    rng = np.random.default_rng(seed)
+    n = int(days * 24 * 60 / interval)
+    t = np.arange(n) * (interval / (24.0 * 60.0))  # in days
+
+    # Seasonal base flow around the turbine cut-in (1.66 feet/sec)
+    flow = 1.8 + 1.2 * np.sin(2 * np.pi * (t / 365.25 - 0.2)) + 0.05 * rng.standard_normal(n)
+
+    # Storms about every 10 days, each one followed by a recession of about 2 days
+    per_day = int(24 * 60 / interval)
+    for first in np.flatnonzero(rng.random(int(days)) < 0.1) * per_day:
+        window = slice(first, min(first + 20 * per_day, n))
+        flow[window] += rng.exponential(4.0) * np.exp(-(t[window] - t[first]) / rng.uniform(1.0, 3.0))
+    flow = np.maximum(flow, 0.0)
+
+    # Missing records and one outage of 3 days, longer than the 1 day gap threshold of the step energy
+    keep = rng.random(n) > 0.005
+    if n > 10 * per_day:
+        outage = int(rng.integers(0, n - 3 * per_day))
+        keep[outage:outage + 3 * per_day] = False
+
+    timestamps = pd.Timestamp(start, tz='UTC') + pd.to_timedelta(np.arange(n)[keep] * interval, unit='min')
+
+    return pd.DataFrame({'timestamp': timestamps.astype(str), 'flow': flow[keep]})
+
+
+# Time zone codes of the standard and daylight saving time of the raw USGS files
+USGS_TZ_CODES = {'US/Eastern': ('EST', 'EDT'), 'US/Central': ('CST', 'CDT'), 'US/Mountain': ('MST', 'MDT'),
+                 'US/Pacific': ('PST', 'PDT')}
+
+
+#################################################################################
+#
+# Function: synthetic_raw_flow
+#
+# Description: Records of a raw USGS velocity file (the same records as
+#              synthetic_flow, in local time with their time zone code)
+#
+# Input:    days (record length)
+#
+# Optional: seed
+#           time_zone (zone of the site, see USGS_TZ_CODES)
+#           site_no
+#           interval (minutes between two records)
+#           start (first record, UTC)
+#
+# Output: returns a DataFrame with the columns Hydro_1_LocalTimetoUTC_Convert
+#         reads ('agency', 'station', 'str_timestamp', 'tz', 'flow', 'type')
+#
+#################################################################################
+
+def synthetic_raw_flow(days, seed=0, time_zone='US/Eastern', site_no='00000000', interval=15, start='2009-12-31 00:00:00'):
+
+    if time_zone not in USGS_TZ_CODES:
+        raise ValueError("Error: time zone " + str(time_zone) + " is not currently supported")
+
+    records = synthetic_flow(days, seed=seed, interval=interval, start=start)
+    local = pd.DatetimeIndex(pd.to_datetime(records['timestamp'], utc=True)).tz_convert(time_zone)
+    standard, daylight = USGS_TZ_CODES[time_zone]
+    daylight_saving = np.asarray(local.map(lambda timestamp: bool(timestamp.dst())), dtype=bool)
+
+    return pd.DataFrame({'agency': 'USGS', 'station': site_no, 'str_timestamp': local.strftime('%Y-%m-%d %H:%M'),
+                         'tz': np.where(daylight_saving, daylight, standard), 'flow': records['flow'].to_numpy(),
+                         'type': 'A'})
+
+
+#################################################################################
+#
+# Function: write_raw_flow
+#
+# Description: Writes raw USGS records (see synthetic_raw_flow) as a tab
+#              separated file with the 30 line header of the USGS files
+#
+# Input:    records
+#           path
+#
+#################################################################################
+
+def write_raw_flow(records, path):
+
+    header = ['# Synthetic USGS instantaneous values (see synthetic.synthetic_raw_flow)'] + ['#'] * 27
+    header += ['agency_cd\tsite_no\tdatetime\ttz_cd\t00000_72255\t00000_72255_cd', '5s\t15s\t20d\t6s\t14n\t10s']
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(header) + '\n')
+        records.to_csv(f, sep='\t', header=False, index=False)
+
+
+#################################################################################
+#
+# Function: synthetic_weather
+#
+# Description: Weather records of a concatenated SolarAnywhere file
+#
+# Input:    days (record length)
+#
+# Optional: seed
+#           latitude (degrees, sets the daily course of the sun)
+#           start (first record, local standard time)
+#
+# Output: returns a DataFrame with the columns of the SolarAnywhere files
+#         (including the extra parenthesis of 'DNI (W/m^2))')
+#
+#################################################################################
+
+def synthetic_weather(days, seed=0, latitude=40.0, start='2010-01-01 01:00'):
+
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=int(days * 24), freq='1h')
+    day_of_year = times.dayofyear.to_numpy()
+    hour = times.hour.to_numpy() + times.minute.to_numpy() / 60.0
+
+    # Sun elevation at the middle of the hour ending at the record
+    declination = np.radians(23.45) * np.sin(2 * np.pi * (284 + day_of_year) / 365.0)
+    hour_angle = np.radians(15.0 * (hour - 0.5 - 12.0))
+    phi = np.radians(latitude)
+    sin_elevation = np.maximum(np.sin(phi) * np.sin(declination) + np.cos(phi) * np.cos(declination) * np.cos(hour_angle), 0.0)
+
+    # Clearness of every day, clear sky global irradiance split in direct and diffuse parts
+    clearness = rng.beta(4.0, 2.0, len(times) // 24 + 1)[np.arange(len(times)) // 24]
+    ghi = 1000.0 * sin_elevation ** 1.15 * clearness
+    dhi = ghi * (1.0 - 0.8 * clearness)
+    dni = np.where(sin_elevation > 0.05, (ghi - dhi) / np.maximum(sin_elevation, 0.05), 0.0)
+
+    season = np.sin(2 * np.pi * (day_of_year - 110) / 365.0)
+    temperature = 10.0 + 12.0 * season + 5.0 * np.sin(2 * np.pi * (hour - 9.0) / 24.0) + rng.normal(0.0, 1.5, len(times))
+    wind = rng.gamma(2.0, 1.5, len(times))
+
+    return pd.DataFrame({'Date_Time': times.strftime('%m/%d/%Y %H:%M'), 'GHI (W/m^2)': ghi, 'DNI (W/m^2))': dni,
+                         'DHI (W/m^2)': dhi, 'Dry-bulb (C)': temperature, 'Wspd (m/s)': wind})
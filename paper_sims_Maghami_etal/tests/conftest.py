@@ -0,0 +1,5 @@
+# The simulation modules are imported as top-level modules, as the scripts next to them do
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
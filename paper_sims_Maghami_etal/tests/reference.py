@@ -0,0 +1,111 @@
+# Reference implementations of the original per-minute loops of the simulation scripts (see the first version of
+# Hydro_2_Simulations), kept in plain Python so every kernel can be checked against them, and the harvest series
+# the tests run on
+import collections
+import numpy as np
+import pandas as pd
+import battery
+import synthetic
+import turbine
+
+
+# Summary metrics and trajectories of the original battery loop
+BaselineResult = collections.namedtuple('BaselineResult', ['fraction_overflow', 'fraction_sampleloss', 'b', 'eload',
+                                                           'overflow', 'batt_status'])
+
+
+# Battery loop of the original scripts over total_sim_steps minute steps of Eh (the samples after them only count in
+# the harvested energy of the overflow fraction)
+def baseline_battery(Eh, params, total_sim_steps, Batt_status=1):
+
+    Nbat_in, Nbat_out, Bnom, Binit, Eleak, Ncc, Bth, Eload_setup = [float(value) for value in params]
+    Eh = np.asarray(Eh, dtype=np.float64)
+
+    Ebat_in = np.zeros(total_sim_steps)
+    Ebat_out = np.zeros(total_sim_steps)
+    B = np.zeros(total_sim_steps)
+    Eload = np.zeros(total_sim_steps)
+    Overflow = np.zeros(total_sim_steps)
+
+    # initial conditions
+    Eload[0] = Eload_setup
+    Ebat_out[0] = (Eload[0] / Nbat_out) + Eleak
+    Ebat_in[0] = min(Nbat_in * Ncc * Eh[0], max(0, Nbat_out * Bnom - Binit - Ebat_out[0]))
+    B[0] = max(0, min(Nbat_out * Bnom, Binit + Ebat_in[0] - Ebat_out[0]))
+    Overflow[0] = max(0, Nbat_in * Ncc * Eh[0] - Ebat_in[0])
+
+    for k in range(1, total_sim_steps):
+
+        Eload[k] = Batt_status * Eload_setup
+
+        Ebat_out[k] = (Eload[k] / Nbat_out) + Eleak
+
+        Ebat_in[k] = min(Nbat_in * Ncc * Eh[k], max(0, Nbat_out * Bnom - B[k - 1] - Ebat_out[k]))
+
+        B[k] = max(0, min(Nbat_out * Bnom, B[k - 1] + Ebat_in[k] - Ebat_out[k]))
+
+        Overflow[k] = max(0, Nbat_in * Ncc * Eh[k] - Ebat_in[k])
+
+        if B[k] == 0:
+            Batt_status = 0
+            Eload[k] = 0
+        if (Batt_status == 0) and (B[k] >= Bth):
+            Batt_status = 1
+
+    fraction_overflow = sum(Overflow) / (sum(Nbat_in * Ncc * Eh) + 0.000000000000001)
+    fraction_sampleloss = np.count_nonzero(Eload == 0) / len(Eload)
+
+    return BaselineResult(fraction_overflow, fraction_sampleloss, B, Eload, Overflow, Batt_status)
+
+
+# Step energy loop of the original scripts
+def baseline_step_energy(minutes, Gen_power, T_threshold):
+
+    delta_t = []
+    step_energy = []
+    for i in range(1, len(minutes)):
+        dt = minutes[i] - minutes[i - 1]
+        if dt < T_threshold:
+            step_energy.append((Gen_power[i - 1] + Gen_power[i]) * dt * 60 / 2)
+            delta_t.append(dt)
+        else:
+            step_energy.append(0)
+            delta_t.append(0)
+
+    Total_time = sum(delta_t)
+    Total_energy = sum(step_energy)
+
+    return step_energy, Total_time, Total_energy, Total_energy / Total_time
+
+
+# Harvest in Wh per minute with storms and dry spells, so that a small battery runs out and turns back on several times
+def outage_harvest(n, seed=0):
+
+    rng = np.random.default_rng(seed)
+    level = np.where(rng.random(n // 60 + 1) < 0.35, rng.exponential(0.02, n // 60 + 1), 0.0)
+    eh = np.repeat(level, 60)[:n] * rng.uniform(0.5, 1.5, n)
+
+    return eh
+
+
+# Parameters of a small battery that runs out with outage_harvest
+def outage_params(sampling_interval=5):
+
+    return battery.default_params(sampling_interval, bnom=0.5)
+
+
+# Raw 15-minute flow records (with missing records and a 3-day outage, see synthetic.synthetic_flow) indexed by UTC
+# time, and their 1-minute interpolation
+def flow_records(days, seed=0):
+
+    records = synthetic.synthetic_flow(days, seed=seed)
+    records['timestamp'] = pd.to_datetime(records['timestamp'], utc=True)
+    records = records.set_index('timestamp')
+
+    return records, records.resample('1min').interpolate(method='linear')
+
+
+# Harvest in Wh per minute of two WaterLily turbines on a 1-minute flow series
+def flow_harvest(interpolated):
+
+    return 2 * turbine.waterlilyv2_power(interpolated['flow']) / 60.0
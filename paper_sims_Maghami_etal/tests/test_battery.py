@@ -0,0 +1,188 @@
+# Battery kernels (stepwise, batched, chunked, fast path, event-driven and ensemble) against the original loop
+import numpy as np
+import pytest
+import battery
+import events
+import ensemble
+from reference import baseline_battery, outage_harvest, outage_params, flow_records, flow_harvest
+
+
+N = 20000
+
+
+@pytest.fixture(scope='module')
+def harvest():
+    return outage_harvest(N)
+
+
+# Parameters whose arithmetic is exact in binary, so the level reaches 0 and Bth exactly
+def exact_params():
+    return battery.BatteryParams(nbat_in=1.0, nbat_out=1.0, bnom=4.0, binit=4.0, eleak=0.0, ncc=1.0, bth=1.0,
+                                 eload_setup=0.25)
+
+
+# Drains the battery to exactly 0, then charges it by exact steps up to Bth and past it
+def hysteresis_harvest():
+    rng = np.random.default_rng(3)
+    return np.concatenate([np.zeros(20), np.full(4, 0.25), np.zeros(6), np.full(3, 0.25), np.full(10, 0.5),
+                           rng.choice([0.0, 0.125, 0.25, 0.5], 400)])
+
+
+def test_simulate_matches_baseline(harvest):
+
+    params = outage_params()
+    minutes = np.arange(N)
+    expected = baseline_battery(harvest, params, minutes[-1])
+    assert 0 < expected.fraction_sampleloss < 1
+
+    result = battery.simulate(harvest, params, minutes=minutes, fast_path=False)
+
+    assert result.fraction_overflow == expected.fraction_overflow
+    assert result.fraction_sampleloss == expected.fraction_sampleloss
+    assert result.batt_status == expected.batt_status
+    np.testing.assert_array_equal(result.b, expected.b)
+    np.testing.assert_array_equal(result.eload == 0, expected.eload == 0)
+
+
+def test_hysteresis_boundary():
+
+    params = exact_params()
+    eh = hysteresis_harvest()
+    expected = baseline_battery(eh, params, len(eh) - 1)
+    # The level hits 0 and then Bth exactly
+    assert np.any(expected.b == 0) and np.any(expected.b == params.bth)
+
+    result = battery.simulate(eh, params, minutes=np.arange(len(eh)), fast_path=False)
+
+    np.testing.assert_array_equal(result.b, expected.b)
+    np.testing.assert_array_equal(result.eload, expected.eload)
+    assert result.fraction_sampleloss == expected.fraction_sampleloss
+
+    # With Bth just above the level reached, the station stays off at that step
+    below = baseline_battery(eh, params._replace(bth=1.0 + 2**-20), len(eh) - 1)
+    turned_on = np.flatnonzero((expected.b == params.bth) & (expected.eload == 0))[0]
+    assert expected.eload[turned_on + 1] > 0 and below.eload[turned_on + 1] == 0
+    result = battery.simulate(eh, params._replace(bth=1.0 + 2**-20), minutes=np.arange(len(eh)), fast_path=False)
+    np.testing.assert_array_equal(result.eload, below.eload)
+
+
+@pytest.mark.parametrize('bounds', [[1], [7, 8, 1000], [N // 2], list(range(500, N, 3001))])
+def test_chunks_match_whole_run(harvest, bounds):
+
+    params = outage_params()
+    whole = battery.simulate(harvest, params, fast_path=False)
+
+    state = battery.initial_state(params)
+    b = []
+    for chunk in np.split(harvest, bounds):
+        result, state = battery.simulate_chunk(chunk, params, state, fast_path=False)
+        b.append(result.b)
+
+    np.testing.assert_array_equal(np.concatenate(b), whole.b)
+    assert state.batt_status == whole.batt_status
+    assert (result.fraction_overflow, result.fraction_sampleloss) == (whole.fraction_overflow,
+                                                                      whole.fraction_sampleloss)
+
+
+def test_fast_path_matches_baseline(harvest):
+
+    params = outage_params()
+    minutes = np.arange(N)
+    expected = baseline_battery(harvest, params, minutes[-1])
+
+    result = battery.simulate(harvest, params, minutes=minutes, fast_path=True)
+
+    np.testing.assert_array_equal(result.eload == 0, expected.eload == 0)
+    np.testing.assert_allclose(result.b, expected.b, rtol=0, atol=1e-12)
+    assert result.fraction_overflow == pytest.approx(expected.fraction_overflow, rel=1e-12)
+
+
+# A year of 1-minute turbine harvest, where the fast path covers long stretches without outage. Its prefix sums round
+# differently from the stepwise recursion, the level drifting by about 1e-9 Wh at most over a year (5.7e-9 Wh over the
+# 5 years of a USGS site)
+@pytest.mark.parametrize('bnom', [None, 20.0])
+def test_fast_path_bounded_difference(bnom):
+
+    records, interpolated = flow_records(365)
+    eh = flow_harvest(interpolated)
+    params = battery.default_params(5) if bnom is None else battery.default_params(5, bnom=bnom)
+
+    stepwise = battery.simulate(eh, params, fast_path=False)
+    fast = battery.simulate(eh, params, fast_path=True)
+
+    assert np.max(np.abs(fast.b - stepwise.b)) < 1e-8
+    assert np.count_nonzero(fast.eload == 0) == np.count_nonzero(stepwise.eload == 0)
+    assert np.count_nonzero(fast.overflow > 0) == np.count_nonzero(stepwise.overflow > 0)
+    assert fast.fraction_sampleloss == stepwise.fraction_sampleloss
+    assert fast.fraction_overflow == pytest.approx(stepwise.fraction_overflow, rel=1e-12)
+
+
+def test_batch_matches_baseline(harvest):
+
+    eh = np.vstack([harvest, outage_harvest(N, seed=1), 3 * harvest])
+    params = battery.broadcast_params(battery.default_params(np.array([1.0, 5.0, 30.0]),
+                                                             bnom=np.array([0.3, 0.5, 1.0])))
+    minutes = np.arange(N)
+
+    result = battery.simulate_batch(eh, params, minutes=minutes)
+
+    for h in range(eh.shape[0]):
+        for p in range(3):
+            expected = baseline_battery(eh[h], battery.BatteryParams(*[field[p] for field in params]), minutes[-1])
+            assert result.fraction_overflow[h, p] == expected.fraction_overflow
+            assert result.fraction_sampleloss[h, p] == expected.fraction_sampleloss
+            assert result.b[h, p] == expected.b[-1]
+            assert result.batt_status[h, p] == expected.batt_status
+
+
+def test_float32_harvest(harvest):
+
+    eh = harvest.astype(np.float32)
+    params = outage_params()
+    expected = baseline_battery(eh.astype(np.float64), params, N - 1)
+
+    # Read in place by the scenario kernel, the charge being computed in float64
+    result = battery.simulate_scenarios(eh, [0], params, steps=N - 1, closing=1)
+    assert result.fraction_overflow[0] == expected.fraction_overflow
+    assert result.fraction_sampleloss[0] == expected.fraction_sampleloss
+
+    result = battery.simulate(eh, params, minutes=np.arange(N), fast_path=False)
+    np.testing.assert_array_equal(result.b, expected.b)
+
+
+@pytest.mark.parametrize('eh, params', [(outage_harvest(N), outage_params()), (hysteresis_harvest(), exact_params())])
+def test_events_match_baseline(eh, params):
+
+    # Runs of constant harvest, as the 1-minute interpolation of flat records gives
+    eh = np.repeat(eh[::5], 5)
+    minutes = np.arange(len(eh))
+    expected = baseline_battery(eh, params, minutes[-1])
+
+    result = events.simulate_events(eh, params, minutes=minutes)
+
+    assert result.fraction_sampleloss == expected.fraction_sampleloss
+    assert result.fraction_overflow == pytest.approx(expected.fraction_overflow, rel=1e-12)
+    assert result.batt_status == expected.batt_status
+    run_ends = np.append(result.run_starts[1:], minutes[-1]) - 1
+    np.testing.assert_allclose(result.b, expected.b[run_ends], rtol=0, atol=1e-12)
+
+
+def test_ensemble_matches_baseline():
+
+    power = 60 * np.vstack([outage_harvest(N, seed=2), outage_harvest(N, seed=4)])
+    rng = np.random.default_rng(5)
+    weights = rng.uniform(0.5, 1.5, (6, 2))
+    params = battery.default_params(5, bnom=0.5)
+    params = params._replace(nbat_in=rng.uniform(0.85, 0.95, 6), ncc=rng.uniform(0.85, 0.95, 6))
+    minutes = np.arange(N)
+
+    # Batches of 4 members, the last one partial
+    result = ensemble.simulate_members(power, weights, params, minutes=minutes, batch_size=4)
+
+    for s in range(6):
+        harvest = weights[s, 0] * power[0] + weights[s, 1] * power[1]
+        expected = baseline_battery(harvest / 60.0, battery.BatteryParams(*[np.broadcast_to(field, 6)[s]
+                                                                            for field in params]), minutes[-1])
+        assert result.fraction_overflow[s] == pytest.approx(expected.fraction_overflow, rel=1e-12)
+        assert result.fraction_sampleloss[s] == expected.fraction_sampleloss
+        assert result.batt_status[s] == expected.batt_status
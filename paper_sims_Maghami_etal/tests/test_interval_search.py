@@ -0,0 +1,33 @@
+# Bisection of the sampling interval against the original loop run on every interval of the range
+import numpy as np
+import battery
+import interval_search
+from reference import baseline_battery, outage_harvest
+
+
+def test_critical_intervals_match_exhaustive_search():
+
+    harvest = {'a': outage_harvest(5000, seed=1), 'b': 0.4 * outage_harvest(4000, seed=2).astype(np.float32)}
+    minutes = {'a': np.arange(5000)}
+    interval_range = (1, 20)
+
+    result = interval_search.critical_intervals(harvest, max_sampleloss=0.01, max_overflow=0.7,
+                                                interval_range=interval_range, params_overrides={'bnom': 2.0},
+                                                minutes=minutes)
+
+    for i, site in enumerate(harvest):
+        eh = np.asarray(harvest[site], dtype=np.float64)
+        # Sites without offsets are simulated over their whole series
+        steps = len(eh) - 1 if site in minutes else len(eh)
+        metrics = [baseline_battery(eh, battery.default_params(interval, bnom=2.0), steps)
+                   for interval in range(interval_range[0], interval_range[1] + 1)]
+        loss = np.array([m.fraction_sampleloss for m in metrics]) <= 0.01
+        over = np.array([m.fraction_overflow for m in metrics]) <= 0.7
+        # The bisection relies on the loss (overflow) criterion being met from (up to) some interval on
+        assert np.all(np.diff(loss.astype(int)) >= 0) and np.all(np.diff(over.astype(int)) <= 0)
+        assert loss.any() and not loss.all() and over.any() and not over.all()
+
+        assert result.min_interval[i] == interval_range[0] + np.flatnonzero(loss)[0]
+        assert result.max_interval[i] == interval_range[0] + np.flatnonzero(over)[-1]
+
+    assert result.simulations < 2 * len(metrics)
@@ -0,0 +1,27 @@
+# Native 15-minute simulation against the original loop on the 1-minute interpolation of the same records
+import numpy as np
+import pytest
+import battery
+import native
+import timeseries
+from reference import baseline_battery, flow_records, flow_harvest
+
+
+@pytest.mark.parametrize('bnom', [0.05, 0.5, 20.0])
+def test_native_matches_baseline(bnom):
+
+    records, interpolated = flow_records(20)
+    params = battery.default_params(5, bnom=bnom)
+    minutes = timeseries.minute_offsets(interpolated.index)
+    expected = baseline_battery(flow_harvest(interpolated), params, minutes[-1])
+
+    result = native.simulate_native(timeseries.minute_offsets(records.index), records['flow'],
+                                    native.waterlilyv2_harvest(2), params)
+
+    assert result.fraction_sampleloss == expected.fraction_sampleloss
+    assert result.fraction_overflow == pytest.approx(expected.fraction_overflow, rel=1e-9)
+    assert result.batt_status == expected.batt_status
+    # Level at the end of every record interval
+    np.testing.assert_allclose(result.b, expected.b[np.diff(timeseries.minute_offsets(records.index)).cumsum() - 1],
+                               rtol=0, atol=1e-9)
+    assert result.steps < minutes[-1]
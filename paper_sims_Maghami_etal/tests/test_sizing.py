@@ -0,0 +1,37 @@
+# Minimum battery capacity against the original loop: no sample loss at the sized capacity, loss just below it
+import numpy as np
+import pytest
+import battery
+import sizing
+from reference import baseline_battery, outage_harvest
+
+
+# Original loop with the capacity bnom, Binit and Bth keeping their ratio to it
+def sampleloss(eh, params, bnom):
+
+    sized = params._replace(bnom=bnom, binit=bnom * params.binit / params.bnom, bth=bnom * params.bth / params.bnom)
+
+    return baseline_battery(eh, sized, len(eh)).fraction_sampleloss
+
+
+def small_harvest():
+    # Enough harvest for a battery of a few load steps, with a dip on the step after the transient
+    params = battery.default_params(5)
+    o = params.eload_setup / params.nbat_out + params.eleak
+    charge = np.full(50, 2 * o)
+    charge[2] = 0.0
+    return charge / (params.nbat_in * params.ncc)
+
+
+@pytest.mark.parametrize('eh', [outage_harvest(5000), outage_harvest(5000, seed=7).astype(np.float32),
+                                small_harvest()])
+@pytest.mark.parametrize('binit_ratio', [1.0, 0.85, 0.7])
+def test_min_capacity_is_minimal(eh, binit_ratio):
+
+    params = battery.default_params(5)
+    params = params._replace(binit=binit_ratio * params.bnom)
+
+    result = sizing.min_capacity(eh, params, margin=1e-9)
+
+    assert sampleloss(eh, params, result.bnom) == 0
+    assert sampleloss(eh, params, result.bnom * (1 - 1e-6)) > 0
@@ -0,0 +1,86 @@
+# Step energy with gaps longer than T_threshold, and streaming and incremental runs, against the original loops
+import numpy as np
+import pytest
+import battery
+import incremental
+import site_store
+import synthetic
+import timeseries
+import turbine
+from reference import baseline_battery, baseline_step_energy, flow_records
+
+
+T_THRESHOLD = 24 * 60
+
+
+@pytest.fixture(scope='module')
+def gapped():
+    rng = np.random.default_rng(11)
+    # Gaps just below, at and above the threshold among 1-minute steps
+    delta_t = np.ones(3000, dtype=np.int64)
+    delta_t[[100, 1200, 2500]] = [T_THRESHOLD - 1, T_THRESHOLD, 3 * T_THRESHOLD]
+    minutes = np.concatenate(([0], np.cumsum(delta_t)))
+    return minutes, rng.uniform(0.0, 20.0, len(minutes))
+
+
+def test_step_energy_skips_long_gaps(gapped):
+
+    minutes, power = gapped
+    step_energy, Total_time, Total_energy, Average_Energy = baseline_step_energy(minutes, power, T_THRESHOLD)
+
+    result = timeseries.step_energy(minutes, power, T_THRESHOLD, verbose=False)
+
+    np.testing.assert_array_equal(result.step_energy, step_energy)
+    assert (result.total_time, result.total_energy, result.average_energy) == (Total_time, Total_energy,
+                                                                              Average_Energy)
+    assert result.gaps.count == 2
+
+
+@pytest.mark.parametrize('bounds', [[1], [100, 101, 1200], [2501]])
+def test_step_energy_chunks(gapped, bounds):
+
+    minutes, power = gapped
+    whole = timeseries.step_energy(minutes, power, T_THRESHOLD, verbose=False)
+
+    state = None
+    for chunk_minutes, chunk_power in zip(np.split(minutes, bounds), np.split(power, bounds)):
+        result, state = timeseries.step_energy_chunk(chunk_minutes, chunk_power, T_THRESHOLD, state)
+
+    assert timeseries.energy_totals(state) == (whole.total_time, whole.total_energy, whole.average_energy)
+
+
+@pytest.mark.parametrize('chunk_days', [0.5, 7])
+def test_incremental_matches_baseline(tmp_path, monkeypatch, chunk_days):
+
+    monkeypatch.setattr(site_store, 'HYDRO_DIR', str(tmp_path))
+    records, interpolated = flow_records(20, seed=4)
+    params = battery.default_params(5, bnom=0.5)
+    harvest = lambda frame: 2 * turbine.waterlilyv2_power(frame['flow'])
+
+    # Same records as the incremental runs read (from the start of the simulation period on)
+    start, end = site_store.simulation_period('US/Central')
+    interpolated = records.loc[records.index >= start].resample('1min').interpolate(method='linear')
+    minutes = timeseries.minute_offsets(interpolated.index)
+    gen_power = harvest(interpolated)
+    expected = baseline_battery(gen_power / 60.0, params, minutes[-1])
+    step_energy, Total_time, Total_energy, Average_Energy = baseline_step_energy(minutes, gen_power, T_THRESHOLD)
+
+    # The raw file grows between two runs, the first one ending on a partial line
+    raw = synthetic.synthetic_flow(20, seed=4).to_csv(index=False).encode()
+    cut = raw.index(b'\n', len(raw) * 3 // 5) + 1
+    path = tmp_path / 'time_zone_converted_00000000_72255.txt'
+    checkpoint = None
+    for content in (raw[:cut + 10], raw):
+        path.write_bytes(content)
+        checkpoint = incremental.advance('00000000', lambda offset: site_store.hydro_records_from(
+            path.name, 'US/Central', offset, rows=500, open_ended=True), harvest, params, checkpoint,
+            chunk_minutes=int(chunk_days * 24 * 60))
+        if content is not raw:
+            assert checkpoint.offset == cut
+
+    metrics = incremental.checkpoint_metrics(checkpoint)
+    assert checkpoint.offset == len(raw)
+    assert metrics.fraction_sampleloss == expected.fraction_sampleloss
+    assert metrics.fraction_overflow == pytest.approx(expected.fraction_overflow, rel=1e-12)
+    assert checkpoint.battery.b == expected.b[-1]
+    assert (metrics.total_time, metrics.average_energy) == (Total_time, pytest.approx(Average_Energy, rel=1e-12))
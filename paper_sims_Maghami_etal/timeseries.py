@@ -0,0 +1,245 @@
+#################################################################################
+#
+# Module: timeseries
+#
+# Description: Helpers shared by the simulation scripts to handle the
+#              harvested power time series (step energies and data gaps).
+#
+#################################################################################
+
+import collections
+import numpy as np
+import pandas as pd
+
+
+# Nanoseconds in one minute
+NS_PER_MINUTE = 60*(10**9)
+
+# Statistics of the gaps that were ignored when integrating a power series
+GapStats = collections.namedtuple('GapStats', ['count', 'ignored_time', 'longest', 'index'])
+
+# Trapezoidal integration of a power series
+StepEnergyResult = collections.namedtuple('StepEnergyResult', ['step_energy', 'total_time', 'total_energy',
+                                                               'average_energy', 'gaps'])
+
+# Last sample and running totals carried from one chunk of a power series to
+# the next (see step_energy_chunk)
+StepEnergyState = collections.namedtuple('StepEnergyState', ['last_minute', 'last_power', 'total_time',
+                                                             'total_energy', 'gap_count', 'gap_time', 'longest_gap'])
+
+
+#################################################################################
+#
+# Function: minute_offsets
+#
+# Description: Minutes elapsed since the first timestamp for every timestamp
+#              of an index, computed from the index's int64 nanosecond values
+#              instead of one Timedelta per timestamp
+#
+# Input:    index (pandas DatetimeIndex, tz-aware or naive)
+#
+# Output: returns the minute offsets as an int64 NumPy array
+#
+#################################################################################
+
+def minute_offsets(index):
+
+    # pandas >= 2 may store timestamps in other units than nanoseconds
+    if hasattr(index, 'as_unit'):
+        index = index.as_unit('ns')
+
+    ns = np.asarray(index.asi8, dtype=np.int64)
+    if len(ns) == 0:
+        return ns
+
+    return np.abs(ns - ns[0]) // NS_PER_MINUTE
+
+
+#################################################################################
+#
+# Function: sequential_sum
+#
+# Description: Adds the values one after the other, in order, to start (the
+#              order of Python's built-in sum). Unlike the pairwise summation
+#              of NumPy's sum, a total accumulated over consecutive chunks of
+#              a series is then identical to the total of the whole series
+#
+# Input:    values
+#
+# Optional: start (running total of the previous chunks)
+#
+# Output: returns the total as a float
+#
+#################################################################################
+
+def sequential_sum(values, start=0.0):
+
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if values.size == 0:
+        return float(start)
+
+    # cumsum adds sequentially
+    return float(np.cumsum(np.concatenate(([start], values)))[-1])
+
+
+#################################################################################
+#
+# Function: step_energy
+#
+# Description: Integrates a power time series with the trapezoidal rule. Steps
+#              longer than T_threshold are gaps in the data, they are ignored
+#              (zero energy and zero time) and reported in the gap statistics
+#
+# Input:    minutes (minute offset of every sample, int64)
+#           gen_power (power in Watts of every sample)
+#           T_threshold (minutes, steps of this length or longer are ignored)
+#
+# Optional: verbose
+#
+# Output: returns a StepEnergyResult with the energy of every step (Joules),
+#         the total time (minutes), the total energy (Joules), the average
+#         energy in one minute step (Joules) and the GapStats (number of
+#         ignored steps, ignored minutes, longest gap and step indices)
+#
+#################################################################################
+
+def step_energy(minutes, gen_power, T_threshold, verbose=True):
+
+    minutes = np.asarray(minutes, dtype=np.int64)
+    gen_power = np.asarray(gen_power, dtype=np.float64)
+
+    delta_t = np.diff(minutes)
+    valid = delta_t < T_threshold
+
+    step_energy = np.where(valid, (gen_power[:-1] + gen_power[1:])*delta_t*60/2, 0.0)
+    delta_t = np.where(valid, delta_t, 0)
+
+    gap_index = np.flatnonzero(~valid)
+    gap_lengths = np.diff(minutes)[gap_index]
+    gaps = GapStats(len(gap_index), int(gap_lengths.sum()), int(gap_lengths.max()) if len(gap_index) else 0, gap_index)
+
+    Total_time = int(delta_t.sum())
+    Total_energy = sequential_sum(step_energy)
+    Average_Energy = Total_energy/Total_time if Total_time else float('nan')
+
+    if verbose==True:
+        print("Total time(months): "+str(Total_time/(30*24*60)))
+        print("Total energy(kwh): "+str(Total_energy/3600000))
+        print("Average energy(Joules in one minute step): "+str(Average_Energy))
+        if gaps.count:
+            print("Ignored gaps: "+str(gaps.count)+" ("+str(gaps.ignored_time)+" minutes, longest "+str(gaps.longest)+")")
+
+    return StepEnergyResult(step_energy, Total_time, Total_energy, Average_Energy, gaps)
+
+
+#################################################################################
+#
+# Function: step_energy_chunk
+#
+# Description: Integrates the next chunk of a power series, continuing from the
+#              last sample of the previous chunk. The running totals are the
+#              same as those of step_energy on the whole series
+#
+# Input:    minutes (minute offsets of the chunk samples, from the start of
+#                    the whole series)
+#           gen_power
+#           T_threshold
+#
+# Optional: state (StepEnergyState of the previous chunks, None for the first)
+#
+# Output: returns the StepEnergyResult of the chunk and the StepEnergyState
+#
+#################################################################################
+
+def step_energy_chunk(minutes, gen_power, T_threshold, state=None):
+
+    minutes = np.asarray(minutes, dtype=np.int64)
+    gen_power = np.asarray(gen_power, dtype=np.float64)
+    if len(minutes) == 0:
+        return step_energy(minutes, gen_power, T_threshold, verbose=False), state
+
+    if state is not None:
+        # The first step of the chunk starts at the last sample of the previous one
+        minutes = np.concatenate(([state.last_minute], minutes))
+        gen_power = np.concatenate(([state.last_power], gen_power))
+    else:
+        state = StepEnergyState(None, None, 0, 0.0, 0, 0, 0)
+
+    result = step_energy(minutes, gen_power, T_threshold, verbose=False)
+
+    state = StepEnergyState(int(minutes[-1]), float(gen_power[-1]),
+                            state.total_time + result.total_time,
+                            sequential_sum(result.step_energy, state.total_energy),
+                            state.gap_count + result.gaps.count,
+                            state.gap_time + result.gaps.ignored_time,
+                            max(state.longest_gap, result.gaps.longest))
+
+    return result, state
+
+
+# Total time (minutes), total energy (Joules) and average energy in one minute step of a StepEnergyState
+def energy_totals(state):
+
+    Average_Energy = state.total_energy/state.total_time if state.total_time else float('nan')
+
+    return state.total_time, state.total_energy, Average_Energy
+
+
+#################################################################################
+#
+# Function: stream_minutes
+#
+# Description: Resamples a time series read in chunks of records to 1 minute
+#              and interpolates it linearly, yielding bounded chunks of the
+#              1-minute grid. Every chunk is interpolated by pandas on a window
+#              that includes the records on both sides of it, so the values are
+#              the same as resample('1min').interpolate() on the whole series
+#
+# Input:    records (iterable of DataFrames with a sorted DatetimeIndex, in
+#                    chronological order)
+#           chunk_minutes (length of the yielded chunks)
+#
+# Output: yields DataFrames of at most chunk_minutes rows of the 1-minute grid
+#
+#################################################################################
+
+def stream_minutes(records, chunk_minutes):
+
+    step = pd.Timedelta(minutes=1)
+    buffer = None
+    next_minute = None
+
+    for frame in records:
+        if len(frame) == 0:
+            continue
+        buffer = frame if buffer is None else pd.concat([buffer, frame])
+        if next_minute is None:
+            next_minute = buffer.index[0].floor('min')
+
+        # Grid minutes up to the last record are final: their neighbouring records are all in the buffer
+        last_minute = buffer.index[-1].floor('min')
+        while next_minute + (chunk_minutes - 1)*step <= last_minute:
+            yield _interpolate_window(buffer, next_minute, next_minute + (chunk_minutes - 1)*step)
+            next_minute = next_minute + chunk_minutes*step
+
+        # Keep the records from the last one at or before the next grid minute
+        first_kept = max(0, buffer.index.searchsorted(next_minute, side='right') - 1)
+        buffer = buffer.iloc[first_kept:]
+
+    if buffer is not None:
+        last_minute = buffer.index[-1].floor('min')
+        while next_minute <= last_minute:
+            yield _interpolate_window(buffer, next_minute, min(last_minute, next_minute + (chunk_minutes - 1)*step))
+            next_minute = next_minute + chunk_minutes*step
+
+
+# 1-minute interpolation of the grid minutes first..last from the buffered records around them
+def _interpolate_window(buffer, first, last):
+
+    lower = max(0, buffer.index.searchsorted(first, side='right') - 1)
+    upper = buffer.index.searchsorted(last, side='left') + 1
+    window = buffer.iloc[lower:upper]
+
+    interpolated = window.resample('1min').interpolate(method='linear')
+
+    return interpolated.loc[first:last]
@@ -97,7 +97,7 @@ def generictf(flow_df, min_flow, max_flow, radius, efficiency, flow_unit='feet/s
 	power_df = pd.DataFrame()
 
 	# Converts flow velocity time series in instantaneous power time series
-	power_df['power'] = flow_df.flow.apply(lambda x: transferfunction(x, flow_unit, min_flow, max_flow, radius, efficiency, fluid_density))
+	power_df['power'] = pd.Series(generictf_power(flow_df.flow, min_flow, max_flow, radius, efficiency, flow_unit=flow_unit, fluid_density=fluid_density), index=flow_df.index)
 
 	# Checks if verbose is true and prints average power generation
 	if verbose==True:
@@ -253,7 +253,7 @@ def waterlilyv2(flow_df, flow_unit='feet/sec', fluid_density=1000, verbose=False
 	power_df = pd.DataFrame()
 
 	# Converts flow velocity time series in instantaneous power time series
-	power_df['power'] = flow_df.flow.apply(lambda x: transferfunction2(x, flow_unit, min_flow, max_flow, fluid_density))
+	power_df['power'] = pd.Series(waterlilyv2_power(flow_df.flow, flow_unit=flow_unit, fluid_density=fluid_density), index=flow_df.index)
 
 	# Checks if verbose is true and prints average power generation
 	if verbose==True:
@@ -261,4 +261,324 @@ def waterlilyv2(flow_df, flow_unit='feet/sec', fluid_density=1000, verbose=False
 		print("Average power generation: "+"{0:.4f}".format(power_df['power'].mean())+" Watts")
 
 	# Returns generated power dataframe
-	return power_df
\ No newline at end of file
+	return power_df
+
+
+
+#################################################################################
+#
+# Function: generictf_power
+#
+# Description: Array version of the generic turbine transfer function. The
+#			   whole flow velocity series is converted at once with masked array
+#			   arithmetic instead of one call per sample
+#
+# Input:    flow (scalar, NumPy array or pandas Series of flow velocities, float32 or
+#				  float64, used without copying)
+#			min_flow
+#			max_flow
+#			radius
+#			efficiency
+#
+# Optional: flow_unit
+#			fluid_density
+#
+# Output: returns the instantaneous power time series as a float64 NumPy array
+#		  of the same shape as flow
+#
+#################################################################################
+
+def generictf_power(flow, min_flow, max_flow, radius, efficiency, flow_unit='feet/sec', fluid_density=1000):
+
+	# Imports library dependencies
+	import numpy as np
+
+	# Checks if flow velocity units are valid and gets the conversion factor to meters/s
+	if flow_unit=='feet/sec':
+		to_ms = 0.3048
+	else:
+		if flow_unit=='meters/sec':
+			to_ms = None
+		else:
+			# If flow unit is not feet/sec nor meters/sec
+			raise NameError("Error: flow velocity unit "+flow_unit+" is not currently supported")
+
+	# Scalars and 0-d inputs are handled as one element series and reshaped back on return
+	abs_flow = np.abs(np.asarray(flow), dtype=np.float64)
+	shape = abs_flow.shape
+	abs_flow = np.atleast_1d(abs_flow)
+
+	# Flow velocity in meters/s
+	if to_ms is None:
+		v_ms = abs_flow
+		max_v_ms = abs(max_flow)
+	else:
+		v_ms = abs_flow*to_ms
+		max_v_ms = abs(max_flow)*to_ms
+
+	# Saturated max power, computed once for the whole series
+	max_power = (efficiency*(fluid_density)*3.14159*(radius**2)*(max_v_ms**3))/2
+
+	# Power from transfer function considering incompressible fluid, saturated above max flow and zero below min flow
+	power = (efficiency*(fluid_density)*3.14159*(radius**2)*np.float_power(v_ms, 3))/2
+	power[abs_flow >= max_flow] = max_power
+	power[~(abs_flow > min_flow)] = 0
+
+	return power.reshape(shape)
+
+
+
+#################################################################################
+#
+# Function: waterlilyv2_power
+#
+# Description: Array version of the second Water Lily turbine transfer
+#			   function. The whole flow velocity series is converted at once
+#			   with masked array arithmetic instead of one call per sample
+#
+# Input:    flow (scalar, NumPy array or pandas Series of flow velocities, float32 or
+#				  float64, used without copying)
+#
+# Optional: flow_unit
+#			fluid_density
+#
+# Output: returns the instantaneous power time series as a float64 NumPy array
+#		  of the same shape as flow
+#
+#################################################################################
+
+def waterlilyv2_power(flow, flow_unit='feet/sec', fluid_density=1000):
+
+	# Imports library dependencies
+	import numpy as np
+
+	if flow_unit=='feet/sec':
+		# Turbine parameters
+		min_flow = 1.6586 # in feet per second (1.82 Km/h)
+		max_flow = 10.4804 # in feet per second (11.5 Km/h)
+		to_kmh = 1.09728
+	else:
+		if flow_unit=='meters/sec':
+			# Turbine parameters
+			min_flow = 0.5056 # in meters per second (1.82 Km/h)
+			max_flow = 3.1944 # in meters per second (11.5 Km/h)
+			to_kmh = 3.6
+		else:
+			# If flow unit is not feet/sec nor meters/sec
+			raise NameError("Error: flow velocity unit "+flow_unit+" is not currently supported")
+
+	# Scalars and 0-d inputs are handled as one element series and reshaped back on return
+	abs_flow = np.abs(np.asarray(flow), dtype=np.float64)
+	shape = abs_flow.shape
+	abs_flow = np.atleast_1d(abs_flow)
+
+	# Flow velocity in Km/h
+	v_kmh = abs_flow*to_kmh
+	max_v_kmh = abs(max_flow)*to_kmh
+
+	# Saturated max power, computed once for the whole series
+	max_power = (fluid_density/1000)*(0.1056*(max_v_kmh**2)+0.0669*(max_v_kmh)-0.4709)
+
+	# Power from manufacturer's curve proportional to fluid density, saturated above max flow and zero below min flow
+	power = (fluid_density/1000)*(0.1056*np.float_power(v_kmh, 2)+0.0669*(v_kmh)-0.4709)
+	power[abs_flow >= max_flow] = max_power
+	power[~(abs_flow > min_flow)] = 0
+
+	return power.reshape(shape)
+
+
+#################################################################################
+#
+# Class: TurbineCurve
+#
+# Description: Flow velocity to power curve of a turbine precomputed once as a
+#			   dense lookup table. Converting a flow series is then a single
+#			   gather with linear interpolation between table entries, which
+#			   makes screening many candidate turbines cheap. Curves are built
+#			   from the turbine models in this module (generictf_curve,
+#			   waterlilyv1_curve, waterlilyv2_curve) or from digitized
+#			   manufacturer curve points (TurbineCurve.from_points), and can be
+#			   stored on disk with save/load. With a tolerance, from_function
+#			   refines the table spacing until the linear interpolation stays
+#			   within the tolerance of the transfer function between entries.
+#
+# Input:    table (power in Watts at evenly spaced flow velocities from min_flow
+#				   to max_flow, both included)
+#			min_flow (flow velocity at or below which no power is generated)
+#			max_flow (flow velocity at or above which the output is saturated)
+#
+# Optional: flow_unit
+#			name
+#
+#################################################################################
+
+class TurbineCurve:
+
+	def __init__(self, table, min_flow, max_flow, flow_unit='feet/sec', name=''):
+
+		# Imports library dependencies
+		import numpy as np
+
+		if flow_unit not in ('feet/sec', 'meters/sec'):
+			# If flow unit is not feet/sec nor meters/sec
+			raise NameError("Error: flow velocity unit "+flow_unit+" is not currently supported")
+
+		self.table = np.ascontiguousarray(table, dtype=np.float64)
+		if self.table.ndim != 1 or len(self.table) < 2:
+			raise ValueError("Error: a turbine curve table needs at least two entries")
+
+		self.min_flow = float(min_flow)
+		self.max_flow = float(max_flow)
+		self.flow_unit = flow_unit
+		self.name = name
+
+		# Flow velocity spacing of the table and slope between consecutive entries (flat after saturation)
+		self.step = (self.max_flow - self.min_flow)/(len(self.table) - 1)
+		self.slope = np.append(np.diff(self.table), 0.0)
+
+	@classmethod
+	def from_function(cls, transfer, min_flow, max_flow, step=0.001, flow_unit='feet/sec', name='', tolerance=None):
+
+		# Imports library dependencies
+		import numpy as np
+
+		while True:
+			# Table spacing is adjusted so that both the cut-in and the saturation flow fall on table entries
+			n = max(int(np.ceil((max_flow - min_flow)/step)), 1)
+			flow = np.linspace(min_flow, max_flow, n + 1)
+
+			# The first entry is the power right above the cut-in flow velocity
+			flow[0] = np.nextafter(min_flow, np.inf)
+			table = transfer(flow)
+
+			if tolerance is None:
+				break
+
+			# Interpolation error is largest halfway between entries, the spacing is halved until it is within tolerance
+			error = np.max(np.abs((table[:-1] + table[1:])/2 - transfer((flow[:-1] + flow[1:])/2)))
+			if error <= tolerance:
+				break
+			if n >= 2**24:
+				raise ValueError("Error: turbine curve "+name+" does not reach the tolerance of "+str(tolerance)+" W")
+			step = (max_flow - min_flow)/(2*n)
+
+		return cls(table, min_flow, max_flow, flow_unit=flow_unit, name=name)
+
+	@classmethod
+	def from_points(cls, flow_points, power_points, min_flow=None, step=0.001, flow_unit='feet/sec', name=''):
+
+		# Imports library dependencies
+		import numpy as np
+
+		flow_points = np.asarray(flow_points, dtype=np.float64)
+		power_points = np.asarray(power_points, dtype=np.float64)
+		order = np.argsort(flow_points)
+		flow_points = flow_points[order]
+		power_points = power_points[order]
+
+		# Without an explicit cut-in velocity the turbine starts at the first digitized point
+		if min_flow is None:
+			min_flow = flow_points[0]
+
+		# Curve is linear between digitized points and saturated after the last one
+		transfer = lambda flow: np.interp(flow, flow_points, power_points, left=0.0)
+
+		return cls.from_function(transfer, min_flow, flow_points[-1], step=step, flow_unit=flow_unit, name=name)
+
+	@classmethod
+	def load(cls, path):
+
+		# Imports library dependencies
+		import numpy as np
+
+		with np.load(path) as data:
+			return cls(data['table'], data['min_flow'], data['max_flow'], flow_unit=str(data['flow_unit']), name=str(data['name']))
+
+	def save(self, path):
+
+		# Imports library dependencies
+		import numpy as np
+
+		np.savez(path, table=self.table, min_flow=self.min_flow, max_flow=self.max_flow, flow_unit=self.flow_unit, name=self.name)
+
+	def power(self, flow):
+
+		# Imports library dependencies
+		import numpy as np
+
+		# Scalars and 0-d inputs are handled as one element series and reshaped back on return
+		abs_flow = np.abs(np.asarray(flow), dtype=np.float64)
+		shape = abs_flow.shape
+		abs_flow = np.atleast_1d(abs_flow)
+
+		# Fractional table position, flows past the saturation flow (and NaN) are clipped to the last entry
+		position = np.fmin(np.fmax((abs_flow - self.min_flow)*(1/self.step), 0), len(self.table) - 1)
+		index = position.astype(np.intp)
+		power = self.table[index] + (position - index)*self.slope[index]
+
+		# Zero power below the turbine's minimum flow velocity
+		power[~(abs_flow > self.min_flow)] = 0
+
+		return power.reshape(shape)
+
+
+
+#################################################################################
+#
+# Function: generictf_curve, waterlilyv1_curve, waterlilyv2_curve
+#
+# Description: Build the lookup table curves of the turbine models above
+#
+# Input:    same turbine parameters as generictf (generictf_curve only)
+#
+# Optional: flow_unit
+#			fluid_density
+#			step (initial flow velocity spacing of the table)
+#			tolerance (largest interpolation error in Watts, the spacing is
+#					   refined until it is met)
+#
+# Output: returns a TurbineCurve
+#
+#################################################################################
+
+def generictf_curve(min_flow, max_flow, radius, efficiency, flow_unit='feet/sec', fluid_density=1000, step=0.001, tolerance=1e-6, name='generictf'):
+
+	transfer = lambda flow: generictf_power(flow, min_flow, max_flow, radius, efficiency, flow_unit=flow_unit, fluid_density=fluid_density)
+
+	return TurbineCurve.from_function(transfer, min_flow, max_flow, step=step, flow_unit=flow_unit, name=name, tolerance=tolerance)
+
+
+def waterlilyv1_curve(flow_unit='feet/sec', fluid_density=1000, step=0.001, tolerance=1e-6):
+
+	# Turbine parameters (see waterlilyv1)
+	if flow_unit=='feet/sec':
+		min_flow = 0.9113 # in feet per second (1 Km/h)
+		max_flow = 5.2858 # in feet per second (5.8 Km/h)
+	else:
+		if flow_unit=='meters/sec':
+			min_flow = 0.2778 # in meters per second (1 Km/h)
+			max_flow = 1.6111 # in meters per second (5.8 Km/h)
+		else:
+			# If flow unit is not feet/sec nor meters/sec
+			raise ValueError("Error: flow velocity unit "+flow_unit+" is not currently supported")
+
+	return generictf_curve(min_flow, max_flow, 0.09, 0.27815, flow_unit=flow_unit, fluid_density=fluid_density, step=step, tolerance=tolerance, name='waterlilyv1')
+
+
+def waterlilyv2_curve(flow_unit='feet/sec', fluid_density=1000, step=0.001, tolerance=1e-6):
+
+	# Turbine parameters (see waterlilyv2)
+	if flow_unit=='feet/sec':
+		min_flow = 1.6586 # in feet per second (1.82 Km/h)
+		max_flow = 10.4804 # in feet per second (11.5 Km/h)
+	else:
+		if flow_unit=='meters/sec':
+			min_flow = 0.5056 # in meters per second (1.82 Km/h)
+			max_flow = 3.1944 # in meters per second (11.5 Km/h)
+		else:
+			# If flow unit is not feet/sec nor meters/sec
+			raise ValueError("Error: flow velocity unit "+flow_unit+" is not currently supported")
+
+	transfer = lambda flow: waterlilyv2_power(flow, flow_unit=flow_unit, fluid_density=fluid_density)
+
+	return TurbineCurve.from_function(transfer, min_flow, max_flow, step=step, flow_unit=flow_unit, name='waterlilyv2', tolerance=tolerance)